@@ -0,0 +1,63 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+
+@dataclass
+class _MediaGroup:
+    messages: List[Message]
+    ready: asyncio.Future
+
+
+class MediaGroupMiddleware(BaseMiddleware):
+    """Собирает сообщения одного альбома (media_group_id) в один вызов обработчика.
+
+    Telegram присылает каждое фото альбома отдельным апдейтом. Первый из них
+    ждет остальные, пока их не наберется size или не пройдет timeout секунд,
+    и передает обработчику data['album'] - сообщения в порядке message_id.
+    Остальные апдейты альбома, в том числе опоздавшие, обработчик не вызывают.
+    Апдейты одного альбома должны обрабатываться параллельно.
+    """
+
+    def __init__(self, *, size: int = 2, timeout: float = 1.0, remember: int = 10000):
+        self.size = size
+        self.timeout = timeout
+        self.remember = remember
+        self._groups: Dict[Tuple[int, str], _MediaGroup] = {}
+        # Уже обработанные альбомы: их опоздавшие сообщения отбрасываются
+        self._done: "OrderedDict[Tuple[int, str], None]" = OrderedDict()
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        if event.media_group_id is None:
+            return await handler(event, data)
+        key = (event.chat.id, event.media_group_id)
+        group = self._groups.get(key)
+        if group is not None:
+            group.messages.append(event)
+            if len(group.messages) >= self.size and not group.ready.done():
+                group.ready.set_result(None)
+            return None
+        if key in self._done:
+            return None
+
+        group = self._groups[key] = _MediaGroup([event], asyncio.get_running_loop().create_future())
+        try:
+            await asyncio.wait_for(group.ready, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            del self._groups[key]
+            self._done[key] = None
+            while len(self._done) > self.remember:
+                self._done.popitem(last=False)
+        data['album'] = sorted(group.messages, key=lambda message: message.message_id)
+        return await handler(event, data)
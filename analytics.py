@@ -0,0 +1,217 @@
+"""Поток аналитических событий: рекомендации размеров и обратная связь.
+
+Обработчики только кладут событие в кольцевой буфер в памяти; фоновая
+задача раз в flush_interval секунд (или раньше, когда набралась пачка)
+забирает все накопленное и пишет одной пачкой в отдельном потоке -
+в сжатые JSONL-файлы с ротацией или в SQLite. Если запись не успевает,
+буфер вытесняет самые старые события, а не тормозит обработчики.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# (время, тип, user_id, поля)
+Event = Tuple[float, str, int, Dict[str, Any]]
+
+
+class EventWriter(ABC):
+    """Приемник пачек событий; методы вызываются в потоке записи"""
+
+    def open(self) -> None:
+        """Открывает файл"""
+
+    def close(self) -> None:
+        """Дописывает и закрывает файл"""
+
+    @abstractmethod
+    def write(self, events: List[Event]) -> None:
+        """Записывает пачку событий"""
+
+
+class JsonlWriter(EventWriter):
+    """JSONL в gzip; новый файл по достижении rotate_bytes несжатых данных или в новые сутки (UTC).
+
+    В имени файла есть pid, поэтому воркеры runner.py пишут каждый в свой файл.
+    """
+
+    def __init__(self, directory: str, *, prefix: str = 'events', rotate_bytes: int = 64 << 20):
+        self.directory = directory
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self._file: Optional[gzip.GzipFile] = None
+        self._day = ''
+        self._written = 0
+
+    def _rotate(self, day: str) -> None:
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{os.getpid()}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), 'ab')
+        self._day = day
+        self._written = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, events: List[Event]) -> None:
+        lines = []
+        for ts, event_type, user_id, fields in events:
+            record = {'ts': round(ts, 3), 'type': event_type, 'user_id': user_id}
+            record.update(fields)
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        data = ('\n'.join(lines) + '\n').encode()
+        day = time.strftime('%Y%m%d', time.gmtime(events[-1][0]))
+        if self._file is None or day != self._day or self._written >= self.rotate_bytes:
+            self._rotate(day)
+        self._file.write(data)
+        # Пачка дожимается до диска: при падении теряется не больше одной пачки
+        self._file.flush()
+        self._written += len(data)
+
+
+class SQLiteEventWriter(EventWriter):
+    """Таблица events в SQLite (WAL); удобно для разовых выборок без распаковки файлов"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self) -> None:
+        # Воркеры runner.py пишут в один файл: ждем блокировку, а не падаем
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events "
+            "(ts REAL NOT NULL, type TEXT NOT NULL, user_id INTEGER NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS events_type_ts ON events (type, ts)")
+        self._conn.commit()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def write(self, events: List[Event]) -> None:
+        self._conn.executemany(
+            "INSERT INTO events (ts, type, user_id, data) VALUES (?, ?, ?, ?)",
+            [(ts, event_type, user_id, json.dumps(fields, ensure_ascii=False))
+             for ts, event_type, user_id, fields in events],
+        )
+        self._conn.commit()
+
+
+def create_writer(kind: str, path: str, *, rotate_bytes: int = 64 << 20) -> Optional[EventWriter]:
+    """Приемник событий по ANALYTICS_BACKEND; None - аналитика выключена"""
+    if kind == 'off':
+        return None
+    if kind == 'jsonl':
+        return JsonlWriter(path or 'analytics', rotate_bytes=rotate_bytes)
+    if kind == 'sqlite':
+        return SQLiteEventWriter(path or 'analytics.db')
+    raise ValueError(f"ANALYTICS_BACKEND должен быть jsonl, sqlite или off, получено: {kind}")
+
+
+class AnalyticsSink:
+    """Кольцевой буфер событий и фоновая пакетная запись.
+
+    emit() не делает ввода-вывода: только добавляет кортеж в deque.
+    Сериализация, сжатие и запись идут в одном потоке вне event loop.
+    """
+
+    def __init__(self, writer: Optional[EventWriter], *, capacity: int = 100000,
+                 flush_interval: float = 1.0, batch_size: int = 1000):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer: Deque[Event] = deque(maxlen=capacity)
+        self._batch_ready = asyncio.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self.emitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def emit(self, event_type: str, user_id: int, **fields: Any) -> None:
+        """Кладет событие в буфер; при переполнении вытесняется самое старое"""
+        if self.writer is None:
+            return
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append((time.time(), event_type, user_id, fields))
+        self.emitted += 1
+        if len(buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def start(self) -> None:
+        """Открывает приемник и запускает фоновую запись"""
+        if self.writer is None or self._flusher is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics")
+        await self._run(self.writer.open)
+        self._flusher = asyncio.create_task(self._flush_loop(), name="analytics-flusher")
+
+    async def close(self) -> None:
+        """Дописывает буфер и закрывает приемник"""
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        await self.flush()
+        await self._run(self.writer.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def flush(self) -> None:
+        """Записывает все накопленное одной пачкой"""
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        self._batch_ready.clear()
+        try:
+            await self._run(self.writer.write, batch)
+        except Exception as e:
+            # Повтор той же пачки упрется в ту же ошибку (например, диск
+            # заполнен), а буфер тем временем вытеснял бы свежие события
+            self.failed += len(batch)
+            logging.error(f"Ошибка записи аналитики, потеряно событий: {len(batch)}: {e}")
+            return
+        self.written += len(batch)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'buffered': len(self._buffer),
+            'emitted': self.emitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
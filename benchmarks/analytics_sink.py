@@ -0,0 +1,76 @@
+"""Время обработчика на запись события аналитики: буфер AnalyticsSink против записи в файл прямо в обработчике.
+
+Для каждого приемника (jsonl, sqlite) события пишутся двумя способами:
+синхронно в обработчике (сериализация, запись и flush/commit на каждое
+событие, как сделал бы наивный код) и через emit() с фоновой пачечной
+записью. Печатается время на событие внутри обработчика и общее время
+до того, как все события лежат на диске.
+
+    python benchmarks/analytics_sink.py [--events 20000]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from analytics import AnalyticsSink, create_writer  # noqa: E402
+
+FIELDS = {
+    'size': '80B EU (36B US)', 'model': 'SENS SoftTouch Classic (беж), код 12345678', 'source': 'quiz',
+    'answers': {'underbust': 78, 'bust': 92, 'bra_type': 'classic', 'priority': 'comfort'},
+}
+
+
+def run_direct(kind: str, path: str, count: int) -> float:
+    writer = create_writer(kind, path)
+    writer.open()
+    started = time.perf_counter()
+    for i in range(count):
+        writer.write([(time.time(), 'recommendation', i, FIELDS)])
+    elapsed = time.perf_counter() - started
+    writer.close()
+    return elapsed
+
+
+async def run_sink(kind: str, path: str, count: int) -> tuple:
+    sink = AnalyticsSink(create_writer(kind, path), flush_interval=0.05)
+    await sink.start()
+    handler_time = 0.0
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        sink.emit('recommendation', i, **FIELDS)
+        handler_time += time.perf_counter() - t0
+        if i % 100 == 0:
+            # Обработчики отдают управление циклу между апдейтами
+            await asyncio.sleep(0)
+    await sink.close()
+    return handler_time, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+    count = args.events
+
+    directory = tempfile.mkdtemp(prefix='analytics-bench-')
+    try:
+        print(f"events={count}")
+        print(f"{'приемник':>9} {'способ':>8} {'мкс в обработчике':>18} {'всего, с':>9}")
+        for kind in ('jsonl', 'sqlite'):
+            direct = run_direct(kind, os.path.join(directory, f'direct-{kind}'), count)
+            handler, total = asyncio.run(run_sink(kind, os.path.join(directory, f'sink-{kind}'), count))
+            print(f"{kind:>9} {'напрямую':>8} {direct / count * 1e6:18.2f} {direct:9.2f}")
+            print(f"{kind:>9} {'буфер':>8} {handler / count * 1e6:18.2f} {total:9.2f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
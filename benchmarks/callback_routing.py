@@ -0,0 +1,124 @@
+"""Стоимость маршрутизации одного нажатия кнопки: старые lambda-фильтры
+против таблицы CallbackRouter.
+
+Оба варианта прогоняются через настоящий TelegramEventObserver aiogram,
+обработчики пустые, поэтому измеряется только выбор обработчика и разбор
+callback_data. Нажатия равномерно распределены по всем кнопкам сценария.
+
+    python benchmarks/callback_routing.py [--callbacks 100000] [--rate 10000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Any, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiogram import Router  # noqa: E402
+from aiogram.types import CallbackQuery, User  # noqa: E402
+
+from callbacks import (  # noqa: E402
+    BraTypeCallback, BreastShapeCallback, CalculateCallback, CallbackRouter, ComfortableCallback,
+    ConsentCallback, DataConsentCallback, FeedbackCallback, MethodCallback, PriorityCallback,
+    SkinToneCallback, StartPhotoCallback,
+)
+
+# Фильтры в том порядке, в котором они были зарегистрированы в bot.py
+LEGACY_EXACT = [
+    'consent_no', 'consent_yes', 'data_consent_no', 'data_consent_yes',
+    'method_photo', 'start_photo_process', 'method_quiz',
+]
+LEGACY_PREFIX = [
+    ('quiz_comfortable_', 2), ('breast_shape_', 2), ('bra_type_', 2), ('priority_', 1), ('skin_tone_', 2),
+]
+LEGACY_TAIL = [('exact', 'quiz_calculate'), ('prefix', ('feedback_', 1))]
+
+
+async def noop(callback: CallbackQuery, **kwargs: Any) -> None:
+    pass
+
+
+def legacy_router() -> Router:
+    router = Router()
+
+    def exact(value: str):
+        router.callback_query.register(noop, lambda c: c.data == value)
+
+    def prefix(value: str, index: int):
+        async def handler(callback: CallbackQuery) -> None:
+            callback.data.split("_")[index]
+        router.callback_query.register(handler, lambda c: c.data.startswith(value))
+
+    for value in LEGACY_EXACT:
+        exact(value)
+    for value, index in LEGACY_PREFIX:
+        prefix(value, index)
+    exact(LEGACY_TAIL[0][1])
+    prefix(*LEGACY_TAIL[1][1])
+    return router
+
+
+def table_router() -> Tuple[Router, CallbackRouter]:
+    router = Router()
+    table = CallbackRouter()
+    for schema, legacy in (
+        (ConsentCallback, 'consent_{answer}'), (DataConsentCallback, 'data_consent_{answer}'),
+        (MethodCallback, 'method_{method}'), (StartPhotoCallback, 'start_photo_process'),
+        (ComfortableCallback, 'quiz_comfortable_{answer}'), (BreastShapeCallback, 'breast_shape_{shape}'),
+        (BraTypeCallback, 'bra_type_{bra_type}'), (PriorityCallback, 'priority_{priority}'),
+        (SkinToneCallback, 'skin_tone_{tone}'), (CalculateCallback, 'quiz_calculate'),
+        (FeedbackCallback, 'feedback_{result}'),
+    ):
+        table.route(schema, legacy=legacy)(noop)
+    table.attach(router)
+    return router, table
+
+
+def make_callbacks(data: List[str], count: int) -> List[CallbackQuery]:
+    user = User(id=1, is_bot=False, first_name='User')
+    return [
+        CallbackQuery(id=str(i), from_user=user, chat_instance='1', data=data[i % len(data)])
+        for i in range(count)
+    ]
+
+
+async def measure(router: Router, callbacks: List[CallbackQuery]) -> float:
+    """Среднее время маршрутизации одного нажатия, секунды"""
+    trigger = router.callback_query.trigger
+    for callback in callbacks[:1000]:
+        await trigger(callback)
+    started = time.perf_counter()
+    for callback in callbacks:
+        await trigger(callback)
+    return (time.perf_counter() - started) / len(callbacks)
+
+
+async def run(count: int, rate: int) -> None:
+    router, table = table_router()
+    # Старые кнопки шлют старые строки, новые - упакованные CallbackData
+    new_data = [callback_data.pack() for _, callback_data in table.routes.values()]
+    new_data = sorted(set(new_data))
+    legacy_data = sorted(set(table.routes) - set(new_data))
+
+    legacy = await measure(legacy_router(), make_callbacks(legacy_data, count))
+    routed = await measure(router, make_callbacks(new_data, count))
+
+    print(f"callbacks={count} buttons={len(new_data)}")
+    for name, cost in (('lambda filters', legacy), ('CallbackRouter', routed)):
+        print(f"{name:>15}: {cost * 1e6:7.2f} мкс/нажатие, "
+              f"при {rate} нажатий/с занято {cost * rate * 100:5.1f}% одного ядра")
+    print(f"ускорение: {legacy / routed:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--callbacks', type=int, default=100_000)
+    parser.add_argument('--rate', type=int, default=10_000, help='целевая нагрузка, нажатий в секунду')
+    args = parser.parse_args()
+    asyncio.run(run(args.callbacks, args.rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Накладные расходы диагностики на один апдейт: выключенной и включенной.
+
+Как и в metrics_overhead.py, HandlerTracer меряется отдельно от Dispatcher:
+тот же обработчик с одним span() внутри вызывается напрямую, через
+выключенный трассировщик, через включенный (с записью трассы в файл) и
+при работающем стороже loop. Лучший из нескольких прогонов.
+
+    python benchmarks/diagnostics_overhead.py [--updates 200000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiogram.dispatcher.event.handler import HandlerObject  # noqa: E402
+
+from diagnostics import Diagnostics, HandlerTracer  # noqa: E402
+
+
+async def handle_step(event: Any) -> None:
+    pass
+
+
+async def run(count: int, rounds: int, directory: str) -> None:
+    diagnostics = Diagnostics(directory)
+    tracer = diagnostics.tracer
+    data: Dict[str, Any] = {'handler': HandlerObject(handle_step)}
+
+    async def handler(event: Any, data: Dict[str, Any]) -> None:
+        with HandlerTracer.span('work'):
+            pass
+
+    async def direct() -> float:
+        started = time.perf_counter()
+        for i in range(count):
+            await handler(i, data)
+        return time.perf_counter() - started
+
+    async def traced() -> float:
+        started = time.perf_counter()
+        for i in range(count):
+            await tracer(handler, i, data)
+        return time.perf_counter() - started
+
+    modes = {
+        'direct': direct,
+        'tracer off': traced,
+        'tracer on': traced,
+        'watchdog on': traced,
+    }
+    best = dict.fromkeys(modes, float('inf'))
+    # Лучший из нескольких прогонов: так меньше влияет шум планировщика ОС
+    for _ in range(rounds):
+        for name, measure in modes.items():
+            diagnostics.set_trace(name == 'tracer on')
+            diagnostics.set_slow(name == 'watchdog on')
+            best[name] = min(best[name], await measure())
+    await diagnostics.close()
+    print(f"updates={count} rounds={rounds}")
+    for name, elapsed in best.items():
+        extra = (elapsed - best['direct']) / count * 1e6
+        print(f"{name:>12}: {elapsed / count * 1e6:6.2f} мкс/апдейт (+{extra:.2f})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='diagnostics-bench-') as directory:
+        asyncio.run(run(args.updates, args.rounds, directory))
+
+
+if __name__ == '__main__':
+    main()
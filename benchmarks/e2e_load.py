@@ -0,0 +1,266 @@
+"""Офлайн-прогон бота целиком на заглушках Telegram и Bodygram.
+
+Поднимает локальные заглушки Bot API (getUpdates, getFile, скачивание файла,
+sendMessage, editMessageText) и эндпоинта сканов Bodygram, запускает
+`python bot.py` в режиме long polling против них и проводит через бота
+тысячи пользователей по сценариям квиза и фото-скана (часть присылает оба
+фото одним альбомом). Задержку и долю ошибок заглушек можно задать.
+
+Задержка шага - от постановки апдейта в getUpdates до ответа, который видит
+пользователь: answerCallbackQuery для нажатия кнопки, последнее сообщение
+(не "⏳ ...") для текста и фото. scan - от второго фото до результата скана,
+album - от альбома до результата, то есть весь путь фото-скана. Пиковый RSS - VmHWM процесса бота, без
+процессов подготовки фото.
+
+Лимиты отправки Telegram в боте по умолчанию сняты, иначе прогон мерил бы
+их, а не бота; SEND_GLOBAL_RATE и другие можно задать в окружении.
+
+    python benchmarks/e2e_load.py [--users 2000] [--photo-share 0.3] [--concurrency 500]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from PIL import Image
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS, '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+
+from fake_bodygram import FakeBodygram  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from photo_preprocess import synthetic_photo  # noqa: E402
+from synthetic import ALBUM_FLOW, PHOTO_FLOW, QUIZ_FLOW, percentile, step_updates  # noqa: E402
+
+BOT_ENV = {
+    'TELEGRAM_BOT_TOKEN': '123456:BENCHMARK-TOKEN',
+    'BODYGRAM_API_KEY': 'benchmark',
+    'BODYGRAM_ORG_ID': 'benchmark',
+    'BOT_MODE': 'polling',
+    'STORAGE_BACKEND': 'memory',
+    'SCAN_CACHE_PATH': '',
+    'METRICS_PORT': '0',
+    # Аналитика включена, как в проде, но пишет не в рабочий каталог
+    'ANALYTICS_PATH': os.path.join(tempfile.gettempdir(), 'sensfit-e2e-analytics'),
+}
+# У заглушки нет лимитов рассылки, поэтому и планировщику бота они не нужны
+UNTHROTTLED_ENV = {
+    'SEND_GLOBAL_RATE': '1000000',
+    'SEND_CHAT_RATE': '1000',
+    'SEND_CHAT_BURST': '1000',
+}
+
+
+class ReplyTracker:
+    """Связывает вызовы Bot API с шагами, которые ждут ответа бота"""
+
+    def __init__(self):
+        self.callbacks: Dict[str, asyncio.Future] = {}
+        self.chats: Dict[int, asyncio.Future] = {}
+
+    def expect(self, kind: str, update: Dict[str, Any]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if kind == 'callback':
+            self.callbacks[update['callback_query']['id']] = future
+        else:
+            self.chats[update['message']['chat']['id']] = future
+        return future
+
+    def forget(self, kind: str, update: Dict[str, Any]) -> None:
+        if kind == 'callback':
+            self.callbacks.pop(update['callback_query']['id'], None)
+        else:
+            self.chats.pop(update['message']['chat']['id'], None)
+
+    def on_call(self, method: str, params: Dict[str, Any]) -> None:
+        if method == 'answerCallbackQuery':
+            future = self.callbacks.pop(params.get('callback_query_id'), None)
+        elif method in ('sendMessage', 'editMessageText') and not str(params.get('text', '')).startswith('⏳'):
+            future = self.chats.pop(int(params.get('chat_id', 0)), None)
+        else:
+            return
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+
+def jpeg_photos(width: int, height: int, count: int) -> List[bytes]:
+    """Разные JPEG: иначе кеш сканов отвечал бы всем по хешу первого фото"""
+    base = synthetic_photo(width, height, seed=1)
+    photos = []
+    for i in range(count):
+        photo = base.copy()
+        photo.paste(Image.effect_noise((64, 64), 32 + i).convert('RGB'), (i * 37 % (width - 64), i * 53 % (height - 64)))
+        output = io.BytesIO()
+        photo.save(output, format='JPEG', quality=87)
+        photos.append(output.getvalue())
+    return photos
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """utime + stime процесса"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def process_memory_mb(pid: int) -> Dict[str, float]:
+    """VmHWM (пик) и VmRSS процесса в МБ"""
+    result = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmHWM', 'VmRSS'):
+                result[key] = int(value.split()[0]) / 1024
+    return result
+
+
+async def start_bot(telegram: FakeTelegram, bodygram: FakeBodygram, log_path: str) -> asyncio.subprocess.Process:
+    env = dict(os.environ)
+    env.update(BOT_ENV)
+    env.update({'TELEGRAM_API_URL': telegram.base_url, 'BODYGRAM_API_URL': bodygram.url})
+    for key, value in UNTHROTTLED_ENV.items():
+        env.setdefault(key, value)
+    log = open(log_path, 'wb')
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, 'bot.py', cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    log.close()
+    # Бот готов, когда начал long polling
+    while not telegram.calls['getUpdates']:
+        if process.returncode is not None:
+            raise RuntimeError(f"bot.py завершился с кодом {process.returncode}, лог: {log_path}")
+        await asyncio.sleep(0.05)
+    return process
+
+
+async def stop_bot(process: asyncio.subprocess.Process) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(process.wait(), timeout=60)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def run(args: argparse.Namespace) -> None:
+    tracker = ReplyTracker()
+    telegram = FakeTelegram(latency=args.telegram_latency_ms / 1000, error_rate=args.telegram_error_rate,
+                            photos=jpeg_photos(*args.photo_size, args.photo_variants), on_call=tracker.on_call)
+    bodygram = FakeBodygram(latency=args.bodygram_latency_ms / 1000, error_rate=args.bodygram_error_rate)
+    await telegram.start()
+    await bodygram.start()
+    process = await start_bot(telegram, bodygram, args.bot_log)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    failures: Dict[str, int] = defaultdict(int)
+    updates = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    peak = {'VmHWM': 0.0, 'VmRSS': 0.0}
+
+    async def simulate(user_id: int, flow) -> None:
+        nonlocal updates
+        async with semaphore:
+            for kind, value in flow:
+                step_batch = step_updates(user_id, kind, value)
+                update = step_batch[0]
+                # Шаг фото-скана, после которого ждем результат, считаем отдельно
+                step = 'scan' if value == 'profile' else kind
+                reply = tracker.expect(kind, update)
+                started = time.perf_counter()
+                for item in step_batch:
+                    telegram.push(item)
+                updates += len(step_batch)
+                if kind == 'callback' and random.random() < args.double_tap:
+                    # Нетерпеливое повторное нажатие той же кнопки
+                    query = update['callback_query']
+                    telegram.push({'callback_query': dict(query, id=f"{query['id']}-again")})
+                    updates += 1
+                try:
+                    finished = await asyncio.wait_for(reply, timeout=args.step_timeout)
+                except asyncio.TimeoutError:
+                    tracker.forget(kind, update)
+                    failures[step] += 1
+                    return
+                latencies[step].append(finished - started)
+                await asyncio.sleep(random.uniform(0.5, 1.5) * args.think_ms / 1000)
+
+    def flow_for(index: int):
+        photo_users = args.users * args.photo_share
+        if index < photo_users * args.album_share:
+            return ALBUM_FLOW
+        return PHOTO_FLOW if index < photo_users else QUIZ_FLOW
+
+    async def watch_memory() -> None:
+        while True:
+            peak.update(process_memory_mb(process.pid))
+            await asyncio.sleep(0.5)
+
+    try:
+        # Прогрев: ленивые модели aiogram, пул подготовки фото, соединения
+        await asyncio.gather(simulate(1, QUIZ_FLOW), simulate(2, PHOTO_FLOW), simulate(3, ALBUM_FLOW))
+        latencies.clear()
+        failures.clear()
+        updates = 0
+        baseline = process_memory_mb(process.pid)
+        cpu_started = process_cpu_seconds(process.pid)
+
+        watcher = asyncio.create_task(watch_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate(100000 + i, flow_for(i)) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        cpu = process_cpu_seconds(process.pid) - cpu_started
+        watcher.cancel()
+        peak.update(process_memory_mb(process.pid))
+    finally:
+        await stop_bot(process)
+        await telegram.stop()
+        await bodygram.stop()
+
+    everything = [value for values in latencies.values() for value in values]
+    print(f"пользователей: {args.users} (фото {args.photo_share:.0%}, из них альбомом {args.album_share:.0%}), "
+          f"одновременно: {args.concurrency}")
+    print(f"апдейтов: {updates}, время: {elapsed:.2f} с, апдейтов/с: {updates / elapsed:.0f}, "
+          f"CPU бота: {cpu / updates * 1000:.2f} мс/апдейт")
+    print(f"{'шаг':>9} {'число':>7} {'p50 мс':>8} {'p99 мс':>8} {'сбоев':>6}")
+    for step in ('text', 'callback', 'photo', 'scan', 'album', 'все'):
+        values = everything if step == 'все' else latencies.get(step, [])
+        failed = sum(failures.values()) if step == 'все' else failures.get(step, 0)
+        print(f"{step:>9} {len(values):7d} {percentile(values, 50) * 1000:8.1f} "
+              f"{percentile(values, 99) * 1000:8.1f} {failed:6d}")
+    print(f"RSS бота: после прогрева {baseline['VmRSS']:.0f} МБ, пик {peak['VmHWM']:.0f} МБ")
+    print(f"вызовы Bot API: {dict(telegram.calls)}")
+    print(f"сканы Bodygram: {dict(bodygram.calls)}, принято {bodygram.bytes_received / 2 ** 20:.1f} МБ")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--photo-share', type=float, default=0.3, help='доля пользователей с фото-сканом')
+    parser.add_argument('--album-share', type=float, default=0.5, help='доля фото-пользователей, шлющих альбом')
+    parser.add_argument('--concurrency', type=int, default=500, help='одновременно активных пользователей')
+    parser.add_argument('--double-tap', type=float, default=0.0, help='доля нажатий кнопок, повторенных дважды')
+    parser.add_argument('--think-ms', type=float, default=50, help='средняя пауза между шагами пользователя')
+    parser.add_argument('--step-timeout', type=float, default=120, help='после этого шаг считается сбоем')
+    parser.add_argument('--telegram-latency-ms', type=float, default=5)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--bodygram-latency-ms', type=float, default=200)
+    parser.add_argument('--bodygram-error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--photo-size', type=int, nargs=2, default=(720, 1280), metavar=('W', 'H'))
+    parser.add_argument('--photo-variants', type=int, default=128, help='сколько разных фото отдает заглушка')
+    parser.add_argument('--bot-log', default=os.devnull, help='куда писать вывод bot.py')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
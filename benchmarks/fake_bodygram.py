@@ -0,0 +1,57 @@
+"""Локальная заглушка Bodygram API для бенчмарков.
+
+Принимает POST сканов, читает тело целиком (как настоящий сервер) и отвечает
+мерками в миллиметрах. Задержка и доля ошибок 503 настраиваются; бот
+подключается к ней через BODYGRAM_API_URL.
+"""
+import asyncio
+import random
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+
+class FakeBodygram:
+    """Заглушка эндпоинта сканов с задержкой и ошибками"""
+
+    def __init__(self, *, latency: float = 0.2, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: Counter = Counter()
+        self.bytes_received = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ''
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запускает сервер и возвращает URL эндпоинта сканов"""
+        app = web.Application(client_max_size=64 << 20)
+        app.router.add_post('/api/orgs/{org}/scans', self._scan)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}/api/orgs/benchmark/scans'
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _scan(self, request: web.Request) -> web.Response:
+        async for chunk in request.content.iter_chunked(1 << 16):
+            self.bytes_received += len(chunk)
+        if self.latency:
+            # Разброс времени обработки скана, как у настоящего API
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.calls['error'] += 1
+            return web.json_response({'error': 'Service Unavailable'}, status=503)
+        self.calls['ok'] += 1
+        underbust = random.uniform(680, 880)
+        bust = underbust + random.uniform(100, 220)
+        return web.json_response({'entry': {'measurements': [
+            {'name': 'underBustGirth', 'value': round(underbust), 'unit': 'mm'},
+            {'name': 'bustGirth', 'value': round(bust), 'unit': 'mm'},
+        ]}})
@@ -0,0 +1,123 @@
+"""Локальная заглушка Redis для бенчмарков и проверки RedisBackend.
+
+Понимает протокол RESP и команды, которые шлет RedisBackend: AUTH, SELECT,
+GET, MGET, SET, MSET, DEL, PING и FLUSHDB. Данные - словари в памяти по
+номеру базы; команды считаются. Бот подключается к ней через
+STORAGE_BACKEND=redis и STORAGE_URL=redis://127.0.0.1:port/db.
+"""
+import asyncio
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Union
+
+Reply = Union[None, int, bytes, str, List[Optional[bytes]], Exception]
+
+
+class FakeRedis:
+    """Заглушка сервера Redis: ключи в памяти, необязательный пароль"""
+
+    def __init__(self, *, password: Optional[str] = None):
+        self.password = password.encode() if password else None
+        self.data: Dict[int, Dict[bytes, bytes]] = defaultdict(dict)
+        self.calls: Counter = Counter()
+        self.connections = 0
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.url = ''
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запускает сервер и возвращает redis:// URL без номера базы"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f'redis://{host}:{port}'
+        return self.url
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def drop_connections(self) -> None:
+        """Рвет открытые соединения, как при перезапуске сервера"""
+        for writer in list(self._writers):
+            writer.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        state = {'db': 0, 'authed': self.password is None}
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                writer.write(self._encode(self._execute(state, command)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if line[:1] != b'*':
+            # Inline-команда, например PING из redis-cli или nc
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            length = int(header[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _execute(self, state: dict, command: List[bytes]) -> Reply:
+        name, args = command[0].upper().decode(), command[1:]
+        self.calls[name] += 1
+        if name == 'AUTH':
+            if self.password is None or args[-1] != self.password:
+                return ValueError('WRONGPASS invalid username-password pair')
+            state['authed'] = True
+            return 'OK'
+        if not state['authed']:
+            return ValueError('NOAUTH Authentication required.')
+        db = self.data[state['db']]
+        if name == 'PING':
+            return 'PONG'
+        if name == 'SELECT':
+            state['db'] = int(args[0])
+            return 'OK'
+        if name == 'GET':
+            return db.get(args[0])
+        if name == 'MGET':
+            return [db.get(key) for key in args]
+        if name == 'SET':
+            db[args[0]] = args[1]
+            return 'OK'
+        if name == 'MSET':
+            if not args or len(args) % 2:
+                return ValueError("ERR wrong number of arguments for 'mset' command")
+            db.update(zip(args[::2], args[1::2]))
+            return 'OK'
+        if name == 'DEL':
+            return sum(db.pop(key, None) is not None for key in args)
+        if name == 'FLUSHDB':
+            db.clear()
+            return 'OK'
+        return ValueError(f"ERR unknown command '{name.lower()}'")
+
+    @classmethod
+    def _encode(cls, reply: Reply) -> bytes:
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, Exception):
+            return b'-%s\r\n' % str(reply).encode()
+        if isinstance(reply, str):
+            return b'+%s\r\n' % reply.encode()
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, bytes):
+            return b'$%d\r\n%s\r\n' % (len(reply), reply)
+        return b'*%d\r\n' % len(reply) + b''.join(cls._encode(item) for item in reply)
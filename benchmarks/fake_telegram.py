@@ -0,0 +1,141 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков.
+
+Отвечает на методы, которые вызывает бот, валидными объектами и считает
+вызовы. Бот подключается к ней через TelegramAPIServer.from_base(base_url)
+(TELEGRAM_API_URL для bot.py). Апдейты для long polling кладутся через push().
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+import zlib
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, Optional, Sequence
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    """Заглушка Bot API с настраиваемой задержкой и долей ошибок.
+
+    Ошибки (429 с retry_after) выдаются только на запросы бота к чатам и
+    файлам: getUpdates и getMe отвечают всегда, чтобы прогон не застревал,
+    answerCallbackQuery - потому что под лимиты рассылки он не попадает.
+    """
+
+    NO_ERRORS = frozenset({'getUpdates', 'getMe', 'answerCallbackQuery'})
+
+    def __init__(self, *, latency: float = 0.0, error_rate: float = 0.0, photo_size: int = 200_000,
+                 photos: Optional[Sequence[bytes]] = None,
+                 on_call: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        # Файл для file_id выбирается по его хешу: разные фото - разные байты
+        self.photos = list(photos) if photos else [os.urandom(photo_size)]
+        # Вызывается на каждый метод Bot API с его параметрами
+        self.on_call = on_call
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._updates: Deque[Dict[str, Any]] = deque()
+        self._new_updates = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ''
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запускает сервер и возвращает его базовый URL"""
+        app = web.Application(client_max_size=64 << 20)
+        app.router.add_post('/bot{token}/{method}', self._method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self._file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push(self, update: Dict[str, Any]) -> None:
+        """Отдает апдейт боту через getUpdates; update_id назначается по порядку постановки"""
+        update['update_id'] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def _get_updates(self, params: Dict[str, Any]) -> Any:
+        """Long polling: подтвержденные offset апдейты удаляются, пустой ответ ждет timeout"""
+        offset = int(params.get('offset') or 0)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return list(itertools.islice(self._updates, limit))
+
+    def _photo(self, file_id: str) -> bytes:
+        return self.photos[zlib.crc32(file_id.encode()) % len(self.photos)]
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == 'application/json':
+            return await request.json()
+        return dict(await request.post())
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get('chat_id', 0))
+        message_id = int(params['message_id']) if 'message_id' in params else next(self._message_ids)
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = await self._params(request)
+        if method == 'getUpdates':
+            return self._json(await self._get_updates(params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and method not in self.NO_ERRORS and random.random() < self.error_rate:
+            return web.json_response(
+                {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                 'parameters': {'retry_after': 1}},
+                status=429,
+            )
+
+        if method in ('sendMessage', 'editMessageText'):
+            result: Any = self._message(params)
+        elif method == 'getFile':
+            file_id = params.get('file_id', 'photo')
+            result = {'file_id': file_id, 'file_unique_id': f'u_{file_id}',
+                      'file_size': len(self._photo(file_id)), 'file_path': f'photos/{file_id}.jpg'}
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'SENS Fit', 'username': 'sens_fit_bot'}
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook и прочее
+            result = True
+        if self.on_call is not None:
+            self.on_call(method, params)
+        return self._json(result)
+
+    @staticmethod
+    def _json(result: Any) -> web.Response:
+        return web.Response(text=json.dumps({'ok': True, 'result': result}), content_type='application/json')
+
+    async def _file(self, request: web.Request) -> web.Response:
+        self.calls['file'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        file_id = request.match_info['path'].rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        return web.Response(body=self._photo(file_id), content_type='image/jpeg')
@@ -0,0 +1,107 @@
+"""Время обработчика на запись в лог: StreamHandler в event loop против LogPipeline.
+
+Лог пишется в pipe, который читает отдельный процесс с задержкой после
+каждого куска (как занятый сборщик логов). Каждый апдейт пишет строку
+"Update id=... is handled", каждый двадцатый - еще и предупреждение с
+телом ответа API в 5 КБ. Печатается время записи в лог внутри обработчика
+(p50/p99/макс) и общее время до того, как все записи выведены.
+
+Режимы:
+  sync          - logging.basicConfig(stream=...), как было: формат и запись в обработчике
+  queue         - LogPipeline без выборки: формат и запись в потоке записи
+  queue+sample  - LogPipeline с выборкой 20 записей INFO в секунду с одной строки
+                  (предупреждения с телом ответа пишутся все)
+
+    python benchmarks/logging_pipeline.py [--updates 20000] [--reader-delay-ms 2]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from log_pipeline import LogPipeline, log_context  # noqa: E402
+
+READER = (
+    "import sys, time\n"
+    "delay = float(sys.argv[1]) / 1000\n"
+    "while sys.stdin.buffer.read1(65536):\n"
+    "    time.sleep(delay)\n"
+)
+
+RESPONSE_BODY = '{"error": "upstream timeout", "trace": "' + 'x' * 5000 + '"}'
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def handle_updates(updates: int, concurrency: int) -> list:
+    latencies = []
+
+    async def user(index: int) -> None:
+        for update_id in range(index, updates, concurrency):
+            started = time.perf_counter()
+            with log_context(update_id=update_id, user_id=index):
+                logging.info(f"Update id={update_id} is handled. Duration 12 ms by bot id=1")
+                if update_id % 20 == 0:
+                    logging.warning(f"Bodygram API вернул 503: {RESPONSE_BODY}")
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    return latencies
+
+
+def run(mode: str, updates: int, concurrency: int, reader_delay_ms: float) -> dict:
+    reader = subprocess.Popen([sys.executable, '-c', READER, str(reader_delay_ms)], stdin=subprocess.PIPE)
+    stream = io.TextIOWrapper(reader.stdin, encoding='utf-8')
+    root = logging.getLogger()
+    pipeline = None
+    if mode == 'sync':
+        handler = logging.StreamHandler(stream)
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+    else:
+        pipeline = LogPipeline(sample_rate=20 if mode == 'queue+sample' else 0, queue_size=updates * 2)
+        pipeline.install(stream=stream)
+    started = time.perf_counter()
+    latencies = asyncio.run(handle_updates(updates, concurrency))
+    handled = time.perf_counter() - started
+    if pipeline is not None:
+        pipeline.close()
+    root.handlers = []
+    stream.close()
+    reader.wait()
+    return {
+        'p50_us': percentile(latencies, 0.5) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'max_ms': max(latencies) * 1e3,
+        'handled_s': handled,
+        'total_s': time.perf_counter() - started,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--reader-delay-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"updates={args.updates} concurrency={args.concurrency} reader_delay={args.reader_delay_ms} мс")
+    print(f"{'режим':>13} {'p50, мкс':>9} {'p99, мкс':>9} {'макс, мс':>9} {'апдейты, с':>11} {'всего, с':>9}")
+    for mode in ('sync', 'queue', 'queue+sample'):
+        result = run(mode, args.updates, args.concurrency, args.reader_delay_ms)
+        print(f"{mode:>13} {result['p50_us']:9.1f} {result['p99_us']:9.1f} {result['max_ms']:9.2f} "
+              f"{result['handled_s']:11.2f} {result['total_s']:9.2f}")
+
+
+if __name__ == '__main__':
+    main()
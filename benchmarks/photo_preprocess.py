@@ -0,0 +1,126 @@
+"""Сколько байт и времени на скан экономит подготовка фото.
+
+Сравнивает старый путь (самый большой PhotoSize как есть -> base64 -> Bodygram)
+с новым (наименьший достаточный PhotoSize -> уменьшение и пересжатие в пуле
+процессов -> base64 -> Bodygram). Фото синтетические, с шумом, чтобы JPEG
+сжимался как настоящий снимок, и с EXIF-поворотом. Время передачи считается
+по заданной пропускной способности, время CPU измеряется.
+
+    python benchmarks/photo_preprocess.py [--scans 20] [--download-mbps 50] [--upload-mbps 10]
+"""
+import argparse
+import asyncio
+import base64
+import io
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiogram.types import PhotoSize  # noqa: E402
+from imaging import ImagePreprocessor, choose_photo_size  # noqa: E402
+
+# Варианты, которые Telegram хранит для одного фото: длинная сторона в пикселях
+TELEGRAM_SIDES = (90, 320, 800, 1280, 2560)
+ORIENTATION_TAG = 0x0112
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> Image.Image:
+    """Градиент с шумом: жмется в JPEG примерно как фото с телефона"""
+    noise = Image.frombytes('L', (width, height), os.urandom(width * height))
+    gradient = Image.linear_gradient('L').resize((width, height)).rotate(seed % 360)
+    channels = [Image.blend(gradient, noise, share) for share in (0.05, 0.1, 0.15)]
+    return Image.merge('RGB', channels)
+
+
+def telegram_variants(image: Image.Image, seed: int) -> Tuple[List[PhotoSize], Dict[str, bytes]]:
+    """Варианты фото так, как их отдает Telegram: JPEG разных размеров с EXIF"""
+    sizes: List[PhotoSize] = []
+    files: Dict[str, bytes] = {}
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = 6
+    for side in TELEGRAM_SIDES:
+        variant = image.copy()
+        variant.thumbnail((side, side))
+        output = io.BytesIO()
+        variant.save(output, format='JPEG', quality=87, exif=exif)
+        file_id = f'photo_{seed}_{side}'
+        files[file_id] = output.getvalue()
+        sizes.append(PhotoSize(file_id=file_id, file_unique_id=f'u_{file_id}',
+                               width=variant.width, height=variant.height,
+                               file_size=len(files[file_id])))
+    return sizes, files
+
+
+async def run(scans: int, download_mbps: float, upload_mbps: float, min_side: int,
+              max_side: int, quality: int, workers: int) -> None:
+    preprocessor = ImagePreprocessor(workers=workers, max_side=max_side, quality=quality)
+    preprocessor.start()
+    photos = [telegram_variants(synthetic_photo(2560, 1920, seed), seed) for seed in range(scans * 2)]
+    # Прогрев пула: первые задачи ждут запуска процессов
+    await preprocessor.process(photos[0][1][photos[0][0][-1].file_id])
+
+    totals = {key: 0.0 for key in (
+        'raw_download', 'raw_upload', 'raw_b64_s', 'new_download', 'new_upload', 'new_b64_s', 'preprocess_s',
+    )}
+    for sizes, files in photos:
+        raw = files[sizes[-1].file_id]
+        started = time.perf_counter()
+        raw_b64 = base64.b64encode(raw)
+        totals['raw_b64_s'] += time.perf_counter() - started
+        totals['raw_download'] += len(raw)
+        totals['raw_upload'] += len(raw_b64)
+
+        chosen = files[choose_photo_size(sizes, min_side).file_id]
+        started = time.perf_counter()
+        processed = await preprocessor.process(chosen)
+        totals['preprocess_s'] += time.perf_counter() - started
+        started = time.perf_counter()
+        new_b64 = base64.b64encode(processed)
+        totals['new_b64_s'] += time.perf_counter() - started
+        totals['new_download'] += len(chosen)
+        totals['new_upload'] += len(new_b64)
+    await preprocessor.close()
+
+    def transfer_s(download: float, upload: float) -> float:
+        return download * 8 / (download_mbps * 1e6) + upload * 8 / (upload_mbps * 1e6)
+
+    raw_time = transfer_s(totals['raw_download'], totals['raw_upload']) + totals['raw_b64_s']
+    new_time = (transfer_s(totals['new_download'], totals['new_upload'])
+                + totals['new_b64_s'] + totals['preprocess_s'])
+    per_scan = lambda value: value / scans  # noqa: E731
+
+    print(f"scans={scans} download={download_mbps} Mbit/s upload={upload_mbps} Mbit/s "
+          f"min_side={min_side} max_side={max_side} quality={quality}")
+    print(f"{'':>10} {'download KB':>12} {'upload KB':>10} {'base64 ms':>10} {'prep ms':>8} {'total ms':>9}")
+    print(f"{'raw':>10} {per_scan(totals['raw_download']) / 1024:12.0f} "
+          f"{per_scan(totals['raw_upload']) / 1024:10.0f} {per_scan(totals['raw_b64_s']) * 1000:10.2f} "
+          f"{0:8.1f} {per_scan(raw_time) * 1000:9.0f}")
+    print(f"{'prepared':>10} {per_scan(totals['new_download']) / 1024:12.0f} "
+          f"{per_scan(totals['new_upload']) / 1024:10.0f} {per_scan(totals['new_b64_s']) * 1000:10.2f} "
+          f"{per_scan(totals['preprocess_s']) * 1000:8.1f} {per_scan(new_time) * 1000:9.0f}")
+    saved_bytes = per_scan(totals['raw_download'] + totals['raw_upload']
+                           - totals['new_download'] - totals['new_upload'])
+    print(f"saved per scan: {saved_bytes / 1024:.0f} KB, {per_scan(raw_time - new_time) * 1000:.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=20, help='сколько сканов (по два фото)')
+    parser.add_argument('--download-mbps', type=float, default=50.0, help='скорость Telegram -> бот')
+    parser.add_argument('--upload-mbps', type=float, default=10.0, help='скорость бот -> Bodygram')
+    parser.add_argument('--min-side', type=int, default=720)
+    parser.add_argument('--max-side', type=int, default=1280)
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.scans, args.download_mbps, args.upload_mbps, args.min_side,
+                    args.max_side, args.quality, args.workers))
+
+
+if __name__ == '__main__':
+    main()
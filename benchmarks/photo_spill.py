@@ -0,0 +1,74 @@
+"""Память под брошенные фото: все в памяти против выгрузки на диск в PhotoBufferStore.
+
+Пользователи присылают фото анфас и уходят. Для каждого режима печатается,
+сколько байт фото осталось в памяти и на диске после выгрузки, сколько
+памяти Python держит процесс (tracemalloc) и сколько стоит в обработчике
+put() и чтение фото обратно - из памяти и с диска.
+
+    python benchmarks/photo_spill.py [--users 2000] [--photo-kb 300]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from photo_buffers import PhotoBufferStore  # noqa: E402
+
+
+async def run(spill_dir, users: int, photo_size: int) -> dict:
+    store = PhotoBufferStore(spill_dir=spill_dir, spill_after=0.0, max_resident_bytes=64 << 20)
+    store.start()
+    tracemalloc.start()
+    ids = []
+    put_time = 0.0
+    for _ in range(users):
+        data = os.urandom(photo_size)
+        t0 = time.perf_counter()
+        ids.append(store.put(data))
+        put_time += time.perf_counter() - t0
+        del data
+    started = time.perf_counter()
+    await store.maintain()
+    spill_time = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = store.stats()
+    sample = ids[:min(200, users)]
+    t0 = time.perf_counter()
+    for photo_id in sample:
+        await store.get(photo_id)
+    get_time = (time.perf_counter() - t0) / len(sample)
+    await store.close()
+    return {
+        'resident_mb': stats['resident_bytes'] / 2**20,
+        'spilled_mb': stats['spilled_bytes'] / 2**20,
+        'python_mb': current / 2**20,
+        'put_us': put_time / users * 1e6,
+        'spill_s': spill_time,
+        'get_ms': get_time * 1e3,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--photo-kb', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"users={args.users} photo={args.photo_kb} КБ")
+    print(f"{'режим':>8} {'в памяти, МБ':>13} {'на диске, МБ':>13} {'Python, МБ':>11} "
+          f"{'put, мкс':>9} {'выгрузка, с':>12} {'чтение, мс':>11}")
+    with tempfile.TemporaryDirectory(prefix='photo-spill-bench-') as directory:
+        for name, spill_dir in (('память', None), ('диск', directory)):
+            result = asyncio.run(run(spill_dir, args.users, args.photo_kb * 1024))
+            print(f"{name:>8} {result['resident_mb']:13.1f} {result['spilled_mb']:13.1f} {result['python_mb']:11.1f} "
+                  f"{result['put_us']:9.2f} {result['spill_s']:12.2f} {result['get_ms']:11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Сквозная проверка CachedStore(RedisBackend) на заглушке Redis и время записи.
+
+Состояния FSM, данные FSM и JSON сессий users пользователей проходят через
+PersistentFSMStorage и SessionStore в заглушку Redis (fake_redis.py):
+запись пачкой при flush, удаления, обрыв соединения и холодное чтение
+новым клиентом с пустым кэшем. Несовпадение значений - выход с ошибкой.
+Затем печатается время set() при кэше, заполненном до cache_size.
+
+    python benchmarks/redis_storage.py [--users 5000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+from fake_redis import FakeRedis  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+from storage import CachedStore, PersistentFSMStorage, RedisBackend  # noqa: E402
+
+BOT_ID = 1
+DB = 3
+PASSWORD = 'benchmark'
+
+
+def storage_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        raise SystemExit(f"ОШИБКА: {message}")
+
+
+def open_store(url: str, cache_size: int = 50000) -> CachedStore:
+    # Большой flush_interval: запись только по явному flush()
+    return CachedStore(RedisBackend.from_url(url), flush_interval=3600, cache_size=cache_size)
+
+
+async def round_trip(server: FakeRedis, url: str, users: int) -> None:
+    store = open_store(url)
+    await store.start()
+    fsm = PersistentFSMStorage(store)
+    sessions = SessionStore(backend=store)
+    for user_id in range(users):
+        await fsm.set_state(storage_key(user_id), 'QuizStates:waiting_for_bust')
+        await fsm.set_data(storage_key(user_id), {'underbust': 70 + user_id % 20, 'name': 'Анна'})
+        session = sessions.get_or_create(user_id)
+        session.quiz_data = {'underbust': 70 + user_id % 20, 'bust': 90}
+        session.height = 150 + user_id % 40
+        sessions.persist(user_id)
+
+    check(not server.data[DB], "записи дошли до Redis до flush")
+    started = time.perf_counter()
+    await store.flush()
+    flushed = time.perf_counter() - started
+    check(len(server.data[DB]) == users * 3, f"после flush в Redis {len(server.data[DB])} ключей, ждали {users * 3}")
+    print(f"flush {users * 3} ключей: {flushed * 1e3:.1f} мс, MSET: {server.calls['MSET']}")
+
+    # Удаления: сброс состояния FSM у четных, удаление сессии у каждого третьего
+    for user_id in range(0, users, 2):
+        await fsm.set_state(storage_key(user_id), None)
+        await fsm.set_data(storage_key(user_id), {})
+    for user_id in range(0, users, 3):
+        sessions.delete(user_id)
+    # Обрыв соединения: клиент переподключается при следующей команде
+    server.drop_connections()
+    await asyncio.sleep(0.05)
+    try:
+        await store.flush()
+    except Exception as e:
+        print(f"flush на оборванном соединении: {type(e).__name__}, пачка осталась в очереди")
+    await store.flush()
+    check(store.pending_writes == 0, f"после flush в очереди {store.pending_writes} записей")
+    await store.close()
+
+    # Холодное чтение: новый клиент, пустой кэш, новое хранилище сессий
+    cold = open_store(url)
+    await cold.start()
+    fsm = PersistentFSMStorage(cold)
+    sessions = SessionStore(backend=cold)
+    get_calls = server.calls['MGET']
+    for user_id in range(users):
+        state = await fsm.get_state(storage_key(user_id))
+        data = await fsm.get_data(storage_key(user_id))
+        if user_id % 2 == 0:
+            check(state is None and data == {}, f"состояние FSM {user_id} не удалено: {state}, {data}")
+        else:
+            check(state == 'QuizStates:waiting_for_bust', f"состояние FSM {user_id}: {state}")
+            check(data == {'underbust': 70 + user_id % 20, 'name': 'Анна'}, f"данные FSM {user_id}: {data}")
+        await sessions.load(user_id)
+        session = sessions.get(user_id)
+        if user_id % 3 == 0:
+            check(session is None, f"сессия {user_id} не удалена")
+        else:
+            check(session is not None and session.height == 150 + user_id % 40
+                  and session.quiz_data == {'underbust': 70 + user_id % 20, 'bust': 90},
+                  f"сессия {user_id}: {session}")
+    reads = server.calls['MGET'] - get_calls
+    # Повторное чтение - из кэша, без запросов к Redis
+    for user_id in range(users):
+        await fsm.get_state(storage_key(user_id))
+    check(server.calls['MGET'] - get_calls == reads, "повторное чтение ушло в Redis")
+    await cold.close()
+    print(f"холодное чтение {users} пользователей: {reads} MGET, повторное - из кэша; "
+          f"соединений: {server.connections}")
+
+
+async def write_cost(url: str, writes: int, cache_size: int) -> None:
+    store = open_store(url, cache_size=cache_size)
+    await store.start()
+    for i in range(cache_size):
+        store.set(f"warm:{i}", '1')
+    await store.flush()
+    started = time.perf_counter()
+    for i in range(writes):
+        store.set(f"bench:{i}", '1')
+    elapsed = time.perf_counter() - started
+    await store.close()
+    print(f"set() при заполненном кэше на {cache_size} ключей: {elapsed / writes * 1e6:.2f} мкс")
+
+
+async def run(users: int, writes: int, cache_size: int) -> None:
+    server = FakeRedis(password=PASSWORD)
+    base_url = await server.start()
+    url = f"{base_url.replace('redis://', f'redis://:{PASSWORD}@')}/{DB}"
+    try:
+        await round_trip(server, url, users)
+        await write_cost(url, writes, cache_size)
+    finally:
+        await server.stop()
+    print("OK")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--cache-size', type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.writes, args.cache_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Пиковая память при отправке сканов: старый путь (base64 -> str -> dict -> JSON)
+против потокового ScanRequestBody.
+
+Каждый режим запускается в отдельном процессе, чтобы ru_maxrss не смешивался.
+Фото отправляются на локальный aiohttp-сервер, который только читает тело.
+
+    python benchmarks/scan_payload_memory.py [--scans 10] [--photo-mb 5]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import subprocess
+import sys
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bodygram import ScanRequestBody, ScanRequestPayload  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса в МБ (ru_maxrss в КБ на Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb() -> float:
+    """Текущий RSS процесса в МБ"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+async def sink(request: web.Request) -> web.Response:
+    """Читает тело по кускам и отбрасывает его"""
+    async for _ in request.content.iter_chunked(1 << 16):
+        pass
+    return web.json_response({'measurements': []})
+
+
+def legacy_body(user_id: int, front: bytes, profile: bytes) -> dict:
+    """Тело запроса так, как его собирал send_photos_to_api до потокового кодирования"""
+    return {
+        "customScanId": f"scan_{user_id}",
+        "photoScan": {
+            "age": 25,
+            "weight": 60000,
+            "height": 1700,
+            "gender": "female",
+            "frontPhoto": base64.b64encode(front).decode(),
+            "rightPhoto": base64.b64encode(profile).decode(),
+        },
+    }
+
+
+async def run_mode(mode: str, scans: int, photo_mb: int) -> None:
+    app = web.Application()
+    app.router.add_post('/scans', sink)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}/scans'
+
+    photos = [(os.urandom(photo_mb << 20), os.urandom(photo_mb << 20)) for _ in range(scans)]
+    baseline = current_rss_mb()
+
+    async with aiohttp.ClientSession() as session:
+        async def one(user_id: int, front: bytes, profile: bytes) -> None:
+            if mode == 'legacy':
+                kwargs = {'json': legacy_body(user_id, front, profile)}
+            else:
+                body = ScanRequestBody(
+                    f"scan_{user_id}",
+                    {"age": 25, "weight": 60000, "height": 1700, "gender": "female"},
+                    {"frontPhoto": front, "rightPhoto": profile},
+                )
+                kwargs = {'data': ScanRequestPayload(body)}
+            async with session.post(url, **kwargs) as response:
+                await response.read()
+
+        await asyncio.gather(*(one(i, f, p) for i, (f, p) in enumerate(photos)))
+
+    await runner.cleanup()
+    print(f"{mode}\t{baseline:.1f}\t{peak_rss_mb():.1f}\t{peak_rss_mb() - baseline:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=10, help='одновременных сканов')
+    parser.add_argument('--photo-mb', type=int, default=5, help='размер каждого фото, МБ')
+    parser.add_argument('--mode', choices=['legacy', 'stream'], help='запустить один режим (внутреннее)')
+    args = parser.parse_args()
+
+    if args.mode:
+        asyncio.run(run_mode(args.mode, args.scans, args.photo_mb))
+        return
+
+    print(f"{args.scans} одновременных сканов, 2 фото по {args.photo_mb} МБ")
+    print("режим\tRSS до, МБ\tпик RSS, МБ\tприрост, МБ")
+    for mode in ('legacy', 'stream'):
+        subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--scans', str(args.scans), '--photo-mb', str(args.photo_mb)],
+            check=True,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Отправка всплеска сообщений без планировщика и через OutboundScheduler.
+
+Telegram имитируется: общий лимит на бота и лимит на чат как у платформы,
+запрос сверх лимита получает 429 (TelegramRetryAfter). Каждый чат сразу шлет
+несколько сообщений и параллельно часто правит одно сообщение прогресса,
+как report_scan_progress. Без планировщика 429 - ошибка для пользователя,
+с планировщиком запросы ждут токенов, а правки склеиваются.
+
+    python benchmarks/send_scheduler.py [--chats 40] [--messages 5] [--edits 10]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import EditMessageText, SendMessage, TelegramMethod  # noqa: E402
+
+from outbound import OutboundScheduler  # noqa: E402
+
+TOKEN = '123456:BENCHMARK-TOKEN'
+
+
+class StrictBucket:
+    """Лимит на стороне Telegram: запрос без токена отклоняется"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def available(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Допуск на неточность таймеров event loop
+        return self.tokens >= 0.99
+
+
+class FakeTelegram:
+    """Bot API с лимитами и задержкой сети"""
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, latency: float):
+        self.global_bucket = StrictBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats: Dict[Any, StrictBucket] = {}
+        self.latency = latency
+        self.delivered = 0
+        self.rejected = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+    async def __call__(self, bot: Bot, method: TelegramMethod) -> Any:
+        now = time.monotonic()
+        self.started = self.started or now
+        chat = self.chats.setdefault(method.chat_id, StrictBucket(self.chat_rate, self.chat_burst))
+        if not (chat.available(now) and self.global_bucket.available(now)):
+            self.rejected += 1
+            await asyncio.sleep(self.latency)
+            raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+        chat.tokens -= 1
+        self.global_bucket.tokens -= 1
+        await asyncio.sleep(self.latency)
+        self.delivered += 1
+        self.finished = time.monotonic()
+        return True
+
+
+async def run_case(scheduled: bool, args: argparse.Namespace) -> Dict[str, Any]:
+    bot = Bot(token=TOKEN)
+    telegram = FakeTelegram(args.global_rate, args.chat_rate, args.chat_burst, args.latency)
+    scheduler = OutboundScheduler(global_rate=args.global_rate, chat_rate=args.chat_rate,
+                                  chat_burst=args.chat_burst)
+    latencies: List[float] = []
+    failures = 0
+
+    async def request(method: TelegramMethod) -> None:
+        nonlocal failures
+        started = time.monotonic()
+        try:
+            if scheduled:
+                await scheduler(telegram, bot, method)
+            else:
+                await telegram(bot, method)
+        except TelegramRetryAfter:
+            failures += 1
+            return
+        latencies.append(time.monotonic() - started)
+
+    async def chat(chat_id: int) -> None:
+        tasks = [asyncio.create_task(request(SendMessage(chat_id=chat_id, text=f"msg {i}")))
+                 for i in range(args.messages)]
+        for i in range(args.edits):
+            tasks.append(asyncio.create_task(request(
+                EditMessageText(chat_id=chat_id, message_id=1, text=f"⏳ Вы в очереди: {args.edits - i}")
+            )))
+            await asyncio.sleep(args.edit_interval)
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(1, args.chats + 1)))
+    await bot.session.close()
+    latencies.sort()
+    elapsed = telegram.finished - telegram.started
+    return {
+        'requests': args.chats * (args.messages + args.edits),
+        'delivered': telegram.delivered,
+        'failed': failures,
+        'rejected_429': telegram.rejected,
+        'throughput': telegram.delivered / elapsed if elapsed > 0 else 0.0,
+        'p50': statistics.median(latencies) if latencies else 0.0,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0,
+        'stats': scheduler.stats() if scheduled else {},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=40)
+    parser.add_argument('--messages', type=int, default=5, help='сообщений на чат разом')
+    parser.add_argument('--edits', type=int, default=10, help='правок сообщения прогресса на чат')
+    parser.add_argument('--edit-interval', type=float, default=0.2, help='пауза между правками, секунд')
+    parser.add_argument('--global-rate', type=float, default=30.0)
+    parser.add_argument('--chat-rate', type=float, default=1.0)
+    parser.add_argument('--chat-burst', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка сети до Bot API, секунд')
+    args = parser.parse_args()
+
+    print(f"chats={args.chats} messages={args.messages} edits={args.edits} "
+          f"limits: {args.global_rate}/s global, {args.chat_rate}/s per chat (burst {args.chat_burst})")
+    for name, scheduled in (('direct', False), ('scheduler', True)):
+        result = asyncio.run(run_case(scheduled, args))
+        print(f"{name:>9}: {result['requests']} запросов, доставлено {result['delivered']}, "
+              f"ошибок {result['failed']}, ответов 429 {result['rejected_429']}, "
+              f"{result['throughput']:.1f} сообщ/с, p50 {result['p50']:.2f} с, p99 {result['p99']:.2f} с")
+        if result['stats']:
+            print(f"{'':>11}{result['stats']}")
+
+
+if __name__ == '__main__':
+    main()
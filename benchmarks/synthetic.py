@@ -0,0 +1,138 @@
+"""Синтетические апдейты Telegram для нагрузочных прогонов"""
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+# Шаги квиза: ('text', текст) или ('callback', callback_data)
+QUIZ_FLOW: List[Tuple[str, str]] = [
+    ('text', '/start'),
+    ('callback', 'c:yes'),
+    ('callback', 'dc:yes'),
+    ('callback', 'm:quiz'),
+    ('callback', 'qc:no'),
+    ('text', '78'),
+    ('text', '92'),
+    ('callback', 'qs:wide'),
+    ('callback', 'qt:classic'),
+    ('callback', 'qp:comfort'),
+    ('callback', 'qn:light'),
+    ('callback', 'qx'),
+    ('callback', 'f:good'),
+]
+
+# Шаги фото-скана; ('photo', сторона) - фото, уникальное для каждого пользователя
+PHOTO_FLOW: List[Tuple[str, str]] = [
+    ('text', '/start'),
+    ('callback', 'c:yes'),
+    ('callback', 'dc:yes'),
+    ('callback', 'm:photo'),
+    ('callback', 'ph'),
+    ('text', '168'),
+    ('photo', 'front'),
+    ('photo', 'profile'),
+    ('callback', 'f:good'),
+]
+
+# Тот же фото-скан, но оба фото одним альбомом; ('album', 'сторона,сторона')
+ALBUM_FLOW: List[Tuple[str, str]] = [
+    ('text', '/start'),
+    ('callback', 'c:yes'),
+    ('callback', 'dc:yes'),
+    ('callback', 'm:photo'),
+    ('callback', 'ph'),
+    ('text', '168'),
+    ('album', 'front,profile'),
+    ('callback', 'f:good'),
+]
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+
+def _chat(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'type': 'private'}
+
+
+def message_update(user_id: int, text: str) -> Dict[str, Any]:
+    """Апдейт с текстовым сообщением (команды размечаются как bot_command)"""
+    message: Dict[str, Any] = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': _chat(user_id),
+        'from': _user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': next(_update_ids), 'message': message}
+
+
+def photo_update(user_id: int, file_id: str, media_group_id: Optional[str] = None) -> Dict[str, Any]:
+    """Апдейт с фото в двух размерах, как их присылает Telegram"""
+    message: Dict[str, Any] = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': _chat(user_id),
+        'from': _user(user_id),
+        'photo': [
+            {'file_id': f'{file_id}_s', 'file_unique_id': f'{file_id}_s', 'width': 320, 'height': 640},
+            {'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 2560},
+        ],
+    }
+    if media_group_id:
+        message['media_group_id'] = media_group_id
+    return {'update_id': next(_update_ids), 'message': message}
+
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> Dict[str, Any]:
+    """Апдейт с нажатием inline-кнопки"""
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': _chat(user_id),
+                'text': '...',
+            },
+        },
+    }
+
+
+def step_update(user_id: int, kind: str, value: str) -> Dict[str, Any]:
+    """Апдейт для одного шага сценария"""
+    if kind == 'text':
+        return message_update(user_id, value)
+    if kind == 'photo':
+        return photo_update(user_id, f'{value}_{user_id}')
+    return callback_update(user_id, value)
+
+
+def step_updates(user_id: int, kind: str, value: str) -> List[Dict[str, Any]]:
+    """Апдейты одного шага: альбом приходит несколькими апдейтами с общим media_group_id"""
+    if kind == 'album':
+        group = f'album_{user_id}_{next(_message_ids)}'
+        return [photo_update(user_id, f'{side}_{user_id}', group) for side in value.split(',')]
+    return [step_update(user_id, kind, value)]
+
+
+def flow_updates(user_id: int, flow: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """Последовательность апдейтов одного пользователя по сценарию"""
+    return [update for kind, value in flow for update in step_updates(user_id, kind, value)]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0..100) по отсортированной копии"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
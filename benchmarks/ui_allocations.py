@@ -0,0 +1,128 @@
+"""Память и время на один шаг квиза: клавиатуры и тексты, собираемые
+в обработчике, против готовых клавиатур и шаблонов из ui.py.
+
+Шаг - то, что делал handle_skin_tone_choice: сводка ответов, клавиатура
+и сборка запроса к Bot API с этой клавиатурой. Память меряется tracemalloc
+как пик временных выделений за шаг, время - отдельным прогоном без трассировки.
+
+    python benchmarks/ui_allocations.py [--steps 20000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.methods import EditMessageText  # noqa: E402
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+from ui import SKIN_TONE_KEYBOARD, PrebuiltMarkupSession, render_quiz_summary  # noqa: E402
+
+QUIZ_DATA: Dict[str, Any] = {
+    'comfortable_bra': 'no', 'underbust': 78, 'bust': 92, 'breast_shape': 'wide',
+    'bra_type': 'classic', 'priority': 'comfort', 'skin_tone': 'light',
+}
+TOKEN = '123456:BENCHMARK-TOKEN'
+
+
+def create_keyboard(*buttons):
+    """create_keyboard в том виде, в каком он был в bot.py"""
+    keyboard = []
+    for text, callback_data in buttons:
+        keyboard.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def legacy_summary(quiz_data: Dict[str, Any]) -> str:
+    """Сводка ответов так, как ее собирал handle_skin_tone_choice"""
+    summary_text = "📋 Ваши ответы:\n\n"
+    if 'comfortable_bra' in quiz_data:
+        comfortable_text = "👍 Да" if quiz_data['comfortable_bra'] == 'yes' else "👎 Нет"
+        summary_text += f"• Есть ли комфортный бюстгальтер: {comfortable_text}\n"
+    if 'current_size' in quiz_data:
+        summary_text += f"• Текущий размер: {quiz_data['current_size']}\n"
+    if 'underbust' in quiz_data:
+        summary_text += f"• Обхват под грудью: {quiz_data['underbust']} см\n"
+    if 'bust' in quiz_data:
+        summary_text += f"• Обхват груди: {quiz_data['bust']} см\n"
+    if 'breast_shape' in quiz_data:
+        shape_map = {'wide': "🔻 Широкая база", 'narrow': "🔸 Узкая / объёмная",
+                     'low': "🔹 Низкий посад", 'unknown': "❔ Не знаю"}
+        summary_text += f"• Форма груди: {shape_map.get(quiz_data['breast_shape'], quiz_data['breast_shape'])}\n"
+    if 'bra_type' in quiz_data:
+        type_map = {'bralette': "👙 Бралетт", 'sport': "💪 Спортивный",
+                    'classic': "💎 Классический", 'pushup': "🚀 Лёгкий push-up"}
+        summary_text += f"• Тип бюстгальтера: {type_map.get(quiz_data['bra_type'], quiz_data['bra_type'])}\n"
+    if 'priority' in quiz_data:
+        priority_map = {'comfort': "☁️ Комфорт", 'aesthetics': "👁 Эстетика", 'support': "🤸‍♀️ Поддержка"}
+        summary_text += f"• Приоритет: {priority_map.get(quiz_data['priority'], quiz_data['priority'])}\n"
+    if 'skin_tone' in quiz_data:
+        tone_map = {'light': "🌕 Светлый", 'medium': "🏽 Средний", 'dark': "🏿 Тёмный"}
+        summary_text += f"• Тон кожи: {tone_map.get(quiz_data['skin_tone'], quiz_data['skin_tone'])}\n"
+    return summary_text
+
+
+def legacy_step(bot: Bot, session: AiohttpSession) -> None:
+    text = legacy_summary(QUIZ_DATA)
+    keyboard = create_keyboard(
+        ("🌕 Светлый", "skin_tone_light"),
+        ("🏽 Средний", "skin_tone_medium"),
+        ("🏿 Тёмный", "skin_tone_dark"),
+    )
+    method = EditMessageText(chat_id=1, message_id=1, text=text, reply_markup=keyboard)
+    session.build_form_data(bot, method)
+
+
+def prebuilt_step(bot: Bot, session: PrebuiltMarkupSession) -> None:
+    text = render_quiz_summary(QUIZ_DATA)
+    method = EditMessageText(chat_id=1, message_id=1, text=text, reply_markup=SKIN_TONE_KEYBOARD)
+    session.build_form_data(bot, method)
+
+
+def measure(step: Callable[[], None], steps: int) -> Dict[str, float]:
+    for _ in range(1000):
+        step()
+    started = time.perf_counter()
+    for _ in range(steps):
+        step()
+    elapsed = (time.perf_counter() - started) / steps
+
+    tracemalloc.start()
+    peak_total = 0
+    for _ in range(steps // 10):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - current
+    tracemalloc.stop()
+    return {'us': elapsed * 1e6, 'peak_bytes': peak_total / (steps // 10)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy_session = AiohttpSession()
+    prebuilt_session = PrebuiltMarkupSession()
+    bot = Bot(token=TOKEN, session=legacy_session)
+    results = {
+        'legacy': measure(lambda: legacy_step(bot, legacy_session), args.steps),
+        'prebuilt': measure(lambda: prebuilt_step(bot, prebuilt_session), args.steps),
+    }
+    print(f"steps={args.steps}")
+    for name, result in results.items():
+        print(f"{name:>9}: {result['us']:7.2f} мкс/шаг, пик выделений {result['peak_bytes'] / 1024:6.1f} КБ/шаг")
+    legacy, prebuilt = results['legacy'], results['prebuilt']
+    print(f"экономия: {legacy['us'] - prebuilt['us']:.2f} мкс и "
+          f"{(legacy['peak_bytes'] - prebuilt['peak_bytes']) / 1024:.1f} КБ на шаг")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Нагрузочный прогон режима вебхука.
+
+Поднимает в одном процессе заглушку Bot API, aiohttp-приложение вебхука с
+диспетчером из bot.py и прогоняет через него сценарий квиза для множества
+пользователей, отправляя синтетические Update JSON POST-запросами.
+Печатает p50/p99 задержки обработчиков и подтверждения вебхука.
+
+    python benchmarks/webhook_load.py [--users 500] [--concurrency 100]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Бенчмарк не ходит в настоящие API, достаточно фиктивных значений
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK-TOKEN')
+os.environ.setdefault('BODYGRAM_API_KEY', 'benchmark')
+os.environ.setdefault('BODYGRAM_ORG_ID', 'benchmark')
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+import bot as bot_module  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from synthetic import QUIZ_FLOW, flow_updates, percentile  # noqa: E402
+from webhook import SECRET_HEADER, WebhookHandler, create_webhook_app  # noqa: E402
+
+SECRET = 'benchmark-secret'
+
+
+class TracingWebhookHandler(WebhookHandler):
+    """WebhookHandler, который сообщает о завершении обработки каждого апдейта"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done = {}
+
+    async def _process(self, update) -> None:
+        try:
+            await super()._process(update)
+        finally:
+            self.done.setdefault(update.update_id, asyncio.Event()).set()
+
+    async def wait(self, update_id: int) -> None:
+        await self.done.setdefault(update_id, asyncio.Event()).wait()
+        del self.done[update_id]
+
+
+async def run(users: int, concurrency: int, think_ms: float, api_latency_ms: float) -> None:
+    telegram = FakeTelegram(latency=api_latency_ms / 1000)
+    base_url = await telegram.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = Bot(token=os.environ['TELEGRAM_BOT_TOKEN'], session=session)
+
+    handler = TracingWebhookHandler(bot_module.dp, bot, secret_token=SECRET)
+    runner = web.AppRunner(create_webhook_app(handler, '/webhook'))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}/webhook'
+
+    ack_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: SECRET}) as client:
+        async def simulate(user_id: int) -> None:
+            async with semaphore:
+                for update in flow_updates(user_id, QUIZ_FLOW):
+                    started = time.perf_counter()
+                    async with client.post(url, json=update) as response:
+                        await response.read()
+                    ack_latencies.append(time.perf_counter() - started)
+                    # Пользователь видит ответ бота и только потом делает следующий шаг
+                    await handler.wait(update['update_id'])
+                    await asyncio.sleep(think_ms / 1000)
+
+        # Прогрев: первые вызовы aiogram лениво достраивают pydantic-модели
+        await simulate(1)
+        handler.latencies.clear()
+        ack_latencies.clear()
+        telegram.calls.clear()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate(100000 + i) for i in range(users)))
+        await handler.drain(timeout=30)
+        elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    await bot.session.close()
+    await telegram.stop()
+
+    handled = list(handler.latencies)
+    print(f"пользователей: {users}, апдейтов: {len(ack_latencies)}, ошибок обработчиков: {handler.errors}")
+    print(f"время: {elapsed:.2f} с, апдейтов/с: {len(ack_latencies) / elapsed:.0f}")
+    print(f"обработчик  p50: {percentile(handled, 50) * 1000:.2f} мс  p99: {percentile(handled, 99) * 1000:.2f} мс")
+    print(f"ответ 200   p50: {percentile(ack_latencies, 50) * 1000:.2f} мс  "
+          f"p99: {percentile(ack_latencies, 99) * 1000:.2f} мс")
+    print(f"вызовы Bot API: {dict(telegram.calls)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help='число пользователей')
+    parser.add_argument('--concurrency', type=int, default=100, help='одновременно активных пользователей')
+    parser.add_argument('--think-ms', type=float, default=20, help='пауза между шагами пользователя, мс')
+    parser.add_argument('--api-latency-ms', type=float, default=0, help='задержка заглушки Bot API, мс')
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.concurrency, args.think_ms, args.api_latency_ms))
+
+
+if __name__ == '__main__':
+    main()
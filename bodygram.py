@@ -0,0 +1,254 @@
+import asyncio
+import base64
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, Optional, Union
+
+import aiohttp
+from aiohttp.abc import AbstractStreamWriter
+from aiohttp.payload import Payload
+
+from circuit_breaker import CircuitBreaker
+
+# Коды ответа, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Размер куска фото для base64, кратен 3, чтобы куски кодировались без паддинга
+ENCODE_CHUNK_SIZE = 3 * 16 * 1024
+
+
+class BodygramError(Exception):
+    """Ошибка запроса к Bodygram API"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class BodygramUnavailable(BodygramError):
+    """Запрос не отправлен: предохранитель разомкнут после серии сбоев API"""
+
+
+@dataclass
+class BodygramStats:
+    """Счетчики запросов к Bodygram API"""
+    requests: int = 0
+    successes: int = 0
+    errors: int = 0
+    retries: int = 0
+    timeouts: int = 0
+    rejected: int = 0
+    in_flight: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        """Средняя задержка успешного скана в секундах"""
+        if not self.successes:
+            return 0.0
+        return self.total_latency / self.successes
+
+    def as_dict(self) -> Dict[str, float]:
+        """Снимок счетчиков для логов и мониторинга"""
+        return {
+            'requests': self.requests,
+            'successes': self.successes,
+            'errors': self.errors,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'in_flight': self.in_flight,
+            'avg_latency': self.avg_latency,
+            'max_latency': self.max_latency,
+        }
+
+
+class ScanRequestBody:
+    """JSON-тело скана, которое пишется в запрос кусками без копий фото в str"""
+
+    def __init__(self, custom_scan_id: str, fields: Dict[str, Any], photos: Dict[str, bytes]):
+        # Все поля кроме фото сериализуем сразу, фото подставляем при записи
+        head = json.dumps({"customScanId": custom_scan_id, "photoScan": fields}, ensure_ascii=False)
+        # Отрезаем закрывающие "}}" объекта photoScan и всего тела
+        self._head = head[:-2].encode()
+        self._tail = b"}}"
+        # Для каждого фото готовим префикс вида ,"frontPhoto":"
+        self._photos = []
+        for name, data in photos.items():
+            separator = b"," if fields or self._photos else b""
+            prefix = separator + json.dumps(name).encode() + b':"'
+            self._photos.append((prefix, memoryview(data)))
+
+    def __len__(self) -> int:
+        size = len(self._head) + len(self._tail)
+        for prefix, photo in self._photos:
+            size += len(prefix) + 4 * ((len(photo) + 2) // 3) + 1
+        return size
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """Отдает тело по кускам, кодируя фото в base64 прямо из memoryview"""
+        yield self._head
+        for prefix, photo in self._photos:
+            yield prefix
+            for offset in range(0, len(photo), ENCODE_CHUNK_SIZE):
+                yield base64.b64encode(photo[offset:offset + ENCODE_CHUNK_SIZE])
+            yield b'"'
+        yield self._tail
+
+
+class ScanRequestPayload(Payload):
+    """Payload aiohttp для ScanRequestBody с заранее известной длиной"""
+
+    def __init__(self, body: ScanRequestBody):
+        super().__init__(body, content_type="application/json")
+        self._size = len(body)
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        return b"".join(self._value.iter_chunks()).decode(encoding, errors)
+
+    async def write(self, writer: AbstractStreamWriter) -> None:
+        for chunk in self._value.iter_chunks():
+            await writer.write(chunk)
+
+
+class BodygramClient:
+    """Асинхронный клиент Bodygram API с пулом соединений и повторами.
+
+    С breaker каждая попытка, включая повторы, сначала спрашивает
+    предохранитель и сообщает ему исход: пока API лежит, запросы (и повторы
+    уже начатых сканов) не отправляются, а сразу падают с BodygramUnavailable.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        *,
+        max_concurrency: int = 10,
+        timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self.stats = BodygramStats()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Создает сессию при первом обращении внутри работающего цикла событий"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": self.api_key},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        """Закрывает сессию и соединения"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Пауза перед повтором: Retry-After или экспонента с полным джиттером"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def create_scan(self, payload: Union[ScanRequestBody, Dict[str, Any]]) -> Dict[str, Any]:
+        """Отправляет скан и возвращает JSON ответа, при сбое бросает BodygramError"""
+        session = await self._get_session()
+        async with self._semaphore:
+            self.stats.requests += 1
+            self.stats.in_flight += 1
+            try:
+                return await self._post_with_retries(session, payload)
+            finally:
+                self.stats.in_flight -= 1
+
+    async def _post_with_retries(
+        self, session: aiohttp.ClientSession, payload: Union[ScanRequestBody, Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Выполняет POST с повторами на 429/5xx и сетевых ошибках"""
+        last_error: Optional[BodygramError] = None
+        for attempt in range(self.max_retries + 1):
+            generation = self.breaker.allow() if self.breaker is not None else 0
+            if generation is None:
+                self.stats.rejected += 1
+                last_error = BodygramUnavailable(
+                    "Bodygram API временно недоступен" + (f" ({last_error})" if last_error else "")
+                )
+                break
+            if attempt:
+                self.stats.retries += 1
+            # Потоковое тело пересоздается на каждую попытку, фото при этом не копируются
+            if isinstance(payload, ScanRequestBody):
+                request_kwargs = {'data': ScanRequestPayload(payload)}
+            else:
+                request_kwargs = {'json': payload}
+            started = time.monotonic()
+            retry_after = None
+            # API исправен, если ответил 200 или отклонил сам запрос (4xx кроме 429)
+            healthy = False
+            cancelled = False
+            try:
+                async with session.post(self.api_url, **request_kwargs) as response:
+                    if response.status == 200:
+                        data = await response.json(content_type=None)
+                        latency = time.monotonic() - started
+                        self.stats.successes += 1
+                        self.stats.total_latency += latency
+                        self.stats.max_latency = max(self.stats.max_latency, latency)
+                        healthy = True
+                        return data
+                    body = await response.text()
+                    last_error = BodygramError(
+                        f"Bodygram API вернул {response.status}: {body[:500]}", response.status
+                    )
+                    if response.status not in RETRY_STATUSES:
+                        healthy = True
+                        break
+                    retry_after = response.headers.get('Retry-After')
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                last_error = BodygramError(f"Таймаут запроса к Bodygram API ({self.timeout} с)")
+            except aiohttp.ClientError as e:
+                last_error = BodygramError(f"Сетевая ошибка Bodygram API: {e}")
+            except asyncio.CancelledError:
+                # Скан отменили (/start, остановка бота): о здоровье API это ничего не говорит
+                cancelled = True
+                raise
+            finally:
+                if self.breaker is not None:
+                    if cancelled:
+                        self.breaker.release(generation)
+                    else:
+                        self.breaker.record(generation, healthy, time.monotonic() - started)
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                logging.warning(f"{last_error}; повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+
+        self.stats.errors += 1
+        raise last_error
@@ -1,24 +1,57 @@
 import asyncio
 import logging
-import sys
-import base64
+import io
 import json
-import requests
+import math
 import os
-from typing import Dict, Any, Optional
+import tempfile
+from functools import partial
+from typing import Dict, Any, Iterator, List, Optional, Union
 from dataclasses import dataclass
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher, html
+from aiogram import Bot, Dispatcher, F, html
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.filters import CommandStart, Command, CommandObject, StateFilter
+from aiogram.types import Message, CallbackQuery, FSInputFile, PhotoSize
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 import aiohttp
 
+from albums import MediaGroupMiddleware
+from analytics import AnalyticsSink, create_writer
+from bodygram import BodygramClient, BodygramError, ScanRequestBody
+from circuit_breaker import STATE_VALUES, CircuitBreaker
+from diagnostics import Diagnostics, ProfileReport
+from callbacks import (
+    Answer, BraTypeCallback, BreastShapeCallback, CalculateCallback, CallbackRouter,
+    ComfortableCallback, ConsentCallback, DataConsentCallback, Feedback, FeedbackCallback,
+    Method, MethodCallback, PriorityCallback, SkinToneCallback, StartPhotoCallback,
+)
+from catalog import Catalog, normalize_size
+from flood_control import FloodControlMiddleware
+from imaging import ImagePreprocessor, choose_photo_size
+from log_pipeline import LogContextMiddleware, LogPipeline
+from metrics import InstrumentationMiddleware, MetricsRegistry, MetricsServer
+from outbound import OutboundScheduler
+from photo_buffers import PhotoBufferStore
+from scan_cache import ScanResultCache, scan_cache_keys
+from scan_queue import ScanJob, ScanQueue, ScanQueueFull
+from sessions import SessionMiddleware, SessionStore
+from size_chart import SizeChart
+from size_mapper import CONFIDENCE_LABELS, SizeMapper
+from storage import CachedStore, PersistentFSMStorage, SQLiteBackend, create_backend
+from ui import (
+    BRA_TYPE_KEYBOARD, BREAST_SHAPE_KEYBOARD, CALCULATE_KEYBOARD, COMFORTABLE_KEYBOARD,
+    CONSENT_KEYBOARD, DATA_CONSENT_KEYBOARD, FEEDBACK_KEYBOARD, METHOD_KEYBOARD, MYFIT_TEMPLATE,
+    NEAREST_SIZE_MODEL_TEMPLATE, PRIORITY_KEYBOARD, QUIZ_FALLBACK_KEYBOARD, QUIZ_RESULT_TEMPLATE, SCAN_ALTERNATIVES_TEMPLATE, SCAN_RESULT_TEMPLATE,
+    SKIN_TONE_KEYBOARD, START_PHOTO_KEYBOARD, PrebuiltMarkupSession, render_quiz_summary,
+)
+from webhook import run_webhook
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -28,6 +61,15 @@ API_KEY = os.getenv('BODYGRAM_API_KEY')
 ORG_ID = os.getenv('BODYGRAM_ORG_ID')
 API_URL = os.getenv('BODYGRAM_API_URL', f"https://platform.bodygram.com/api/orgs/{ORG_ID}/scans")
 
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+
 # Настройки бота
 BOT_NAME = os.getenv('BOT_NAME', 'SENS Fit Bot')
 BOT_DESCRIPTION = os.getenv('BOT_DESCRIPTION', 'Telegram bot for SENS Fit bra size fitting')
@@ -40,11 +82,116 @@ PRIVACY_EMAIL = os.getenv('PRIVACY_EMAIL', 'privacy@sensfit.com')
 WILDBERRIES_BASE_URL = os.getenv('WILDBERRIES_BASE_URL', 'https://www.wildberries.ru/catalog/')
 OZON_BASE_URL = os.getenv('OZON_BASE_URL', 'https://www.ozon.ru/product/')
 
+# Размерная сетка
+SIZE_CHART_PATH = os.getenv(
+    'SIZE_CHART_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'size_chart.json')
+)
+
+# Каталог моделей: JSON или CSV, перечитывается при изменении файла
+CATALOG_PATH = os.getenv(
+    'CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'catalog.json')
+)
+CATALOG_RELOAD_INTERVAL = float(os.getenv('CATALOG_RELOAD_INTERVAL', '10'))
+
 # Значения по умолчанию
 DEFAULT_AGE = int(os.getenv('DEFAULT_AGE', '25'))
 DEFAULT_WEIGHT = int(os.getenv('DEFAULT_WEIGHT', '60000'))
 DEFAULT_GENDER = os.getenv('DEFAULT_GENDER', 'female')
 
+# Сетевые настройки Telegram (TELEGRAM_API_URL - локальный Bot API сервер или заглушка)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+TELEGRAM_API = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+TELEGRAM_CONNECTION_LIMIT = int(os.getenv('TELEGRAM_CONNECTION_LIMIT', '100'))
+TELEGRAM_REQUEST_TIMEOUT = int(os.getenv('TELEGRAM_REQUEST_TIMEOUT', '60'))
+PHOTO_DOWNLOAD_TIMEOUT = int(os.getenv('PHOTO_DOWNLOAD_TIMEOUT', '30'))
+
+# Лимиты исходящих сообщений Telegram
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+
+# Эндпоинт метрик Prometheus (0 - выключен)
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Подготовка фото перед сканом
+PHOTO_MIN_SIDE = int(os.getenv('PHOTO_MIN_SIDE', '720'))
+PHOTO_MAX_SIDE = int(os.getenv('PHOTO_MAX_SIDE', '1280'))
+PHOTO_JPEG_QUALITY = int(os.getenv('PHOTO_JPEG_QUALITY', '85'))
+PHOTO_PREPROCESS_WORKERS = int(os.getenv('PHOTO_PREPROCESS_WORKERS', '2'))
+# Сколько ждать второе фото альбома, секунд
+ALBUM_TIMEOUT = float(os.getenv('ALBUM_TIMEOUT', '1'))
+
+# Защита от флуда: окно повторных нажатий и лимиты на пользователя (в секунду и разом)
+CALLBACK_DEDUPE_WINDOW = float(os.getenv('CALLBACK_DEDUPE_WINDOW', '2'))
+USER_START_RATE = float(os.getenv('USER_START_RATE', '0.2'))
+USER_START_BURST = int(os.getenv('USER_START_BURST', '3'))
+USER_PHOTO_RATE = float(os.getenv('USER_PHOTO_RATE', '0.2'))
+USER_PHOTO_BURST = int(os.getenv('USER_PHOTO_BURST', '4'))
+
+# Настройки клиента Bodygram
+BODYGRAM_TIMEOUT = float(os.getenv('BODYGRAM_TIMEOUT', '30'))
+BODYGRAM_MAX_CONCURRENCY = int(os.getenv('BODYGRAM_MAX_CONCURRENCY', '10'))
+BODYGRAM_MAX_RETRIES = int(os.getenv('BODYGRAM_MAX_RETRIES', '3'))
+
+# Предохранитель Bodygram: при доле сбоев в окне размыкается и отправляет в квиз
+BODYGRAM_BREAKER_WINDOW = float(os.getenv('BODYGRAM_BREAKER_WINDOW', '60'))
+BODYGRAM_BREAKER_MIN_CALLS = int(os.getenv('BODYGRAM_BREAKER_MIN_CALLS', '10'))
+BODYGRAM_BREAKER_FAILURE_RATE = float(os.getenv('BODYGRAM_BREAKER_FAILURE_RATE', '0.5'))
+BODYGRAM_BREAKER_SLOW_CALL = float(os.getenv('BODYGRAM_BREAKER_SLOW_CALL', '15'))
+BODYGRAM_BREAKER_OPEN_SECONDS = float(os.getenv('BODYGRAM_BREAKER_OPEN_SECONDS', '30'))
+BODYGRAM_BREAKER_HALF_OPEN_CALLS = int(os.getenv('BODYGRAM_BREAKER_HALF_OPEN_CALLS', '2'))
+
+# Очередь сканов
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', '4'))
+SCAN_QUEUE_MAXSIZE = int(os.getenv('SCAN_QUEUE_MAXSIZE', '1000'))
+SCAN_PROGRESS_INTERVAL = float(os.getenv('SCAN_PROGRESS_INTERVAL', '5'))
+
+# Кеш результатов сканов: повторная отправка тех же фото не вызывает Bodygram
+SCAN_CACHE_SIZE = int(os.getenv('SCAN_CACHE_SIZE', '10000'))
+SCAN_CACHE_TTL_HOURS = float(os.getenv('SCAN_CACHE_TTL_HOURS', '24'))
+SCAN_CACHE_PATH = os.getenv('SCAN_CACHE_PATH', '')
+
+# Хранение сессий пользователей
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '10000'))
+SESSION_TTL_HOURS = float(os.getenv('SESSION_TTL_HOURS', '168'))
+PHOTO_TTL_HOURS = float(os.getenv('PHOTO_TTL_HOURS', '24'))
+
+# Выгрузка фото на диск: фото без обращений дольше PHOTO_SPILL_AFTER секунд
+# и сверх PHOTO_RAM_LIMIT_MB в памяти шифруются в файлы (0 - только в памяти)
+PHOTO_SPILL_AFTER = float(os.getenv('PHOTO_SPILL_AFTER', '60'))
+PHOTO_SPILL_DIR = os.getenv('PHOTO_SPILL_DIR', '')
+PHOTO_RAM_LIMIT_MB = float(os.getenv('PHOTO_RAM_LIMIT_MB', '256'))
+PHOTO_SPILL_MIN_KB = float(os.getenv('PHOTO_SPILL_MIN_KB', '64'))
+
+# Постоянное хранилище состояний и сессий: memory, sqlite или redis
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory')
+STORAGE_URL = os.getenv('STORAGE_URL', '')
+STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '0.5'))
+
+# Аналитика рекомендаций и обратной связи (ANALYTICS_BACKEND: jsonl, sqlite или off)
+ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'jsonl')
+ANALYTICS_PATH = os.getenv('ANALYTICS_PATH', '')
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '1'))
+ANALYTICS_BUFFER_SIZE = int(os.getenv('ANALYTICS_BUFFER_SIZE', '100000'))
+ANALYTICS_ROTATE_MB = float(os.getenv('ANALYTICS_ROTATE_MB', '64'))
+
+# Логирование: записи в JSON (LOG_FORMAT: json или text) пишет отдельный поток
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_MAX_CHARS = int(os.getenv('LOG_MAX_CHARS', '2000'))
+LOG_SAMPLE_PER_SECOND = int(os.getenv('LOG_SAMPLE_PER_SECOND', '20'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+# Диагностика: /diag для ADMIN_USER_IDS, SIGUSR1 - профиль, SIGUSR2 - сторож loop и трассы
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+DIAGNOSTICS_DIR = os.getenv('DIAGNOSTICS_DIR', 'diagnostics')
+DIAGNOSTICS_ENABLE = {item.strip() for item in os.getenv('DIAGNOSTICS_ENABLE', '').split(',') if item.strip()}
+SLOW_CALLBACK_MS = float(os.getenv('SLOW_CALLBACK_MS', '100'))
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '30'))
+PROFILE_HZ = float(os.getenv('PROFILE_HZ', '200'))
+
 # Проверяем обязательные переменные
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env файле")
@@ -52,6 +199,12 @@ if not API_KEY:
     raise ValueError("BODYGRAM_API_KEY не установлен в .env файле")
 if not ORG_ID:
     raise ValueError("BODYGRAM_ORG_ID не установлен в .env файле")
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"BOT_MODE должен быть polling или webhook, получено: {BOT_MODE}")
+if BOT_MODE == 'webhook' and not WEBHOOK_BASE_URL:
+    raise ValueError("WEBHOOK_BASE_URL не установлен в .env файле")
+if not DIAGNOSTICS_ENABLE <= {'slow', 'trace'}:
+    raise ValueError(f"DIAGNOSTICS_ENABLE может содержать только slow и trace, получено: {DIAGNOSTICS_ENABLE}")
 
 # Состояния FSM
 class UserStates(StatesGroup):
@@ -72,47 +225,216 @@ class UserStates(StatesGroup):
     waiting_for_quiz_calculate = State()
     waiting_for_feedback = State()
 
-# Хранилище данных пользователей
-user_data: Dict[int, Dict[str, Any]] = {}
+# Постоянное хранилище (None - все только в памяти процесса)
+storage_backend = create_backend(STORAGE_BACKEND, STORAGE_URL)
+persistent_store = (
+    CachedStore(storage_backend, flush_interval=STORAGE_FLUSH_INTERVAL)
+    if storage_backend is not None else None
+)
+
+# Размерная сетка: таблица по всей области ввода квиза строится один раз при старте
+size_chart = SizeChart.from_file(SIZE_CHART_PATH)
+# Перевод мерок скана в размер по той же сетке, с кешем по квантованным меркам
+size_mapper = SizeMapper(size_chart)
+
+# Каталог моделей с индексами по размеру, типу, тону кожи и форме груди
+catalog = Catalog(CATALOG_PATH, reload_interval=CATALOG_RELOAD_INTERVAL)
+
+# Байты фото: активные в памяти, остывшие - зашифрованными во временном каталоге
+photo_buffers = PhotoBufferStore(
+    spill_dir=(PHOTO_SPILL_DIR or tempfile.gettempdir()) if PHOTO_SPILL_AFTER > 0 else None,
+    spill_after=PHOTO_SPILL_AFTER,
+    max_resident_bytes=int(PHOTO_RAM_LIMIT_MB * 1024 * 1024),
+    min_spill_size=int(PHOTO_SPILL_MIN_KB * 1024),
+)
+
+# Хранилище данных пользователей: LRU-лимит, фото живут не дольше PHOTO_TTL_HOURS
+sessions = SessionStore(
+    max_sessions=MAX_SESSIONS,
+    session_ttl=SESSION_TTL_HOURS * 3600,
+    photo_ttl=PHOTO_TTL_HOURS * 3600,
+    backend=persistent_store,
+    photo_store=photo_buffers,
+)
 
 # Создаем диспетчер с хранилищем состояний
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(
+    storage=PersistentFSMStorage(persistent_store) if persistent_store is not None else MemoryStorage()
+)
+dp.update.outer_middleware(SessionMiddleware(sessions))
+# update_id, user_id и session_id во всех записях лога, сделанных при обработке апдейта
+dp.update.outer_middleware(LogContextMiddleware(session_id=sessions.session_id))
+# Оба фото скана можно прислать одним альбомом: его сообщения приходят одним вызовом
+dp.message.outer_middleware(MediaGroupMiddleware(size=2, timeout=ALBUM_TIMEOUT))
+
+# Все нажатия кнопок разрешаются одной таблицей callback_data -> обработчик
+callbacks = CallbackRouter()
+callbacks.attach(dp)
+
+# Метрики: длительность обработчиков и внешних вызовов, воронка UserStates, память сессий
+metrics = MetricsRegistry()
+instrumentation = InstrumentationMiddleware(metrics)
+dp.message.middleware(instrumentation)
+dp.callback_query.middleware(instrumentation)
+external_call_latency = metrics.histogram('bot_external_call_seconds', 'Длительность внешних вызовов', 'call')
+metrics.gauge('bot_active_sessions', 'Сессии пользователей в памяти', lambda: len(sessions))
+metrics.gauge('bot_photo_buffer_bytes', 'Память под фото в сессиях', lambda: photo_buffers.resident_bytes)
+metrics.gauge('bot_photo_spilled_bytes', 'Фото в сессиях, выгруженные на диск', lambda: photo_buffers.spilled_bytes)
+metrics.gauge('bot_scan_queue_depth', 'Сканы, ожидающие воркера', lambda: scan_queue.depth)
+metrics.gauge('bot_outbound_queue_depth', 'Запросы к Bot API, ожидающие лимита', lambda: send_scheduler.depth)
+metrics.gauge('bot_analytics_buffer_events', 'События аналитики, ожидающие записи', lambda: len(analytics))
+metrics_server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT)
+
+# Логи: event loop только кладет запись в очередь, формат и вывод - в потоке записи.
+# Включается в точке входа (log_pipeline.install()), в runner.py - в каждом процессе
+log_dropped = metrics.counter(
+    'bot_log_dropped_total', 'Записи лога, отброшенные выборкой или при полной очереди', ('reason',),
+)
+log_pipeline = LogPipeline(
+    level=LOG_LEVEL,
+    fmt=LOG_FORMAT,
+    max_chars=LOG_MAX_CHARS,
+    sample_rate=LOG_SAMPLE_PER_SECOND,
+    queue_size=LOG_QUEUE_SIZE,
+    on_drop=lambda reason: log_dropped.inc((reason,)),
+)
+metrics.gauge('bot_log_queue_depth', 'Записи лога, ожидающие потока записи', lambda: log_pipeline.depth)
+
+# Диагностика по запросу: сторож loop со стеками, профайлер и трассы обработчиков
+loop_stalls = metrics.counter('bot_loop_stalls_total', 'Шаги event loop дольше SLOW_CALLBACK_MS', ())
+diagnostics = Diagnostics(
+    DIAGNOSTICS_DIR,
+    slow_threshold=SLOW_CALLBACK_MS / 1000,
+    profile_interval=1 / PROFILE_HZ,
+    profile_seconds=PROFILE_SECONDS,
+    on_stall=lambda lag: loop_stalls.inc(()),
+)
+dp.message.middleware(diagnostics.tracer)
+dp.callback_query.middleware(diagnostics.tracer)
+
+# Повторные нажатия, очередь апдейтов пользователя и лимиты на /start и фото
+# (после MediaGroupMiddleware: альбом приходит сюда одним сообщением)
+flood_dropped = metrics.counter(
+    'bot_flood_dropped_total', 'Отброшенные апдейты: повторные нажатия и превышение лимитов', ('reason',),
+)
+flood_control = FloodControlMiddleware(
+    dedupe_window=CALLBACK_DEDUPE_WINDOW,
+    limits={
+        'start': (USER_START_RATE, USER_START_BURST),
+        'photo': (USER_PHOTO_RATE, USER_PHOTO_BURST),
+    },
+    max_users=MAX_SESSIONS,
+    on_drop=lambda reason: flood_dropped.inc((reason,)),
+)
+dp.message.outer_middleware(flood_control)
+dp.callback_query.outer_middleware(flood_control)
+
+breaker_transitions = metrics.counter(
+    'bot_bodygram_circuit_transitions_total', 'Смены состояния предохранителя Bodygram', ('from_state', 'to_state'),
+)
+
+def on_breaker_change(previous: str, state: str) -> None:
+    """Смена состояния предохранителя Bodygram: в лог и в метрики"""
+    logging.warning(f"Предохранитель Bodygram: {previous} -> {state}")
+    breaker_transitions.inc((previous, state))
 
-def create_keyboard(*buttons: tuple[str, str]) -> InlineKeyboardMarkup:
-    """Создает клавиатуру с кнопками"""
-    keyboard = []
-    for text, callback_data in buttons:
-        keyboard.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+# Пока Bodygram сбоит, сканы не отправляются, а пользователям сразу предлагается квиз
+bodygram_breaker = CircuitBreaker(
+    window=BODYGRAM_BREAKER_WINDOW,
+    min_calls=BODYGRAM_BREAKER_MIN_CALLS,
+    failure_rate=BODYGRAM_BREAKER_FAILURE_RATE,
+    slow_call=BODYGRAM_BREAKER_SLOW_CALL,
+    open_seconds=BODYGRAM_BREAKER_OPEN_SECONDS,
+    half_open_calls=BODYGRAM_BREAKER_HALF_OPEN_CALLS,
+    on_change=on_breaker_change,
+)
+metrics.gauge(
+    'bot_bodygram_circuit_state', 'Предохранитель Bodygram: 0 - замкнут, 1 - пробные вызовы, 2 - разомкнут',
+    lambda: STATE_VALUES[bodygram_breaker.state],
+)
+metrics.gauge(
+    'bot_bodygram_failure_rate', 'Доля неудачных и медленных вызовов Bodygram в окне',
+    lambda: bodygram_breaker.current_failure_rate,
+)
+
+# Клиент Bodygram API (сессия создается при первом скане)
+bodygram_client = BodygramClient(
+    API_URL,
+    API_KEY,
+    max_concurrency=BODYGRAM_MAX_CONCURRENCY,
+    timeout=BODYGRAM_TIMEOUT,
+    max_retries=BODYGRAM_MAX_RETRIES,
+    breaker=bodygram_breaker,
+)
+
+# Кеш результатов сканов по фото и росту, с диском, если задан SCAN_CACHE_PATH
+scan_cache = ScanResultCache(
+    max_entries=SCAN_CACHE_SIZE,
+    ttl=SCAN_CACHE_TTL_HOURS * 3600,
+    backend=SQLiteBackend(SCAN_CACHE_PATH) if SCAN_CACHE_PATH else None,
+)
+
+# Исходящие запросы: лимиты на бота и на чат, повтор после 429, склейка правок
+send_scheduler = OutboundScheduler(
+    global_rate=SEND_GLOBAL_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    max_retries=SEND_MAX_RETRIES,
+)
+
+# События рекомендаций и обратной связи: буфер в памяти, запись пачками в фоне
+analytics = AnalyticsSink(
+    create_writer(ANALYTICS_BACKEND, ANALYTICS_PATH, rotate_bytes=int(ANALYTICS_ROTATE_MB * 2 ** 20)),
+    capacity=ANALYTICS_BUFFER_SIZE,
+    flush_interval=ANALYTICS_FLUSH_INTERVAL,
+)
+
+# Уменьшение и пересжатие фото в пуле процессов
+image_preprocessor = ImagePreprocessor(
+    workers=PHOTO_PREPROCESS_WORKERS,
+    max_side=PHOTO_MAX_SIDE,
+    quality=PHOTO_JPEG_QUALITY,
+)
+
+# Тексты с настройками подставляются один раз при старте
+HELP_TEXT = (
+    f"🤖 {BOT_NAME} - подбор бюстгальтера\n\n"
+    "Команды:\n"
+    "/start - начать подбор размера\n"
+    "/myfit - показать последнюю рекомендацию\n"
+    "/reset - сбросить данные\n"
+    "/privacy - политика конфиденциальности\n"
+    "/help - эта справка"
+)
+PRIVACY_TEXT = (
+    "🔒 Политика конфиденциальности SENS Fit\n\n"
+    "• Фото хранятся не более 24 часов\n"
+    "• Данные используются только для подбора размера\n"
+    "• Мы не передаем данные третьим лицам\n"
+    "• Соблюдаем 152-ФЗ и GDPR\n\n"
+    f"По вопросам: {PRIVACY_EMAIL}"
+)
+SCAN_UNAVAILABLE_TEXT = (
+    "😔 Фото-скан сейчас временно недоступен.\n\n"
+    "Подберите размер по меркам - это займет пару минут, "
+    "или попробуйте фото-скан позже."
+)
 
 # КОМАНДЫ (должны быть в начале, до других обработчиков)
 @dp.message(Command("help"))
 async def help_command(message: Message):
     """Команда помощи"""
-    help_text = (
-        f"🤖 {BOT_NAME} - подбор бюстгальтера\n\n"
-        "Команды:\n"
-        "/start - начать подбор размера\n"
-        "/myfit - показать последнюю рекомендацию\n"
-        "/reset - сбросить данные\n"
-        "/privacy - политика конфиденциальности\n"
-        "/help - эта справка"
-    )
-    await message.answer(help_text)
+    await message.answer(HELP_TEXT)
 
 @dp.message(Command("myfit"))
 async def myfit_command(message: Message):
     """Показать последнюю рекомендацию"""
     user_id = message.from_user.id
     
-    if user_id in user_data and user_data[user_id].get('last_recommendation'):
-        recommendation = user_data[user_id]['last_recommendation']
-        result_text = (
-            f"Ваша последняя рекомендация:\n\n"
-            f"Размер: **{recommendation['size']}**\n"
-            f"Модель: {recommendation['model']}\n"
-            f"Ссылка: {recommendation['link']}"
-        )
+    session = sessions.get(user_id)
+    
+    if session and session.last_recommendation:
+        result_text = MYFIT_TEMPLATE.format_map(session.last_recommendation)
         await message.answer(result_text, parse_mode=ParseMode.MARKDOWN)
     else:
         await message.answer("У вас пока нет рекомендаций. Нажмите /start для подбора размера.")
@@ -121,22 +443,45 @@ async def myfit_command(message: Message):
 async def reset_command(message: Message):
     """Сброс данных пользователя"""
     user_id = message.from_user.id
-    if user_id in user_data:
-        del user_data[user_id]
+    sessions.delete(user_id)
     await message.answer("Данные сброшены. Нажмите /start для нового подбора.")
 
 @dp.message(Command("privacy"))
 async def privacy_command(message: Message):
     """Политика конфиденциальности"""
-    privacy_text = (
-        "🔒 Политика конфиденциальности SENS Fit\n\n"
-        "• Фото хранятся не более 24 часов\n"
-        "• Данные используются только для подбора размера\n"
-        "• Мы не передаем данные третьим лицам\n"
-        "• Соблюдаем 152-ФЗ и GDPR\n\n"
-        f"По вопросам: {PRIVACY_EMAIL}"
-    )
-    await message.answer(privacy_text)
+    await message.answer(PRIVACY_TEXT)
+
+async def send_profile(message: Message, result: Union[ProfileReport, Exception]) -> None:
+    """Отправляет администратору снятый по /diag profile профиль"""
+    if isinstance(result, Exception):
+        await message.answer(f"Не удалось снять профиль: {result}", parse_mode=None)
+        return
+    await message.answer_document(FSInputFile(result.path), caption=result.summary()[:1024], parse_mode=None)
+
+@dp.message(Command("diag"), F.from_user.id.in_(ADMIN_USER_IDS))
+async def diag_command(message: Message, command: CommandObject):
+    """Диагностика для администраторов: /diag, /diag slow|trace on|off, /diag profile [секунд]"""
+    args = (command.args or '').split()
+    if len(args) == 2 and args[0] in ('slow', 'trace') and args[1] in ('on', 'off'):
+        toggle = diagnostics.set_slow if args[0] == 'slow' else diagnostics.set_trace
+        toggle(args[1] == 'on')
+    elif args[:1] == ['profile']:
+        try:
+            seconds = min(max(float(args[1]), 1.0), 300.0) if len(args) > 1 else PROFILE_SECONDS
+        except ValueError:
+            await message.answer("Использование: /diag profile [секунд]")
+            return
+        # Профиль снимается в фоне: обработчик не держит очередь апдейтов админа
+        # и остановку бота на все окно профилирования
+        if not diagnostics.start_profile(seconds, partial(send_profile, message)):
+            await message.answer("Профилирование уже идет")
+            return
+        await message.answer(f"Снимаю профиль {seconds:.0f} с...")
+        return
+    elif args:
+        await message.answer("Использование: /diag, /diag slow|trace on|off, /diag profile [секунд]")
+        return
+    await message.answer(diagnostics.status(), parse_mode=None)
 
 @dp.message(CommandStart())
 async def command_start_handler(message: Message) -> None:
@@ -144,11 +489,7 @@ async def command_start_handler(message: Message) -> None:
     user_id = message.from_user.id
     
     # Инициализируем данные пользователя
-    user_data[user_id] = {
-        'photos': {},
-        'quiz_data': {},
-        'last_recommendation': None
-    }
+    sessions.reset(user_id)
     
     welcome_text = (
         "SENS Fit 👋\n\n"
@@ -157,14 +498,9 @@ async def command_start_handler(message: Message) -> None:
         "Готовы продолжить?"
     )
     
-    keyboard = create_keyboard(
-        ("✅ Да", "consent_yes"),
-        ("❌ Нет", "consent_no")
-    )
-    
-    await message.answer(welcome_text, reply_markup=keyboard)
+    await message.answer(welcome_text, reply_markup=CONSENT_KEYBOARD)
 
-@dp.callback_query(lambda c: c.data == "consent_no")
+@callbacks.route(ConsentCallback, legacy="consent_{answer}", answer=Answer.no)
 async def handle_consent_no(callback: CallbackQuery):
     """Обработка отказа от согласия"""
     await callback.message.edit_text(
@@ -173,7 +509,7 @@ async def handle_consent_no(callback: CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "consent_yes")
+@callbacks.route(ConsentCallback, legacy="consent_{answer}", answer=Answer.yes)
 async def handle_consent_yes(callback: CallbackQuery, state: FSMContext):
     """Обработка согласия и переход к согласию на обработку данных"""
     consent_text = (
@@ -182,15 +518,10 @@ async def handle_consent_yes(callback: CallbackQuery, state: FSMContext):
         "Нажимая «Согласен», вы даёте согласие на 152-ФЗ / GDPR."
     )
     
-    keyboard = create_keyboard(
-        ("✅ Согласен", "data_consent_yes"),
-        ("❌ Отмена", "data_consent_no")
-    )
-    
-    await callback.message.edit_text(consent_text, reply_markup=keyboard)
+    await callback.message.edit_text(consent_text, reply_markup=DATA_CONSENT_KEYBOARD)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "data_consent_no")
+@callbacks.route(DataConsentCallback, legacy="data_consent_{answer}", answer=Answer.no)
 async def handle_data_consent_no(callback: CallbackQuery):
     """Обработка отказа от обработки данных"""
     await callback.message.edit_text(
@@ -199,23 +530,23 @@ async def handle_data_consent_no(callback: CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "data_consent_yes")
+@callbacks.route(DataConsentCallback, legacy="data_consent_{answer}", answer=Answer.yes)
 async def handle_data_consent_yes(callback: CallbackQuery, state: FSMContext):
     """Обработка согласия на данные и выбор метода"""
     method_text = "Как вам удобнее подобрать размер?"
     
-    keyboard = create_keyboard(
-        ("📸 Фото-скан (точнее)", "method_photo"),
-        ("✏️ Квиз без фото", "method_quiz")
-    )
-    
-    await callback.message.edit_text(method_text, reply_markup=keyboard)
+    await callback.message.edit_text(method_text, reply_markup=METHOD_KEYBOARD)
     await callback.answer()
 
 # ФОТО-СКАН СЦЕНАРИЙ
-@dp.callback_query(lambda c: c.data == "method_photo")
+@callbacks.route(MethodCallback, legacy="method_{method}", method=Method.photo)
 async def handle_method_photo(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора фото-скана"""
+    if not bodygram_breaker.available:
+        await callback.message.edit_text(SCAN_UNAVAILABLE_TEXT, reply_markup=QUIZ_FALLBACK_KEYBOARD)
+        await callback.answer()
+        return
+    
     photo_instructions = (
         "Нужно 2 фото в полный рост:\n"
         "1⃣ Спереди   2⃣ Профиль\n\n"
@@ -226,12 +557,10 @@ async def handle_method_photo(callback: CallbackQuery, state: FSMContext):
         "Когда будете готовы, нажмите «Сделать фото»."
     )
     
-    keyboard = create_keyboard(("📷 Сделать фото", "start_photo_process"))
-    
-    await callback.message.edit_text(photo_instructions, reply_markup=keyboard)
+    await callback.message.edit_text(photo_instructions, reply_markup=START_PHOTO_KEYBOARD)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "start_photo_process")
+@callbacks.route(StartPhotoCallback, legacy="start_photo_process")
 async def start_photo_process(callback: CallbackQuery, state: FSMContext):
     """Начало процесса фото-скана - запрос роста"""
     await state.set_state(UserStates.waiting_for_height)
@@ -245,15 +574,45 @@ async def handle_height_input(message: Message, state: FSMContext):
         height = int(message.text)
         if 130 <= height <= 220:
             user_id = message.from_user.id
-            user_data[user_id]['height'] = height
+            sessions.get_or_create(user_id).height = height
             
             await state.set_state(UserStates.waiting_for_front_photo)
-            await message.answer("Загрузите фронтальное фото.")
+            await message.answer(
+                "Загрузите фронтальное фото.\n\n"
+                "Можно сразу оба фото одним альбомом: первое спереди, второе сбоку."
+            )
         else:
             await message.answer("Пожалуйста, введите рост от 130 до 220 см.")
     except ValueError:
         await message.answer("Пожалуйста, введите число.")
 
+@dp.message(
+    StateFilter(UserStates.waiting_for_front_photo, UserStates.waiting_for_profile_photo),
+    F.media_group_id,
+)
+async def handle_photo_album(message: Message, state: FSMContext, album: List[Message]):
+    """Оба фото одним альбомом: скачиваются параллельно, скан стартует сразу"""
+    photos = [choose_photo_size(item.photo, PHOTO_MIN_SIDE) for item in album if item.photo]
+    if len(photos) < 2:
+        # Второе фото не пришло: обычный пошаговый путь
+        if await state.get_state() == UserStates.waiting_for_front_photo.state:
+            await handle_front_photo(message, state)
+        else:
+            await handle_profile_photo(message, state)
+        return
+    
+    user_id = message.from_user.id
+    front, profile = photos[:2]
+    images = await asyncio.gather(fetch_scan_photo(message.bot, front), fetch_scan_photo(message.bot, profile))
+    if None in images:
+        await message.answer("Не удалось скачать фото. Попробуйте еще раз.")
+        return
+    
+    sessions.set_photo(user_id, 'front', images[0], front.file_unique_id)
+    sessions.set_photo(user_id, 'profile', images[1], profile.file_unique_id)
+    await state.set_state(UserStates.waiting_for_profile_photo)
+    await start_scan(message, state)
+
 @dp.message(UserStates.waiting_for_front_photo)
 async def handle_front_photo(message: Message, state: FSMContext):
     """Обработка фронтального фото"""
@@ -263,20 +622,15 @@ async def handle_front_photo(message: Message, state: FSMContext):
     
     user_id = message.from_user.id
     
-    # Получаем фото
-    photo = message.photo[-1]
-    file = await message.bot.get_file(photo.file_id)
-    file_path = file.file_path
-    file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-    
-    # Скачиваем фото
-    img_bytes = await download_image_from_url(file_url)
+    # Скачиваем наименьший достаточный вариант фото и готовим его к скану
+    photo = choose_photo_size(message.photo, PHOTO_MIN_SIDE)
+    img_bytes = await fetch_scan_photo(message.bot, photo)
     if img_bytes is None:
         await message.answer("Не удалось скачать фото. Попробуйте еще раз.")
         return
     
     # Сохраняем фронтальное фото
-    user_data[user_id]['photos']['front'] = img_bytes
+    sessions.set_photo(user_id, 'front', img_bytes, photo.file_unique_id)
     
     await state.set_state(UserStates.waiting_for_profile_photo)
     await message.answer("Теперь фото сбоку (левый или правый профиль).")
@@ -290,68 +644,126 @@ async def handle_profile_photo(message: Message, state: FSMContext):
     
     user_id = message.from_user.id
     
-    # Получаем фото
-    photo = message.photo[-1]
-    file = await message.bot.get_file(photo.file_id)
-    file_path = file.file_path
-    file_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-    
-    # Скачиваем фото
-    img_bytes = await download_image_from_url(file_url)
+    # Скачиваем наименьший достаточный вариант фото и готовим его к скану
+    photo = choose_photo_size(message.photo, PHOTO_MIN_SIDE)
+    img_bytes = await fetch_scan_photo(message.bot, photo)
     if img_bytes is None:
         await message.answer("Не удалось скачать фото. Попробуйте еще раз.")
         return
     
     # Сохраняем профильное фото
-    user_data[user_id]['photos']['profile'] = img_bytes
+    sessions.set_photo(user_id, 'profile', img_bytes, photo.file_unique_id)
+    await start_scan(message, state)
+
+async def start_scan(message: Message, state: FSMContext):
+    """Ставит скан сохраненных фото в очередь или сразу отвечает из кеша"""
+    user_id = message.from_user.id
     
-    # Показываем обработку
+    # Повторно присланное фото не запускает второй скан, пока идет первый
+    if scan_queue.has_job(user_id):
+        await message.answer("Скан уже выполняется, результат придет в сообщении выше.")
+        return
+    
+    # Показываем обработку и ставим скан в очередь, ответ придет от воркера
     processing_msg = await message.answer("⏳ Анализируем фото… (~5 сек)")
     
+    # Те же фото и рост уже сканировались: отвечаем сразу, без очереди и API
+    cached = await get_cached_scan(user_id)
+    if cached:
+        await show_scan_result(user_id, processing_msg, state, cached, cached=True)
+        return
+    
+    # Bodygram лежит: не ставим скан в очередь, где он все равно упадет
+    if not bodygram_breaker.available:
+        await processing_msg.edit_text(SCAN_UNAVAILABLE_TEXT, reply_markup=QUIZ_FALLBACK_KEYBOARD)
+        return
+    
+    try:
+        await scan_queue.submit(ScanJob(user_id=user_id, processing_msg=processing_msg, state=state))
+    except ScanQueueFull as e:
+        logging.warning(f"Скан пользователя {user_id} отклонен: {e}")
+        await processing_msg.edit_text("Сейчас слишком много запросов. Попробуйте через пару минут.")
+
+async def process_scan_job(job: ScanJob):
+    """Выполняет скан из очереди и показывает результат"""
+    user_id = job.user_id
+    processing_msg = job.processing_msg
+    state = job.state
+    
     # Отправляем на API
     result = await send_photos_to_api(user_id)
-    
+    await show_scan_result(user_id, processing_msg, state, result)
+
+async def trace_scan_job(job: ScanJob):
+    """Скан из очереди; при включенных трассах - с трассой, как у обработчиков"""
+    await diagnostics.tracer.trace('process_scan_job', process_scan_job(job), user_id=job.user_id)
+
+async def show_scan_result(user_id: int, processing_msg: Message, state: FSMContext,
+                           result: Optional[Dict[str, str]], cached: bool = False):
+    """Сохраняет рекомендацию по скану и показывает ее пользователю"""
     if result:
+        result['source'] = 'scan'
+        session = sessions.get(user_id)
+        analytics.emit(
+            'recommendation', user_id, **result, cached=cached,
+            height=session.height if session is not None else None,
+        )
         # Сохраняем рекомендацию
-        user_data[user_id]['last_recommendation'] = result
+        sessions.get_or_create(user_id).last_recommendation = result
+        sessions.persist(user_id)
+        # Фото больше не нужны, удаляем сразу после скана
+        sessions.clear_photos(user_id)
         
         # Показываем результат
-        result_text = (
-            f"✔️ Ваш идеальный размер: **{result['size']}**\n"
-            f"Рекомендуемая модель:\n"
-            f"• {result['model']}\n"
-            f"• Ссылка: [🛍️ Купить на WB]({result['link']})"
+        result_text = SCAN_RESULT_TEMPLATE.format(
+            size=result['size'],
+            model=result['model'],
+            link=result['link'],
+            confidence=CONFIDENCE_LABELS[result['confidence']],
         )
+        if result['alternatives']:
+            result_text += SCAN_ALTERNATIVES_TEMPLATE.format(alternatives=result['alternatives'])
         
-        keyboard = create_keyboard(
-            ("✅ Подошло", "feedback_good"),
-            ("❌ Не подошло", "feedback_bad")
-        )
-        
-        await processing_msg.edit_text(result_text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+        await processing_msg.edit_text(result_text, reply_markup=FEEDBACK_KEYBOARD, parse_mode=ParseMode.MARKDOWN)
         await state.set_state(UserStates.waiting_for_feedback)
+    elif not bodygram_breaker.available:
+        await processing_msg.edit_text(SCAN_UNAVAILABLE_TEXT, reply_markup=QUIZ_FALLBACK_KEYBOARD)
     else:
         await processing_msg.edit_text("Ошибка при анализе фото. Попробуйте еще раз.")
 
+async def report_scan_progress(job: ScanJob, position: int, eta: float):
+    """Обновляет сообщение о скане: позиция в очереди и ожидаемое время"""
+    if position > 0:
+        text = f"⏳ Вы в очереди: {position}. Результат примерно через {math.ceil(eta)} сек"
+    else:
+        text = f"⏳ Анализируем фото… (~{math.ceil(eta)} сек)"
+    if job.processing_msg.text != text:
+        job.processing_msg = await job.processing_msg.edit_text(text)
+
+# Очередь сканов с пулом воркеров
+scan_queue = ScanQueue(
+    trace_scan_job,
+    report_scan_progress,
+    workers=SCAN_WORKERS,
+    maxsize=SCAN_QUEUE_MAXSIZE,
+    progress_interval=SCAN_PROGRESS_INTERVAL,
+)
+
 # КВИЗ СЦЕНАРИЙ
-@dp.callback_query(lambda c: c.data == "method_quiz")
+@callbacks.route(MethodCallback, legacy="method_{method}", method=Method.quiz)
 async def handle_method_quiz(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора квиза"""
     await state.set_state(UserStates.waiting_for_quiz_comfortable_bra)
     question_text = "Есть ли у вас сейчас бюстгальтер, который сидит комфортно?"
-    keyboard = create_keyboard(
-        ("👍 Да", "quiz_comfortable_yes"),
-        ("👎 Нет", "quiz_comfortable_no")
-    )
-    await callback.message.edit_text(question_text, reply_markup=keyboard)
+    await callback.message.edit_text(question_text, reply_markup=COMFORTABLE_KEYBOARD)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("quiz_comfortable_"))
-async def handle_comfortable_choice(callback: CallbackQuery, state: FSMContext):
+@callbacks.route(ComfortableCallback, legacy="quiz_comfortable_{answer}")
+async def handle_comfortable_choice(callback: CallbackQuery, callback_data: ComfortableCallback, state: FSMContext):
     """Обработка выбора удобного бюстгальтера"""
     user_id = callback.from_user.id
-    comfortable_type = callback.data.split("_")[2]
-    user_data[user_id]['quiz_data']['comfortable_bra'] = comfortable_type
+    comfortable_type = callback_data.answer.value
+    sessions.get_or_create(user_id).quiz_data['comfortable_bra'] = comfortable_type
     
     if comfortable_type == "yes":
         # Если есть удобный бюстгальтер
@@ -368,7 +780,7 @@ async def handle_current_size_input(message: Message, state: FSMContext):
     """Обработка ввода текущего размера"""
     current_size = message.text.strip()
     user_id = message.from_user.id
-    user_data[user_id]['quiz_data']['current_size'] = current_size
+    sessions.get_or_create(user_id).quiz_data['current_size'] = current_size
     
     await state.set_state(UserStates.waiting_for_quiz_underbust)
     await message.answer("Возьмите сантиметровую ленту. Измерьте под грудью (плотно). Введите число в см.")
@@ -380,7 +792,7 @@ async def handle_underbust_input(message: Message, state: FSMContext):
         underbust = int(message.text)
         if 60 <= underbust <= 120:
             user_id = message.from_user.id
-            user_data[user_id]['quiz_data']['underbust'] = underbust
+            sessions.get_or_create(user_id).quiz_data['underbust'] = underbust
             
             await state.set_state(UserStates.waiting_for_quiz_bust)
             await message.answer("Введите обхват груди (см):")
@@ -396,139 +808,68 @@ async def handle_bust_input(message: Message, state: FSMContext):
         bust = int(message.text)
         if 70 <= bust <= 140:
             user_id = message.from_user.id
-            user_data[user_id]['quiz_data']['bust'] = bust
+            sessions.get_or_create(user_id).quiz_data['bust'] = bust
             
             await state.set_state(UserStates.waiting_for_quiz_breast_shape)
-            await message.answer("Как бы вы описали форму груди?", reply_markup=create_keyboard(
-                ("🔻 Широкая база", "breast_shape_wide"),
-                ("🔸 Узкая / объёмная", "breast_shape_narrow"),
-                ("🔹 Низкий посад", "breast_shape_low"),
-                ("❔ Не знаю", "breast_shape_unknown")
-            ))
+            await message.answer("Как бы вы описали форму груди?", reply_markup=BREAST_SHAPE_KEYBOARD)
         else:
             await message.answer("Пожалуйста, введите число от 70 до 140 см.")
     except ValueError:
         await message.answer("Пожалуйста, введите число.")
 
-@dp.callback_query(lambda c: c.data.startswith("breast_shape_"))
-async def handle_breast_shape_choice(callback: CallbackQuery, state: FSMContext):
+@callbacks.route(BreastShapeCallback, legacy="breast_shape_{shape}")
+async def handle_breast_shape_choice(callback: CallbackQuery, callback_data: BreastShapeCallback, state: FSMContext):
     """Обработка выбора формы груди"""
     user_id = callback.from_user.id
-    breast_shape = callback.data.split("_")[2]
-    user_data[user_id]['quiz_data']['breast_shape'] = breast_shape
+    breast_shape = callback_data.shape.value
+    sessions.get_or_create(user_id).quiz_data['breast_shape'] = breast_shape
     
     await state.set_state(UserStates.waiting_for_quiz_bra_type)
-    await callback.message.edit_text("Какой тип бюстгальтера предпочитаете?", reply_markup=create_keyboard(
-        ("👙 Бралетт", "bra_type_bralette"),
-        ("💪 Спортивный", "bra_type_sport"),
-        ("💎 Классический", "bra_type_classic"),
-        ("🚀 Лёгкий push-up", "bra_type_pushup")
-    ))
+    await callback.message.edit_text("Какой тип бюстгальтера предпочитаете?", reply_markup=BRA_TYPE_KEYBOARD)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("bra_type_"))
-async def handle_bra_type_choice(callback: CallbackQuery, state: FSMContext):
+@callbacks.route(BraTypeCallback, legacy="bra_type_{bra_type}")
+async def handle_bra_type_choice(callback: CallbackQuery, callback_data: BraTypeCallback, state: FSMContext):
     """Обработка выбора типа бюстгальтера"""
     user_id = callback.from_user.id
-    bra_type = callback.data.split("_")[2]
-    user_data[user_id]['quiz_data']['bra_type'] = bra_type
+    bra_type = callback_data.bra_type.value
+    sessions.get_or_create(user_id).quiz_data['bra_type'] = bra_type
     
     await state.set_state(UserStates.waiting_for_quiz_priority)
-    await callback.message.edit_text("Что для вас важнее всего?", reply_markup=create_keyboard(
-        ("☁️ Комфорт", "priority_comfort"),
-        ("👁 Эстетика", "priority_aesthetics"),
-        ("🤸‍♀️ Поддержка", "priority_support")
-    ))
+    await callback.message.edit_text("Что для вас важнее всего?", reply_markup=PRIORITY_KEYBOARD)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("priority_"))
-async def handle_priority_choice(callback: CallbackQuery, state: FSMContext):
+@callbacks.route(PriorityCallback, legacy="priority_{priority}")
+async def handle_priority_choice(callback: CallbackQuery, callback_data: PriorityCallback, state: FSMContext):
     """Обработка выбора приоритета"""
     user_id = callback.from_user.id
-    priority = callback.data.split("_")[1]
-    user_data[user_id]['quiz_data']['priority'] = priority
+    priority = callback_data.priority.value
+    sessions.get_or_create(user_id).quiz_data['priority'] = priority
     
     await state.set_state(UserStates.waiting_for_quiz_skin_tone)
-    await callback.message.edit_text("Ваш оттенок кожи ближе к…", reply_markup=create_keyboard(
-        ("🌕 Светлый", "skin_tone_light"),
-        ("🏽 Средний", "skin_tone_medium"),
-        ("🏿 Тёмный", "skin_tone_dark")
-    ))
+    await callback.message.edit_text("Ваш оттенок кожи ближе к…", reply_markup=SKIN_TONE_KEYBOARD)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("skin_tone_"))
-async def handle_skin_tone_choice(callback: CallbackQuery, state: FSMContext):
+@callbacks.route(SkinToneCallback, legacy="skin_tone_{tone}")
+async def handle_skin_tone_choice(callback: CallbackQuery, callback_data: SkinToneCallback, state: FSMContext):
     """Обработка выбора тона кожи"""
     user_id = callback.from_user.id
-    skin_tone = callback.data.split("_")[2]
-    user_data[user_id]['quiz_data']['skin_tone'] = skin_tone
-    
-    # Получаем все данные квиза для отображения
-    quiz_data = user_data[user_id]['quiz_data']
-    
-    # Создаем текст с выбранными пунктами
-    summary_text = "📋 Ваши ответы:\n\n"
-    
-    # Добавляем каждый выбранный пункт
-    if 'comfortable_bra' in quiz_data:
-        comfortable_text = "👍 Да" if quiz_data['comfortable_bra'] == 'yes' else "👎 Нет"
-        summary_text += f"• Есть ли комфортный бюстгальтер: {comfortable_text}\n"
-    
-    if 'current_size' in quiz_data:
-        summary_text += f"• Текущий размер: {quiz_data['current_size']}\n"
-    
-    if 'underbust' in quiz_data:
-        summary_text += f"• Обхват под грудью: {quiz_data['underbust']} см\n"
-    
-    if 'bust' in quiz_data:
-        summary_text += f"• Обхват груди: {quiz_data['bust']} см\n"
-    
-    if 'breast_shape' in quiz_data:
-        shape_map = {
-            'wide': "🔻 Широкая база",
-            'narrow': "🔸 Узкая / объёмная", 
-            'low': "🔹 Низкий посад",
-            'unknown': "❔ Не знаю"
-        }
-        summary_text += f"• Форма груди: {shape_map.get(quiz_data['breast_shape'], quiz_data['breast_shape'])}\n"
-    
-    if 'bra_type' in quiz_data:
-        type_map = {
-            'bralette': "👙 Бралетт",
-            'sport': "💪 Спортивный",
-            'classic': "💎 Классический",
-            'pushup': "🚀 Лёгкий push-up"
-        }
-        summary_text += f"• Тип бюстгальтера: {type_map.get(quiz_data['bra_type'], quiz_data['bra_type'])}\n"
+    skin_tone = callback_data.tone.value
+    sessions.get_or_create(user_id).quiz_data['skin_tone'] = skin_tone
     
-    if 'priority' in quiz_data:
-        priority_map = {
-            'comfort': "☁️ Комфорт",
-            'aesthetics': "👁 Эстетика",
-            'support': "🤸‍♀️ Поддержка"
-        }
-        summary_text += f"• Приоритет: {priority_map.get(quiz_data['priority'], quiz_data['priority'])}\n"
-    
-    if 'skin_tone' in quiz_data:
-        tone_map = {
-            'light': "🌕 Светлый",
-            'medium': "🏽 Средний", 
-            'dark': "🏿 Тёмный"
-        }
-        summary_text += f"• Тон кожи: {tone_map.get(quiz_data['skin_tone'], quiz_data['skin_tone'])}\n"
+    # Сводка выбранных пунктов по готовым шаблонам
+    summary_text = render_quiz_summary(sessions.get_or_create(user_id).quiz_data)
     
     # Отправляем сообщение с выбранными пунктами
     await callback.message.edit_text(summary_text)
     
     # Отправляем отдельное сообщение с кнопкой "Рассчитать"
-    await callback.message.answer("Теперь нажмите «Рассчитать» для получения рекомендации:", reply_markup=create_keyboard(
-        ("🚀 Рассчитать", "quiz_calculate")
-    ))
+    await callback.message.answer("Теперь нажмите «Рассчитать» для получения рекомендации:", reply_markup=CALCULATE_KEYBOARD)
     
     await state.set_state(UserStates.waiting_for_quiz_calculate)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "quiz_calculate")
+@callbacks.route(CalculateCallback, legacy="quiz_calculate")
 async def handle_quiz_calculate(callback: CallbackQuery, state: FSMContext):
     """Обработка нажатия кнопки «Рассчитать»"""
     user_id = callback.from_user.id
@@ -541,22 +882,15 @@ async def handle_quiz_calculate(callback: CallbackQuery, state: FSMContext):
     
     if quiz_result:
         # Сохраняем рекомендацию
-        user_data[user_id]['last_recommendation'] = quiz_result
+        session = sessions.get_or_create(user_id)
+        quiz_result['source'] = 'quiz'
+        session.last_recommendation = quiz_result
+        analytics.emit('recommendation', user_id, **quiz_result, answers=dict(session.quiz_data))
         
         # Показываем результат
-        result_text = (
-            f"✔️ Рекомендуемый размер: **{quiz_result['size']}**\n"
-            f"Подойдёт модель:\n"
-            f"• {quiz_result['model']}\n"
-            f"Ссылки: [WB]({quiz_result['link']}) [Ozon]({quiz_result['link']})"
-        )
+        result_text = QUIZ_RESULT_TEMPLATE.format_map(quiz_result)
         
-        keyboard = create_keyboard(
-            ("✅ Подошло", "feedback_good"),
-            ("❌ Не подошло", "feedback_bad")
-        )
-        
-        await processing_msg.edit_text(result_text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+        await processing_msg.edit_text(result_text, reply_markup=FEEDBACK_KEYBOARD, parse_mode=ParseMode.MARKDOWN)
         await state.set_state(UserStates.waiting_for_feedback)
     else:
         await processing_msg.edit_text("Ошибка при расчете размера. Попробуйте еще раз.")
@@ -564,12 +898,19 @@ async def handle_quiz_calculate(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # ОБРАТНАЯ СВЯЗЬ
-@dp.callback_query(lambda c: c.data.startswith("feedback_"))
-async def handle_feedback(callback: CallbackQuery, state: FSMContext):
+@callbacks.route(FeedbackCallback, legacy="feedback_{result}")
+async def handle_feedback(callback: CallbackQuery, callback_data: FeedbackCallback, state: FSMContext):
     """Обработка обратной связи"""
-    feedback_type = callback.data.split("_")[1]
-    
-    if feedback_type == "good":
+    # Отзыв пишется вместе с размером, к которому он относится
+    session = sessions.get(callback.from_user.id)
+    recommendation = session.last_recommendation if session is not None else None
+    analytics.emit(
+        'feedback', callback.from_user.id,
+        result=callback_data.result.value,
+        source=recommendation.get('source') if recommendation else None,
+        size=recommendation.get('size') if recommendation else None,
+    )
+    if callback_data.result == Feedback.good:
         await callback.message.edit_text(
             "Спасибо! Это помогает нам стать точнее 💜\n\n"
             "Нажмите /start для нового подбора размера."
@@ -583,74 +924,142 @@ async def handle_feedback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
-async def download_image_from_url(file_url: str) -> Optional[bytes]:
-    """Скачивает изображение по URL"""
+async def download_photo(bot: Bot, photo: PhotoSize) -> Optional[bytes]:
+    """Скачивает фото из Telegram в память через пул соединений бота"""
+    buffer = io.BytesIO()
     try:
-        response = requests.get(file_url)
-        if response.status_code == 200:
-            return response.content
-        return None
+        with external_call_latency.time('telegram_file'), diagnostics.tracer.span('telegram_file'):
+            await bot.download(photo, destination=buffer, timeout=PHOTO_DOWNLOAD_TIMEOUT)
+        return buffer.getvalue()
     except Exception as e:
         logging.error(f"Ошибка при скачивании изображения: {e}")
         return None
 
+async def fetch_scan_photo(bot: Bot, photo: PhotoSize) -> Optional[bytes]:
+    """Скачивает фото и готовит его к скану; None, если скачать не удалось"""
+    img_bytes = await download_photo(bot, photo)
+    if img_bytes is None:
+        return None
+    with diagnostics.tracer.span('preprocess'):
+        return await image_preprocessor.process(img_bytes)
+
+async def scan_keys(user_id: int) -> Optional[Iterator[str]]:
+    """Ключи кеша для текущих фото и роста пользователя"""
+    session = sessions.get(user_id)
+    front_photo = await sessions.get_photo(user_id, 'front')
+    profile_photo = await sessions.get_photo(user_id, 'profile')
+    if session is None or front_photo is None or profile_photo is None or session.height is None:
+        return None
+    return scan_cache_keys(
+        session.height,
+        (sessions.get_photo_id(user_id, 'front'), front_photo),
+        (sessions.get_photo_id(user_id, 'profile'), profile_photo),
+    )
+
+async def get_cached_scan(user_id: int) -> Optional[Dict[str, str]]:
+    """Результат прошлого скана тех же фото, если он еще в кеше"""
+    keys = await scan_keys(user_id)
+    if keys is None:
+        return None
+    return await scan_cache.get(keys)
+
 async def send_photos_to_api(user_id: int) -> Optional[Dict[str, str]]:
     """Отправляет фото на API и возвращает результат"""
     try:
-        user_info = user_data[user_id]
-        front_photo = user_info['photos']['front']
-        profile_photo = user_info['photos']['profile']
-        height = user_info['height']
-        
-        front_photo_base64 = base64.b64encode(front_photo).decode()
-        profile_photo_base64 = base64.b64encode(profile_photo).decode()
-        
-        headers = {"Authorization": API_KEY}
+        session = sessions.get(user_id)
+        front_photo = await sessions.get_photo(user_id, 'front')
+        profile_photo = await sessions.get_photo(user_id, 'profile')
+        if session is None or front_photo is None or profile_photo is None or session.height is None:
+            logging.error(f"Нет фото или роста для скана пользователя {user_id}")
+            return None
+        height = session.height
+        # Ключи кеша по уже прочитанным фото: пока идет скан, сессию могут сбросить
+        keys = scan_cache_keys(
+            height,
+            (sessions.get_photo_id(user_id, 'front'), front_photo),
+            (sessions.get_photo_id(user_id, 'profile'), profile_photo),
+        )
         
-        data = {
-            "customScanId": f"scan_{user_id}",
-            "photoScan": {
+        # Фото кодируются в base64 по кускам прямо в тело запроса
+        data = ScanRequestBody(
+            f"scan_{user_id}",
+            {
                 "age": DEFAULT_AGE,
                 "weight": DEFAULT_WEIGHT,
                 "height": height * 10,  # API ожидает в мм
                 "gender": DEFAULT_GENDER,
-                "frontPhoto": front_photo_base64,
-                "rightPhoto": profile_photo_base64,
             },
-        }
-        
-        response = requests.post(url=API_URL, headers=headers, json=data)
+            {
+                "frontPhoto": front_photo,
+                "rightPhoto": profile_photo,
+            },
+        )
         
-        if response.status_code == 200:
-            api_data = response.json()
-            return parse_api_response_for_size(api_data)
-        else:
-            logging.error(f"API request failed: {response.text}")
-            return None
-            
+        with external_call_latency.time('bodygram_scan'), diagnostics.tracer.span('bodygram_scan'):
+            api_data = await bodygram_client.create_scan(data)
+        result = parse_api_response_for_size(api_data)
+        if result:
+            await scan_cache.set(keys, result)
+        return result
+    
+    except BodygramError as e:
+        logging.error(f"API request failed: {e}")
+        return None
     except Exception as e:
         logging.error(f"Ошибка при отправке на API: {e}")
         return None
 
 
 
-def parse_api_response_for_size(data: Dict[str, Any]) -> Dict[str, str]:
-    """Парсит ответ API для получения размера бюстгальтера"""
-    try:
-        # Здесь должна быть логика определения размера на основе измерений
-        # Пока возвращаем заглушку
-        measurements = data.get('measurements', [])
-        
-        # Простая логика определения размера (заглушка)
-        size = "75C EU (34C US)"
-        model = "SENS Seamless SoftTouch, цвет Nude"
-        link = f"{WILDBERRIES_BASE_URL}12345678"
-        
+def build_recommendation(size: str, size_eu: str, quiz_data: Dict[str, Any]) -> Dict[str, str]:
+    """Подбирает модель из каталога под размер и предпочтения пользователя.
+
+    Если размера нет в каталоге (например, 60AA или 95G), модель подбирается
+    в ближайшем размере из наличия, и это написано рядом с моделью.
+    """
+    stocked = catalog.nearest_size(size_eu)
+    skus = catalog.recommend(
+        stocked,
+        bra_type=quiz_data.get('bra_type'),
+        skin_tone=quiz_data.get('skin_tone'),
+        breast_shape=quiz_data.get('breast_shape'),
+        priority=quiz_data.get('priority'),
+    ) if stocked is not None else []
+    if not skus:
+        # Каталог пуст: отправляем в общий каталог магазинов
         return {
             'size': size,
-            'model': model,
-            'link': link
+            'model': "Модели в этом размере сейчас нет в наличии",
+            'link': WILDBERRIES_BASE_URL,
+            'ozon_link': OZON_BASE_URL,
         }
+    sku = skus[0]
+    recommendation = {
+        'size': size,
+        'model': sku.title,
+        'link': f"{WILDBERRIES_BASE_URL}{sku.wb_article}",
+        'ozon_link': f"{OZON_BASE_URL}{sku.ozon_article}",
+    }
+    if stocked != normalize_size(size_eu):
+        recommendation['model'] = NEAREST_SIZE_MODEL_TEMPLATE.format(model=sku.title, stocked=stocked)
+        recommendation['stocked_size'] = stocked
+    return recommendation
+
+def parse_api_response_for_size(data: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Парсит ответ API для получения размера бюстгальтера"""
+    try:
+        estimate = size_mapper.map(data)
+        if estimate is None:
+            logging.error("В ответе API нет обхватов под грудью и по груди")
+            return None
+        
+        recommendation = build_recommendation(estimate.size.label, estimate.size.eu, {})
+        recommendation['confidence'] = estimate.confidence
+        recommendation['alternatives'] = ", ".join(size.eu for size in estimate.alternatives)
+        # Мерки скана, в см: по ним и отзывам настраивается размерная сетка
+        recommendation['underbust'] = round(estimate.underbust, 1)
+        recommendation['bust'] = round(estimate.bust, 1)
+        return recommendation
     except Exception as e:
         logging.error(f"Ошибка при парсинге ответа API: {e}")
         return None
@@ -658,65 +1067,109 @@ def parse_api_response_for_size(data: Dict[str, Any]) -> Dict[str, str]:
 def calculate_quiz_size(user_id: int) -> Optional[Dict[str, str]]:
     """Рассчитывает размер на основе квиза"""
     try:
-        quiz_data = user_data[user_id]['quiz_data']
+        quiz_data = sessions.get_or_create(user_id).quiz_data
         underbust = quiz_data['underbust']
         bust = quiz_data['bust']
         
         # Если есть текущий размер, используем его как основу
         if 'current_size' in quiz_data and quiz_data['current_size']:
             size = quiz_data['current_size']
+            size_eu = normalize_size(size)
         else:
-            # Рассчитываем размер на основе измерений
-            cup_size = bust - underbust
-            if cup_size <= 10:
-                cup = "A"
-            elif cup_size <= 12:
-                cup = "B"
-            elif cup_size <= 14:
-                cup = "C"
-            elif cup_size <= 16:
-                cup = "D"
-            else:
-                cup = "E"
-            
-            band_size = underbust
-            if band_size < 70:
-                band_size = 70
-            elif band_size > 90:
-                band_size = 90
-            
-            size = f"{band_size}{cup} EU"
-        
-        # Выбираем модель на основе предпочтений
-        bra_type = quiz_data.get('bra_type', 'classic')
-        priority = quiz_data.get('priority', 'comfort')
-        skin_tone = quiz_data.get('skin_tone', 'light')
-        
-        if bra_type == 'bralette':
-            model = "SENS Bralette Comfort (беж), код 12345678"
-        elif bra_type == 'sport':
-            model = "SENS Sport Active (черный), код 12345679"
-        elif bra_type == 'pushup':
-            model = "SENS Push-up Delight (беж), код 12345680"
-        else:  # classic
-            model = "SENS SoftTouch Classic (беж), код 12345678"
+            # Рассчитываем размер на основе измерений по размерной сетке
+            result = size_chart.lookup(underbust, bust)
+            size = result.label
+            size_eu = result.eu
         
-        link = f"{WILDBERRIES_BASE_URL}12345678"
-        
-        return {
-            'size': size,
-            'model': model,
-            'link': link
-        }
+        # Выбираем модель из каталога на основе предпочтений
+        return build_recommendation(size, size_eu, quiz_data)
     except Exception as e:
         logging.error(f"Ошибка при расчете размера: {e}")
         return None
 
+def create_bot(shards: int = 1) -> Bot:
+    """Создает бота с общей сессией aiohttp; shards - сколько процессов делят лимит отправки"""
+    # Одна сессия aiohttp с пулом соединений на всё время жизни бота:
+    # через неё идут и запросы к Bot API, и скачивание фото.
+    # Готовые клавиатуры она отправляет заранее сериализованными
+    session = PrebuiltMarkupSession(
+        api=TELEGRAM_API, limit=TELEGRAM_CONNECTION_LIMIT, timeout=TELEGRAM_REQUEST_TIMEOUT,
+    )
+    # Все исходящие запросы проходят через планировщик лимитов Telegram
+    send_scheduler.set_global_rate(SEND_GLOBAL_RATE / shards)
+    session.middleware(send_scheduler)
+    return Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+async def start_services(worker_index: int = 0) -> None:
+    """Запускает фоновые подсистемы: хранилище, очередь сканов, очистку сессий, метрики"""
+    if persistent_store is not None:
+        await persistent_store.start()
+    await scan_cache.start()
+    image_preprocessor.start()
+    await scan_queue.start()
+    sessions.start()
+    catalog.start()
+    await analytics.start()
+    diagnostics.install_signals()
+    diagnostics.set_slow('slow' in DIAGNOSTICS_ENABLE)
+    diagnostics.set_trace('trace' in DIAGNOSTICS_ENABLE)
+    if METRICS_PORT:
+        # Воркеры runner.py слушают соседние порты: METRICS_PORT + номер воркера
+        metrics_server.port = METRICS_PORT + worker_index
+        await metrics_server.start()
+
+async def stop_services() -> None:
+    """Дожидается текущих сканов и останавливает фоновые подсистемы"""
+    await scan_queue.stop()
+    await metrics_server.stop()
+    await sessions.stop()
+    await catalog.stop()
+    await analytics.close()
+    await diagnostics.close()
+    if persistent_store is not None:
+        await persistent_store.close()
+    await scan_cache.close()
+    await image_preprocessor.close()
+    await bodygram_client.close()
+    logging.info(f"Bodygram stats: {bodygram_client.stats.as_dict()}")
+    logging.info(f"Bodygram circuit breaker: {bodygram_breaker.stats()}")
+    # Каждое попадание в кеш - сэкономленный вызов Bodygram средней длительности
+    saved_seconds = scan_cache.hits * bodygram_client.stats.avg_latency
+    logging.info(f"Scan cache stats: {scan_cache.stats()}, saved ~{saved_seconds:.1f} s of API time")
+    logging.info(f"Photo preprocessing stats: {image_preprocessor.stats()}")
+    logging.info(f"Outbound scheduler stats: {send_scheduler.stats()}")
+    logging.info(f"Flood control stats: {flood_control.stats()}")
+    logging.info(f"Analytics stats: {analytics.stats()}")
+    logging.info(f"Logging stats: {log_pipeline.stats()}")
+
 async def main() -> None:
     """Главная функция"""
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    await dp.start_polling(bot)
+    bot = create_bot()
+    await start_services()
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(
+                dp,
+                bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                base_url=WEBHOOK_BASE_URL,
+                secret_token=WEBHOOK_SECRET,
+                drain_timeout=WEBHOOK_DRAIN_TIMEOUT,
+                close_bot_session=False,
+            )
+        else:
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        # Сессию закрываем после остановки очереди сканов: дожидаемые сканы еще
+        # правят сообщения, иначе aiogram молча открыл бы новую сессию без закрытия
+        await stop_services()
+        await bot.session.close()
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    asyncio.run(main())
\ No newline at end of file
+    log_pipeline.install()
+    try:
+        asyncio.run(main())
+    finally:
+        log_pipeline.close()
\ No newline at end of file
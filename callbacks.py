@@ -0,0 +1,167 @@
+"""Схема callback_data и маршрутизация нажатий кнопок одним поиском по словарю.
+
+Все поля callback_data - перечисления, поэтому множество допустимых строк
+конечно. Роутер заранее упаковывает каждую комбинацию значений и хранит
+таблицу "строка -> (обработчик, разобранный объект)": нажатие кнопки
+разрешается одним обращением к dict, без перебора фильтров и split().
+"""
+import itertools
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+
+class Answer(str, Enum):
+    yes = 'yes'
+    no = 'no'
+
+
+class Method(str, Enum):
+    photo = 'photo'
+    quiz = 'quiz'
+
+
+class BreastShape(str, Enum):
+    wide = 'wide'
+    narrow = 'narrow'
+    low = 'low'
+    unknown = 'unknown'
+
+
+class BraType(str, Enum):
+    bralette = 'bralette'
+    sport = 'sport'
+    classic = 'classic'
+    pushup = 'pushup'
+
+
+class Priority(str, Enum):
+    comfort = 'comfort'
+    aesthetics = 'aesthetics'
+    support = 'support'
+
+
+class SkinTone(str, Enum):
+    light = 'light'
+    medium = 'medium'
+    dark = 'dark'
+
+
+class Feedback(str, Enum):
+    good = 'good'
+    bad = 'bad'
+
+
+# Короткие префиксы: callback_data ограничена 64 байтами
+class ConsentCallback(CallbackData, prefix='c'):
+    answer: Answer
+
+
+class DataConsentCallback(CallbackData, prefix='dc'):
+    answer: Answer
+
+
+class MethodCallback(CallbackData, prefix='m'):
+    method: Method
+
+
+class StartPhotoCallback(CallbackData, prefix='ph'):
+    pass
+
+
+class ComfortableCallback(CallbackData, prefix='qc'):
+    answer: Answer
+
+
+class BreastShapeCallback(CallbackData, prefix='qs'):
+    shape: BreastShape
+
+
+class BraTypeCallback(CallbackData, prefix='qt'):
+    bra_type: BraType
+
+
+class PriorityCallback(CallbackData, prefix='qp'):
+    priority: Priority
+
+
+class SkinToneCallback(CallbackData, prefix='qn'):
+    tone: SkinTone
+
+
+class CalculateCallback(CallbackData, prefix='qx'):
+    pass
+
+
+class FeedbackCallback(CallbackData, prefix='f'):
+    result: Feedback
+
+
+Route = Tuple[CallableObject, CallbackData]
+
+
+class CallbackRouter:
+    """Таблица маршрутов callback_data с разбором полей заранее"""
+
+    def __init__(self):
+        self.routes: Dict[str, Route] = {}
+
+    def route(self, schema: Type[CallbackData], legacy: Optional[str] = None,
+              **fixed: Enum) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+        """Регистрирует обработчик для всех значений схемы или только для fixed.
+
+        legacy - формат старой строки callback_data, например "breast_shape_{shape}":
+        кнопки в уже отправленных сообщениях продолжают работать.
+        """
+        def decorator(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            target = CallableObject(handler)
+            for callback_data in self._expand(schema, fixed):
+                self._add(callback_data.pack(), target, callback_data)
+                if legacy is not None:
+                    values = {name: value.value for name, value in callback_data}
+                    self._add(legacy.format(**values), target, callback_data)
+            return handler
+        return decorator
+
+    def _add(self, data: str, target: CallableObject, callback_data: CallbackData) -> None:
+        if data in self.routes:
+            raise ValueError(f"callback_data {data!r} уже зарегистрирована")
+        self.routes[data] = (target, callback_data)
+
+    @staticmethod
+    def _expand(schema: Type[CallbackData], fixed: Dict[str, Enum]):
+        """Все комбинации значений полей схемы"""
+        names = list(schema.model_fields)
+        choices = []
+        for name in names:
+            if name in fixed:
+                choices.append((fixed[name],))
+                continue
+            annotation = schema.model_fields[name].annotation
+            if not (isinstance(annotation, type) and issubclass(annotation, Enum)):
+                raise TypeError(f"Поле {schema.__name__}.{name} должно быть перечислением")
+            choices.append(tuple(annotation))
+        for combination in itertools.product(*choices):
+            yield schema(**dict(zip(names, combination)))
+
+    async def resolve(self, callback: CallbackQuery) -> Any:
+        """Фильтр: маршрут для callback_data или False.
+
+        Асинхронный намеренно: синхронные фильтры aiogram вызывает через asyncio.to_thread.
+        """
+        route = self.routes.get(callback.data)
+        if route is None:
+            return False
+        return {'callback_route': route}
+
+    async def dispatch(self, callback: CallbackQuery, callback_route: Route, **data: Any) -> Any:
+        target, callback_data = callback_route
+        return await target.call(callback, callback_data=callback_data, **data)
+
+    def attach(self, router: Router) -> None:
+        """Подключает таблицу одним обработчиком callback_query"""
+        router.callback_query.register(self.dispatch, self.resolve)
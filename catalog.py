@@ -0,0 +1,213 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# Шаг обхвата пояса между соседними размерами, см
+BAND_STEP = 5
+
+# Сколько ответов nearest_size помнить: реальных размеров сетки около сотни
+NEAREST_CACHE_SIZE = 1024
+
+# Вес совпадения каждого признака при ранжировании
+MATCH_WEIGHTS = {
+    'bra_type': 8,
+    'skin_tone': 4,
+    'breast_shape': 2,
+    'priority': 1,
+}
+
+
+@dataclass(frozen=True)
+class Sku:
+    """Товарная позиция: модель в конкретном цвете"""
+    sku: str
+    model: str
+    bra_type: str
+    colour: str
+    skin_tones: Tuple[str, ...]
+    breast_shapes: Tuple[str, ...]
+    priorities: Tuple[str, ...]
+    sizes: FrozenSet[str]
+    wb_article: str
+    ozon_article: str
+
+    @property
+    def title(self) -> str:
+        """Название для сообщения, например SENS SoftTouch Classic (беж), код 12345678"""
+        return f"{self.model} ({self.colour}), код {self.wb_article}"
+
+
+def normalize_size(size: str) -> str:
+    """Приводит размер к виду ключа каталога: ' 75c eu ' -> '75C'"""
+    return size.upper().replace('EU', '').replace(' ', '')
+
+
+def _parse_size(size: str) -> Optional[Tuple[int, int]]:
+    """'75C' -> (75, 3): обхват пояса и номер чашки по порядку AA, A, B, ..."""
+    band = size.rstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    cup = size[len(band):]
+    if not band.isdigit() or not cup:
+        return None
+    if cup == 'AA':
+        return int(band), 0
+    if len(cup) != 1:
+        return None
+    return int(band), ord(cup) - ord('A') + 1
+
+
+def _split(value: Any) -> Tuple[str, ...]:
+    """Список из JSON или строка 'a|b|c' из CSV"""
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return tuple(part.strip() for part in str(value or '').split('|') if part.strip())
+
+
+def _parse_sku(row: Dict[str, Any]) -> Sku:
+    return Sku(
+        sku=str(row['sku']),
+        model=row['model'],
+        bra_type=row['bra_type'],
+        colour=row['colour'],
+        skin_tones=_split(row.get('skin_tones')),
+        breast_shapes=_split(row.get('breast_shapes')),
+        priorities=_split(row.get('priorities')),
+        sizes=frozenset(normalize_size(size) for size in _split(row.get('sizes'))),
+        wb_article=str(row['wb_article']),
+        ozon_article=str(row['ozon_article']),
+    )
+
+
+def load_skus(path: str) -> List[Sku]:
+    """Читает каталог из JSON (список объектов) или CSV"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = json.load(f)
+    return [_parse_sku(row) for row in rows]
+
+
+class CatalogIndex:
+    """Неизменяемый снимок каталога с индексами по размеру и признакам"""
+
+    def __init__(self, skus: List[Sku]):
+        self.skus = skus
+        self.by_size: Dict[str, List[int]] = {}
+        self.by_feature: Dict[str, Dict[str, FrozenSet[int]]] = {}
+        features: Dict[str, Dict[str, set]] = {name: {} for name in MATCH_WEIGHTS}
+        for i, sku in enumerate(skus):
+            for size in sku.sizes:
+                self.by_size.setdefault(size, []).append(i)
+            features['bra_type'].setdefault(sku.bra_type, set()).add(i)
+            for tone in sku.skin_tones:
+                features['skin_tone'].setdefault(tone, set()).add(i)
+            for shape in sku.breast_shapes:
+                features['breast_shape'].setdefault(shape, set()).add(i)
+            for priority in sku.priorities:
+                features['priority'].setdefault(priority, set()).add(i)
+        for name, values in features.items():
+            self.by_feature[name] = {value: frozenset(ids) for value, ids in values.items()}
+        self._stocked = [(size, parsed) for size in sorted(self.by_size) if (parsed := _parse_size(size))]
+        # Ключ - разобранный размер, а не текст пользователя; кеш ограничен,
+        # чтобы поток мусорных размеров не раздувал память
+        self._nearest = lru_cache(maxsize=NEAREST_CACHE_SIZE)(self._find_nearest)
+
+    def nearest_size(self, size: str) -> Optional[str]:
+        """Ближайший размер в наличии: сам size или соседний по сетке.
+
+        Расстояние - сдвиг пояса плюс сдвиг объема чашки: пояс на шаг больше
+        с чашкой на одну меньше (сестринский размер, 65D -> 70C) ближе, чем
+        тот же пояс с другой чашкой. При равенстве - меньший сдвиг пояса.
+        Неразборчивый размер - None.
+        """
+        size = normalize_size(size)
+        if size in self.by_size:
+            return size
+        parsed = _parse_size(size)
+        if parsed is None:
+            return None
+        return self._nearest(*parsed)
+
+    def _find_nearest(self, band: int, cup: int) -> Optional[str]:
+        scored = []
+        for stocked, (stocked_band, stocked_cup) in self._stocked:
+            bands = (stocked_band - band) // BAND_STEP
+            volume = abs(bands + stocked_cup - cup)
+            scored.append((abs(bands) + volume, abs(bands), stocked))
+        return min(scored)[2] if scored else None
+
+    def rank(self, size: str, limit: int = 1, **preferences: Optional[str]) -> List[Sku]:
+        """Лучшие позиции в наличии в размере size по совпадению предпочтений"""
+        candidates = self.by_size.get(normalize_size(size))
+        if not candidates:
+            return []
+        matches = [
+            (self.by_feature[name].get(value, frozenset()), MATCH_WEIGHTS[name])
+            for name, value in preferences.items()
+            if value is not None and name in MATCH_WEIGHTS
+        ]
+        scored = sorted(
+            candidates,
+            key=lambda i: (-sum(weight for ids, weight in matches if i in ids), i),
+        )
+        return [self.skus[i] for i in scored[:limit]]
+
+
+class Catalog:
+    """Каталог из локального файла с перезагрузкой при изменении файла"""
+
+    def __init__(self, path: str, *, reload_interval: float = 10.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = os.path.getmtime(path)
+        self.index = CatalogIndex(load_skus(path))
+        self._watcher: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.index.skus)
+
+    def recommend(self, size: str, *, limit: int = 1, **preferences: Optional[str]) -> List[Sku]:
+        """Ранжированные позиции для размера и предпочтений из квиза"""
+        return self.index.rank(size, limit=limit, **preferences)
+
+    def nearest_size(self, size: str) -> Optional[str]:
+        """Размер в наличии, ближайший к size; None, если каталог пуст"""
+        return self.index.nearest_size(size)
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает файл, если он изменился; при ошибке оставляет прежний каталог"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return False
+            # Битый файл не перечитываем на каждой проверке, ждем следующего изменения
+            self._mtime = mtime
+            index = CatalogIndex(load_skus(self.path))
+        except Exception as e:
+            logging.error(f"Не удалось перезагрузить каталог {self.path}: {e}")
+            return False
+        # Снимок подменяется целиком, поиск никогда не видит частично загруженный каталог
+        self.index = index
+        logging.info(f"Каталог перезагружен: {len(index.skus)} позиций")
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            self.reload_if_changed()
+
+    def start(self) -> None:
+        """Запускает слежение за файлом каталога"""
+        if self._watcher is None and self.reload_interval > 0:
+            self._watcher = asyncio.create_task(self._watch(), name="catalog-watcher")
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
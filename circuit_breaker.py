@@ -0,0 +1,159 @@
+"""Предохранитель (circuit breaker) для вызовов внешнего API.
+
+closed - вызовы идут, исходы копятся в скользящем окне window секунд.
+Как только в окне набралось min_calls вызовов и доля неудачных (ошибки и
+вызовы дольше slow_call секунд) достигла failure_rate, предохранитель
+размыкается: open - вызовы сразу отклоняются. Через open_seconds он
+переходит в half_open и пропускает не больше half_open_calls пробных
+вызовов одновременно; half_open_calls успешных подряд замыкают его,
+первая же неудача снова размыкает.
+
+allow() возвращает поколение - номер смены состояния, в котором вызов
+пропущен. Исход вызова из прошлого поколения (например, начатого в closed и
+завершенного уже в half_open) record() и release() пропускают: он не
+занимал пробный слот и к текущему состоянию не относится.
+"""
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Числовое значение состояния для gauge в мониторинге
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+StateListener = Callable[[str, str], None]
+
+
+class CircuitBreaker:
+    """Скользящая доля ошибок и медленных вызовов с автоматическим восстановлением"""
+
+    def __init__(
+        self,
+        *,
+        window: float = 60.0,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call: float = 15.0,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 2,
+        on_change: Optional[StateListener] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.on_change = on_change
+        self.clock = clock
+        self.state = CLOSED
+        # Растет при каждой смене состояния
+        self.generation = 0
+        # (время завершения, неудачный ли вызов) за последние window секунд
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_successes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def available(self) -> bool:
+        """Пропустит ли предохранитель вызов; в отличие от allow() ничего не меняет"""
+        if self.state == OPEN:
+            return self.clock() - self._opened_at >= self.open_seconds
+        if self.state == HALF_OPEN:
+            return self._trials < self.half_open_calls
+        return True
+
+    def allow(self) -> Optional[int]:
+        """Поколение, в котором разрешен вызов, или None, если вызов отклонен.
+
+        Исход разрешенного вызова нужно сообщить в record() или release() с этим поколением.
+        """
+        if self.state == OPEN:
+            if self.clock() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return None
+            self._set_state(HALF_OPEN)
+            self._trials = 0
+            self._trial_successes = 0
+        if self.state == HALF_OPEN:
+            if self._trials >= self.half_open_calls:
+                self.rejected += 1
+                return None
+            self._trials += 1
+        return self.generation
+
+    def record(self, generation: int, ok: bool, latency: float = 0.0) -> None:
+        """Исход разрешенного вызова; медленный успешный вызов считается неудачным"""
+        if generation != self.generation:
+            # Вызов пропущен до смены состояния, на решение он уже не влияет
+            return
+        failed = not ok or latency >= self.slow_call
+        now = self.clock()
+        if self.state == HALF_OPEN:
+            self._trials = max(0, self._trials - 1)
+            if failed:
+                self._open(now)
+            else:
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self._close()
+            return
+        self._calls.append((now, failed))
+        self._failures += failed
+        self._trim(now)
+        if len(self._calls) >= self.min_calls and self._failures >= self.failure_rate * len(self._calls):
+            self._open(now)
+
+    def release(self, generation: int) -> None:
+        """Разрешенный вызов отменен до исхода: освобождает пробный слот, на долю ошибок не влияет"""
+        if generation == self.generation and self.state == HALF_OPEN:
+            self._trials = max(0, self._trials - 1)
+
+    def _trim(self, now: float) -> None:
+        calls = self._calls
+        while calls and calls[0][0] <= now - self.window:
+            _, failed = calls.popleft()
+            self._failures -= failed
+
+    def _open(self, now: float) -> None:
+        self._opened_at = now
+        self.opened += 1
+        self._set_state(OPEN)
+
+    def _close(self) -> None:
+        self._calls.clear()
+        self._failures = 0
+        self._set_state(CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        previous, self.state = self.state, state
+        self.generation += 1
+        if self.on_change is not None:
+            try:
+                self.on_change(previous, state)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика смены состояния предохранителя: {e}")
+
+    @property
+    def current_failure_rate(self) -> float:
+        """Доля неудачных вызовов в окне"""
+        self._trim(self.clock())
+        return self._failures / len(self._calls) if self._calls else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'state': self.state,
+            'failure_rate': round(self.current_failure_rate, 3),
+            'calls_in_window': len(self._calls),
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
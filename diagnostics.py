@@ -0,0 +1,387 @@
+"""Диагностика в работающем процессе: включается командой /diag или сигналом.
+
+- LoopWatchdog - поиск шагов event loop дольше threshold. Задача в loop
+  отмечается каждые threshold/2 секунд, поток-сторож проверяет отметку и,
+  если loop занят, снимает стек потока loop в этот момент: видно, кто
+  блокирует loop, а не только что он был заблокирован.
+- SamplingProfiler - профиль потока loop за окно в seconds секунд: стек
+  снимается по SIGALRM раз в interval секунд, стеки пишутся в формате
+  folded (flamegraph.pl, speedscope).
+- HandlerTracer - inner middleware: длительность каждого обработчика и
+  участков внутри него (span) построчно в JSONL.
+
+Выключенные, они почти ничего не стоят: сторожа и профайлера нет вовсе,
+трассировщик проверяет один флаг на апдейт, span() - одну contextvar.
+"""
+import asyncio
+import collections
+import contextvars
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TextIO, Tuple, Union
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import InstrumentationMiddleware
+
+StallListener = Callable[[float], None]
+
+# Сколько ближайших к месту остановки кадров стека писать в лог
+LOG_STACK_FRAMES = 12
+
+_spans: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar('trace_spans', default=None)
+
+
+def _timestamp() -> str:
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+
+
+class LoopWatchdog:
+    """Шаги event loop дольше threshold секунд: счетчик, последние стеки и запись в лог"""
+
+    def __init__(self, threshold: float = 0.1, history: int = 20, on_stall: Optional[StallListener] = None):
+        self.threshold = threshold
+        self.on_stall = on_stall
+        self.recent: Deque[Dict[str, Any]] = collections.deque(maxlen=history)
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._beat = 0.0
+        self._thread_id = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[threading.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        # У каждого запуска свой флаг: сторож прошлого запуска мог еще не проснуться
+        self._stop = threading.Event()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        threading.Thread(target=self._watch, args=(self._stop,), name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        self._task = None
+
+    async def _heartbeat(self) -> None:
+        interval = self.threshold / 2
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(interval)
+            self.max_lag = max(self.max_lag, time.monotonic() - self._beat - interval)
+
+    def _watch(self, stop: threading.Event) -> None:
+        reported = None
+        while not stop.wait(self.threshold / 4):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.threshold / 2
+            if lag <= self.threshold or beat == reported:
+                continue
+            # Одна запись на одну остановку loop, стек - в момент, пока он занят
+            reported = beat
+            frame = sys._current_frames().get(self._thread_id)
+            frames = traceback.extract_stack(frame) if frame is not None else traceback.StackSummary()
+            self.stalls += 1
+            self.recent.append({'at': time.time(), 'lag_ms': round(lag * 1000), 'stack': ''.join(frames.format())})
+            stack = ''.join(traceback.StackSummary.from_list(frames[-LOG_STACK_FRAMES:]).format())
+            logging.warning(f"Event loop занят дольше {lag * 1000:.0f} мс, стек:\n{stack}")
+            if self.on_stall is not None:
+                self.on_stall(lag)
+
+
+@dataclass
+class ProfileReport:
+    """Итог профилирования: файл folded и самые частые функции на вершине стека"""
+    path: str
+    samples: int
+    top: List[Tuple[str, int]]
+
+    def summary(self, limit: int = 10) -> str:
+        lines = [f"Сэмплов: {self.samples}, файл: {os.path.basename(self.path)}"]
+        for name, count in self.top[:limit]:
+            lines.append(f"{count * 100 / max(self.samples, 1):5.1f}% {name}")
+        return '\n'.join(lines)
+
+
+# Получает итог фонового профилирования или исключение, из-за которого его не снять
+ProfileListener = Callable[[Union[ProfileReport, Exception]], Awaitable[None]]
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер потока event loop за окно времени.
+
+    Стек снимает обработчик SIGALRM по таймеру setitimer: он выполняется в
+    главном потоке (потоке loop) и получает прерванный кадр, где бы тот ни
+    был. Поток-сэмплер для этого не годится: GIL достается ему в основном,
+    когда loop отпускает его в select(), и профиль почти целиком из select.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.005):
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+        self._stacks: Dict[str, int] = collections.Counter()
+        self._leaves: Dict[str, int] = collections.Counter()
+
+    async def run(self, seconds: float) -> ProfileReport:
+        """Снимает стеки потока loop seconds секунд и пишет их в файл folded"""
+        if self.running:
+            raise RuntimeError("Профилирование уже идет")
+        if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("Профайлеру нужен Unix и event loop в главном потоке")
+        self.running = True
+        self._stacks.clear()
+        self._leaves.clear()
+        previous = signal.signal(signal.SIGALRM, self._sample)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+            self.running = False
+        return await asyncio.to_thread(self._write, dict(self._stacks), self._leaves.most_common())
+
+    def _sample(self, signum: int, frame: Any) -> None:
+        # Кадр самого обработчика сигнала в стек не попадает: frame - прерванный кадр
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        if names:
+            self._stacks[';'.join(reversed(names))] += 1
+            self._leaves[names[0]] += 1
+
+    def _write(self, stacks: Dict[str, int], top: List[Tuple[str, int]]) -> ProfileReport:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{_timestamp()}-{os.getpid()}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+        return ProfileReport(path, sum(stacks.values()), top)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('spans', 'name', 'started')
+
+    def __init__(self, spans: Dict[str, float], name: str):
+        self.spans = spans
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.spans[self.name] = self.spans.get(self.name, 0.0) + time.perf_counter() - self.started
+
+
+class HandlerTracer(BaseMiddleware):
+    """Трассы обработчиков: длительность и участки span() построчно в trace-<время>-<pid>.jsonl"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.enabled = False
+        self.path: Optional[str] = None
+        self.traced = 0
+        self._file: Optional[TextIO] = None
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"trace-{_timestamp()}-{os.getpid()}.jsonl")
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1 << 16)
+        self.enabled = True
+
+    def disable(self) -> None:
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._file.close()
+        self._file = None
+
+    @staticmethod
+    def span(name: str) -> Any:
+        """Участок внутри трассируемого обработчика; вне трассы ничего не делает"""
+        spans = _spans.get()
+        return _NO_SPAN if spans is None else _Span(spans, name)
+
+    async def trace(self, name: str, call: Awaitable[Any], **fields: Any) -> Any:
+        """Выполняет call и пишет его трассу, если трассировка включена"""
+        if not self.enabled:
+            return await call
+        spans: Dict[str, float] = {}
+        token = _spans.set(spans)
+        started = time.perf_counter()
+        try:
+            return await call
+        finally:
+            elapsed = time.perf_counter() - started
+            _spans.reset(token)
+            if self._file is not None:
+                self._file.write(json.dumps({
+                    'ts': time.time(),
+                    'handler': name,
+                    **fields,
+                    'ms': round(elapsed * 1000, 3),
+                    'spans': {key: round(value * 1000, 3) for key, value in spans.items()},
+                }, ensure_ascii=False) + '\n')
+                self.traced += 1
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.enabled:
+            return await handler(event, data)
+        user = data.get('event_from_user')
+        update = data.get('event_update')
+        return await self.trace(
+            InstrumentationMiddleware.handler_name(data),
+            handler(event, data),
+            user_id=user.id if user is not None else None,
+            update_id=update.update_id if update is not None else None,
+        )
+
+
+class Diagnostics:
+    """Сторож loop, профайлер и трассировщик вместе; SIGUSR1 - профиль, SIGUSR2 - сторож и трассы"""
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        slow_threshold: float = 0.1,
+        profile_interval: float = 0.005,
+        profile_seconds: float = 30.0,
+        on_stall: Optional[StallListener] = None,
+    ):
+        self.directory = directory
+        self.profile_seconds = profile_seconds
+        self.watchdog = LoopWatchdog(slow_threshold, on_stall=on_stall)
+        self.profiler = SamplingProfiler(directory, profile_interval)
+        self.tracer = HandlerTracer(directory)
+        self._profile_task: Optional[asyncio.Task] = None
+
+    def set_slow(self, enabled: bool) -> None:
+        if enabled:
+            self.watchdog.start()
+        else:
+            self.watchdog.stop()
+
+    def set_trace(self, enabled: bool) -> None:
+        if enabled:
+            self.tracer.enable()
+        else:
+            self.tracer.disable()
+
+    async def profile(self, seconds: Optional[float] = None) -> ProfileReport:
+        report = await self.profiler.run(seconds or self.profile_seconds)
+        logging.info(f"Профиль записан: {report.path}, сэмплов: {report.samples}")
+        return report
+
+    @property
+    def profiling(self) -> bool:
+        """Идет ли фоновое профилирование, в том числе еще не начавшее сэмплировать"""
+        return self._profile_task is not None or self.profiler.running
+
+    def start_profile(self, seconds: Optional[float] = None, on_done: Optional[ProfileListener] = None) -> bool:
+        """Снимает профиль в фоновой задаче, не задерживая вызвавший обработчик.
+
+        Возвращает False, если профилирование уже идет. on_done получает
+        итог или исключение, когда окно профилирования закончится.
+        """
+        if self.profiling:
+            return False
+        self._profile_task = asyncio.create_task(self._run_profile(seconds, on_done), name="diagnostics-profile")
+        self._profile_task.add_done_callback(self._profile_finished)
+        return True
+
+    def _profile_finished(self, task: asyncio.Task) -> None:
+        if self._profile_task is task:
+            self._profile_task = None
+
+    async def _run_profile(self, seconds: Optional[float], on_done: Optional[ProfileListener]) -> None:
+        try:
+            result: Union[ProfileReport, Exception] = await self.profile(seconds)
+        except Exception as e:
+            logging.error(f"Не удалось снять профиль: {e}")
+            result = e
+        if on_done is None:
+            return
+        try:
+            await on_done(result)
+        except Exception as e:
+            logging.error(f"Ошибка при отправке профиля: {e}")
+
+    def install_signals(self) -> None:
+        """SIGUSR1 снимает профиль, SIGUSR2 включает и выключает сторожа и трассы"""
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGUSR1, self._on_profile_signal)
+        loop.add_signal_handler(signal.SIGUSR2, self._on_toggle_signal)
+
+    def _on_profile_signal(self) -> None:
+        self.start_profile()
+
+    def _on_toggle_signal(self) -> None:
+        enabled = not (self.watchdog.running or self.tracer.enabled)
+        self.set_slow(enabled)
+        self.set_trace(enabled)
+        logging.warning(f"Диагностика {'включена' if enabled else 'выключена'} по SIGUSR2")
+
+    async def close(self) -> None:
+        self.set_slow(False)
+        self.set_trace(False)
+        task = self._profile_task
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def status(self) -> str:
+        watchdog = self.watchdog
+        lines = [
+            f"Сторож loop: {'вкл' if watchdog.running else 'выкл'} (порог {watchdog.threshold * 1000:.0f} мс), "
+            f"остановок: {watchdog.stalls}, макс. задержка: {watchdog.max_lag * 1000:.0f} мс",
+            f"Трассы: {'вкл' if self.tracer.enabled else 'выкл'}, записано: {self.tracer.traced}"
+            + (f", файл: {self.tracer.path}" if self.tracer.path else ''),
+            f"Профайлер: {'идет' if self.profiling else 'свободен'}",
+        ]
+        if watchdog.recent:
+            last = watchdog.recent[-1]
+            frames = last['stack'].strip().splitlines()[-2:]
+            lines.append(f"Последняя остановка: {last['lag_ms']} мс\n" + '\n'.join(frames))
+        return '\n'.join(lines)
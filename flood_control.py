@@ -0,0 +1,154 @@
+"""Защита от повторных нажатий и флуда одного пользователя.
+
+FloodControlMiddleware - outer middleware для сообщений и нажатий кнопок:
+1. Повтор того же нажатия (пользователь, сообщение, callback_data), пока
+   первое обрабатывается и еще dedupe_window секунд после, отбрасывается:
+   на него отвечает только answerCallbackQuery, чтобы погасить часики.
+2. Апдейты одного пользователя обрабатываются по одному под его
+   asyncio.Lock; замок живет, пока у пользователя есть апдейты в работе.
+3. /start и фото ограничены корзиной токенов на пользователя; о превышении
+   пользователь узнает один раз, пока корзина не наполнится.
+
+Подключается после MediaGroupMiddleware: альбом доходит сюда одним
+сообщением, и его фото не ждут друг друга под замком.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from outbound import TokenBucket
+
+DropListener = Callable[[str], None]
+
+LIMIT_TEXT = "Слишком много запросов подряд. Подождите несколько секунд и попробуйте снова."
+
+
+@dataclass
+class _UserLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Апдейты пользователя, которые держат или ждут замок
+    holders: int = 0
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """Дедупликация нажатий, очередь апдейтов пользователя и лимиты на /start и фото"""
+
+    def __init__(
+        self,
+        *,
+        dedupe_window: float = 2.0,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_users: int = 100000,
+        on_drop: Optional[DropListener] = None,
+    ):
+        self.dedupe_window = dedupe_window
+        # вид апдейта ('start', 'photo') -> (токенов в секунду, емкость корзины)
+        self.limits = limits or {}
+        self.max_users = max_users
+        self.on_drop = on_drop
+        # (user_id, message_id, data) -> до какого момента повтор отбрасывается; inf - еще в работе
+        self._recent: "OrderedDict[Tuple[int, int, str], float]" = OrderedDict()
+        self._locks: Dict[int, _UserLock] = {}
+        self._buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+        # Пользователи, уже предупрежденные о лимите по этому виду апдейтов
+        self._warned: Dict[Tuple[int, str], None] = {}
+        self.dropped: Dict[str, int] = {}
+
+    @staticmethod
+    def update_kind(event: TelegramObject) -> Optional[str]:
+        """Вид апдейта для лимитов: 'start', 'photo' или None"""
+        if isinstance(event, Message):
+            if event.photo:
+                return 'photo'
+            if event.text and event.text.split(maxsplit=1)[0].split('@')[0] == '/start':
+                return 'start'
+        return None
+
+    def _drop(self, reason: str) -> None:
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        if self.on_drop is not None:
+            self.on_drop(reason)
+
+    def _is_duplicate(self, key: Tuple[int, int, str], now: float) -> bool:
+        recent = self._recent
+        # Ключи добавляются по времени, поэтому устаревшие лежат в начале
+        while recent:
+            oldest_key, until = next(iter(recent.items()))
+            if until > now and len(recent) <= self.max_users:
+                break
+            del recent[oldest_key]
+        if key in recent and recent[key] > now:
+            return True
+        recent[key] = float('inf')
+        recent.move_to_end(key)
+        return False
+
+    def _allow(self, user_id: int, kind: str, now: float) -> bool:
+        rate, capacity = self.limits[kind]
+        key = (user_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            if len(self._buckets) > self.max_users:
+                old_key, _ = self._buckets.popitem(last=False)
+                self._warned.pop(old_key, None)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.try_take(now)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        now = time.monotonic()
+
+        dedupe_key = None
+        if isinstance(event, CallbackQuery) and event.message is not None:
+            dedupe_key = (user.id, event.message.message_id, event.data or '')
+            if self._is_duplicate(dedupe_key, now):
+                self._drop('duplicate_callback')
+                await event.answer()
+                return None
+
+        kind = self.update_kind(event)
+        if kind in self.limits:
+            if not self._allow(user.id, kind, now):
+                self._drop(f'rate_{kind}')
+                if (user.id, kind) not in self._warned:
+                    self._warned[(user.id, kind)] = None
+                    await event.answer(LIMIT_TEXT)
+                return None
+            self._warned.pop((user.id, kind), None)
+
+        entry = self._locks.get(user.id)
+        if entry is None:
+            entry = self._locks[user.id] = _UserLock()
+        entry.holders += 1
+        try:
+            async with entry.lock:
+                return await handler(event, data)
+        finally:
+            entry.holders -= 1
+            if not entry.holders:
+                del self._locks[user.id]
+            if dedupe_key is not None:
+                # Окно повторов отсчитывается от конца обработки первого нажатия
+                self._recent[dedupe_key] = time.monotonic() + self.dedupe_window
+                self._recent.move_to_end(dedupe_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'locked_users': len(self._locks),
+            'tracked_callbacks': len(self._recent),
+            'dropped': dict(self.dropped),
+        }
@@ -0,0 +1,137 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import multiprocessing.context
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence
+
+from aiogram.types import PhotoSize
+from PIL import Image, ImageOps
+
+
+def choose_photo_size(sizes: Sequence[PhotoSize], min_side: int) -> PhotoSize:
+    """Самый маленький вариант фото, у которого короткая сторона не меньше min_side.
+
+    Если такого нет, берется самый большой: лучше качества Telegram не даст.
+    """
+    ordered: List[PhotoSize] = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if min(size.width, size.height) >= min_side:
+            return size
+    return ordered[-1]
+
+
+def preprocess_image(data: bytes, max_side: int, quality: int) -> bytes:
+    """Поворачивает фото по EXIF, уменьшает до max_side и пересохраняет JPEG без метаданных.
+
+    Выполняется в процессе пула, поэтому функция верхнего уровня и без состояния.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        # thumbnail только уменьшает и сохраняет пропорции
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = io.BytesIO()
+        # Без exif= Pillow не переносит метаданные (GPS, модель камеры) в новый файл
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+# Пустой __main__ на время запуска процесса пула, см. _PoolProcess
+_EMPTY_MAIN = types.ModuleType('__main__')
+
+
+class _PoolProcess(multiprocessing.context.ForkServerProcess):
+    """Процесс пула, которому не нужен __main__.
+
+    multiprocessing передает дочернему процессу путь к __main__, и тот заново
+    импортирует его как __mp_main__: для bot.py это проверка окружения,
+    Dispatcher, каталог, сетка и все хранилища в каждом процессе пула. Путь
+    берется из sys.modules['__main__'] в момент запуска процесса, поэтому на
+    это время там пустой модуль; запуск идет в потоке event loop, другие
+    потоки к __main__ не обращаются. Процессы форкаются от forkserver, в
+    котором заранее импортирован только этот модуль.
+    """
+
+    @staticmethod
+    def _Popen(process_obj):
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = _EMPTY_MAIN
+        try:
+            return multiprocessing.context.ForkServerProcess._Popen(process_obj)
+        finally:
+            sys.modules['__main__'] = main
+
+
+class _PoolContext(multiprocessing.context.ForkServerContext):
+    Process = _PoolProcess
+
+
+def _pool_context() -> multiprocessing.context.BaseContext:
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        # Windows: только spawn, процессы пула импортируют __main__ заново
+        return multiprocessing.get_context('spawn')
+    context = _PoolContext()
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class ImagePreprocessor:
+    """Подготовка фото к скану в пуле процессов, вне event loop"""
+
+    def __init__(self, *, workers: int = 2, max_side: int = 1280, quality: int = 85):
+        self.workers = workers
+        self.max_side = max_side
+        self.quality = quality
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.failures = 0
+
+    def start(self) -> None:
+        if self._pool is None and self.workers > 0:
+            # Не fork: fork процесса с потоками (SQLite, чтение очереди) может унаследовать
+            # занятые блокировки. forkserver - чистый процесс без потоков бота
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+    async def process(self, data: bytes) -> bytes:
+        """Обработанное фото; при ошибке или выключенном пуле - исходное"""
+        if self._pool is None:
+            return data
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._pool, preprocess_image, data, self.max_side, self.quality
+            )
+        except BrokenProcessPool as e:
+            # Процесс пула упал (например, OOM на огромном фото): пул пересоздаем
+            self.failures += 1
+            logging.error(f"Пул подготовки фото сломан, пересоздаем: {e}")
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            self.start()
+            return data
+        except Exception as e:
+            self.failures += 1
+            logging.warning(f"Не удалось обработать фото, отправляем исходное: {e}")
+            return data
+        self.bytes_in += len(data)
+        self.bytes_out += len(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'failures': self.failures,
+        }
@@ -0,0 +1,243 @@
+"""Логирование без записи в поток вывода из event loop.
+
+Код, который пишет в лог, только кладет запись в очередь (QueueHandler):
+сообщение собирается и обрезается до max_chars, к записи приклеиваются поля
+контекста - update_id, user_id, session_id апдейта, в котором она сделана.
+JSON собирает и пишет в stdout QueueListener в отдельном потоке. Если
+очередь полна, запись отбрасывается, а не ждет.
+
+Одно место в коде (файл и строка) пишет не больше sample_rate записей в
+секунду, например "Update id=... is handled" от aiogram на каждый апдейт;
+остальные отбрасываются, а их число попадает в поле sampled_out следующей
+записи оттуда же. Предупреждения и ошибки (WARNING и выше) не отбрасываются
+никогда: всплеск ошибок - как раз то, что нужно видеть целиком.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+FORMATS = ('json', 'text')
+
+DropListener = Callable[[str], None]
+
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Добавляет поля ко всем записям лога внутри блока"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer middleware апдейтов: update_id, user_id и session_id во всех записях апдейта"""
+
+    def __init__(self, session_id: Optional[Callable[[int], Optional[str]]] = None):
+        self.session_id = session_id
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        fields: Dict[str, Any] = {'update_id': getattr(event, 'update_id', None)}
+        user = data.get('event_from_user')
+        if user is not None:
+            fields['user_id'] = user.id
+            if self.session_id is not None:
+                session_id = self.session_id(user.id)
+                if session_id is not None:
+                    fields['session_id'] = session_id
+        with log_context(**fields):
+            return await handler(event, data)
+
+
+class SamplingFilter(logging.Filter):
+    """Не больше rate записей в секунду с одной строки кода; WARNING и выше проходят всегда"""
+
+    def __init__(self, rate: int, on_drop: Optional[DropListener] = None):
+        super().__init__()
+        self.rate = rate
+        self.on_drop = on_drop
+        # (файл, строка) -> [секунда, пропущено записей, отброшено с прошлой пропущенной]
+        self._windows: Dict[Tuple[str, int], List[int]] = {}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = [second, 0, 0]
+        elif window[0] != second:
+            window[0], window[1] = second, 0
+        if window[1] >= self.rate:
+            window[2] += 1
+            self.sampled_out += 1
+            if self.on_drop is not None:
+                self.on_drop('sampled')
+            return False
+        window[1] += 1
+        if window[2]:
+            record.sampled_out = window[2]
+            window[2] = 0
+        return True
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [+{len(text) - max_chars} символов]"
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладет в очередь готовое сообщение с контекстом; при полной очереди не ждет"""
+
+    def __init__(self, log_queue: queue.Queue, max_chars: int, on_drop: Optional[DropListener]):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы сообщения могут измениться, пока запись ждет в очереди
+        message = _truncate(record.getMessage(), self.max_chars)
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        record.context = _context.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop('queue_full')
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON; выполняется в потоке QueueListener"""
+
+    def __init__(self, static_fields: Optional[Dict[str, Any]] = None, max_chars: int = 0):
+        super().__init__()
+        self.static_fields = static_fields or {}
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(self.static_fields)
+        entry.update(getattr(record, 'context', {}))
+        sampled_out = getattr(record, 'sampled_out', 0)
+        if sampled_out:
+            entry['sampled_out'] = sampled_out
+        if record.exc_info:
+            entry['exc'] = _truncate(self.formatException(record.exc_info), self.max_chars)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемая строка с полями контекста в конце, для локального запуска"""
+
+    def __init__(self, static_fields: Optional[Dict[str, Any]] = None, max_chars: int = 0):
+        super().__init__('%(asctime)s %(levelname)s:%(name)s:%(message)s')
+        self.static_fields = static_fields or {}
+        self.max_chars = max_chars
+
+    def formatException(self, exc_info: Any) -> str:
+        return _truncate(super().formatException(exc_info), self.max_chars)
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {**self.static_fields, **getattr(record, 'context', {})}
+        sampled_out = getattr(record, 'sampled_out', 0)
+        if sampled_out:
+            fields['sampled_out'] = sampled_out
+        line = super().format(record)
+        if not fields:
+            return line
+        return line + ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+
+
+class LogPipeline:
+    """Корневой логгер через очередь и поток записи; install() при старте, close() при остановке"""
+
+    def __init__(
+        self,
+        *,
+        level: str = 'INFO',
+        fmt: str = 'json',
+        max_chars: int = 2000,
+        sample_rate: int = 20,
+        queue_size: int = 10000,
+        on_drop: Optional[DropListener] = None,
+    ):
+        if fmt not in FORMATS:
+            raise ValueError(f"Формат лога должен быть json или text, получено: {fmt}")
+        self.level = level.upper()
+        self.fmt = fmt
+        self.max_chars = max_chars
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._handler = _QueueHandler(self.queue, max_chars, on_drop)
+        self._sampler = SamplingFilter(sample_rate, on_drop)
+        self._handler.addFilter(self._sampler)
+        self._output: Optional[logging.Handler] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    @property
+    def depth(self) -> int:
+        """Записи, ожидающие потока записи"""
+        return self.queue.qsize()
+
+    def install(self, *, stream: Optional[TextIO] = None, **static_fields: Any) -> "LogPipeline":
+        """Заменяет обработчики корневого логгера; static_fields попадают в каждую запись"""
+        formatter_class = JsonFormatter if self.fmt == 'json' else TextFormatter
+        self._output = logging.StreamHandler(stream or sys.stdout)
+        self._output.setFormatter(formatter_class(static_fields, self.max_chars))
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self._handler)
+        root.setLevel(self.level)
+        self._listener = logging.handlers.QueueListener(self.queue, self._output)
+        self._listener.start()
+        return self
+
+    def close(self) -> None:
+        """Дописывает очередь и дальше пишет в поток вывода напрямую"""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self._listener = None
+        root = logging.getLogger()
+        root.removeHandler(self._handler)
+        root.addHandler(self._output)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': self.depth,
+            'dropped': self._handler.dropped,
+            'sampled_out': self._sampler.sampled_out,
+        }
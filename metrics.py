@@ -0,0 +1,217 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Свой минимальный реестр вместо prometheus_client: бот однопоточный, поэтому
+наблюдение - это поиск корзины и два сложения без блокировок, а значения
+gauge считаются только в момент запроса /metrics.
+"""
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм, секунды: от быстрых обработчиков до скана Bodygram
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """Гистограмма с одной меткой"""
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.bounds = tuple(buckets)
+        # значение метки -> [счетчики корзин..., +Inf, сумма]
+        self._series: Dict[str, List[float]] = {}
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.bounds) + 1) + [0.0]
+        series[bisect_left(self.bounds, seconds)] += 1
+        series[-1] += seconds
+
+    def time(self, label_value: str) -> "_Timer":
+        """Контекстный менеджер, замеряющий блок кода"""
+        return _Timer(self, label_value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, series in self._series.items():
+            label = _labels((self.label,), (label_value,))
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_value', 'started')
+
+    def __init__(self, histogram: Histogram, label_value: str):
+        self.histogram = histogram
+        self.label_value = label_value
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(self.label_value, time.perf_counter() - self.started)
+
+
+class Counter:
+    """Счетчик с набором меток"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, label_values: Tuple[Any, ...], amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое считается функцией в момент запроса метрик"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.read()}"]
+
+
+class MetricsRegistry:
+    """Набор метрик и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def histogram(self, name: str, documentation: str, label: str,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label, buckets))
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str]) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, read))
+
+    def _register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.warning(f"Не удалось получить метрику {metric.name}: {e}")
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """Длительность каждого обработчика и переходы состояний UserStates.
+
+    Подключается как inner middleware: фильтры уже выбрали обработчик,
+    а FSMContext и исходное состояние лежат в data.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.latency = registry.histogram('bot_handler_seconds', 'Длительность обработчиков апдейтов', 'handler')
+        self.errors = registry.counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',))
+        self.transitions = registry.counter(
+            'bot_fsm_transitions_total', 'Переходы между состояниями FSM', ('from_state', 'to_state'),
+        )
+        self.entered = registry.counter('bot_fsm_state_entered_total', 'Входы в состояние FSM', ('state',))
+
+    @staticmethod
+    def handler_name(data: Dict[str, Any]) -> str:
+        # Нажатия кнопок идут через общий CallbackRouter.dispatch: берем обработчик маршрута
+        route = data.get('callback_route')
+        handler = route[0] if route is not None else data.get('handler')
+        return getattr(getattr(handler, 'callback', None), '__name__', 'unknown')
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        name = self.handler_name(data)
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc((name,))
+            raise
+        finally:
+            self.latency.observe(name, time.perf_counter() - started)
+            state = data.get('state')
+            if state is not None:
+                before = data.get('raw_state')
+                after = await state.get_state()
+                if after != before:
+                    self.transitions.inc((before or '', after or ''))
+                    if after is not None:
+                        self.entered.inc((after,))
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics для Prometheus"""
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int, path: str = '/metrics'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self) -> None:
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Метрики доступны на {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
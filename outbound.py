@@ -0,0 +1,222 @@
+"""Планировщик исходящих запросов к Bot API.
+
+Telegram ограничивает отправку: около 30 сообщений в секунду на бота и около
+одного в секунду в один чат, при превышении отвечает 429 с retry_after.
+OutboundScheduler - middleware сессии aiogram: каждый запрос с chat_id ждет
+токен в корзине своего чата, затем в общей корзине; 429 выдерживает паузу
+retry_after и повторяется. Пауза ставится на чат, а если за время паузы 429
+пришел и из другого чата, значит, исчерпан общий лимит бота - тогда на паузу
+встает и общая корзина. Правки одного сообщения, которые еще ждут своей
+очереди, склеиваются: в Telegram уходит только последний текст.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, TelegramMethod
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: каждый берет токен сразу и ждет свою очередь"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Забирает токен и возвращает, через сколько секунд им можно пользоваться"""
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        return max(0.0, self.updated - now + max(0.0, -self.tokens) / self.rate)
+
+    def try_take(self, now: float) -> bool:
+        """Забирает токен, только если он есть прямо сейчас; без резервирования"""
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, until: float) -> None:
+        """Ни одного токена до until (ответ 429 с retry_after)"""
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, until)
+
+
+@dataclass
+class _PendingEdit:
+    """Правка сообщения, ждущая токена; более поздние правки подменяют method"""
+    method: EditMessageText
+    future: asyncio.Future
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Лимиты Telegram на бота и на чат, повтор после 429 и склейка правок"""
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        # LRU корзин по чатам: вытесняются давно молчавшие, их корзины и так полны
+        self._chats: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._edits: Dict[Tuple[Hashable, int], _PendingEdit] = {}
+        # Последний 429: чат и конец его паузы
+        self._last_retry_chat: Hashable = None
+        self._last_retry_until = 0.0
+        self.depth = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.global_pauses = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+
+    def set_global_rate(self, rate: float) -> None:
+        """Общий лимит бота, например доля одного процесса из нескольких"""
+        self.global_bucket = TokenBucket(rate, rate)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            # getUpdates, getFile, answerCallbackQuery и т.п. под лимиты рассылки не попадают
+            return await make_request(bot, method)
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            return await self._edit(make_request, bot, method, chat_id)
+        return await self._schedule(make_request, bot, method, chat_id)
+
+    async def _edit(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                    method: EditMessageText, chat_id: Hashable) -> Any:
+        """Правка сообщения: пока она ждет токена, следующие правки только меняют текст"""
+        key = (chat_id, method.message_id)
+        pending = self._edits.get(key)
+        if pending is not None:
+            pending.method = method
+            self.coalesced += 1
+            return await asyncio.shield(pending.future)
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку забирает колбэк, если склеенных правок не было
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        pending = self._edits[key] = _PendingEdit(method, future)
+        try:
+            result = await self._schedule(make_request, bot, pending, chat_id)
+        except BaseException as e:
+            if self._edits.get(key) is pending:
+                del self._edits[key]
+            if not future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    async def _schedule(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                        request: Any, chat_id: Hashable) -> Any:
+        """Ждет токенов и отправляет; после 429 ставит чат на паузу и повторяет"""
+        attempt = 0
+        while True:
+            await self._acquire(chat_id)
+            if isinstance(request, _PendingEdit):
+                # С этого момента новые правки сообщения пойдут отдельным запросом
+                key = (chat_id, request.method.message_id)
+                if self._edits.get(key) is request:
+                    del self._edits[key]
+                method = request.method
+            else:
+                method = request
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retried += 1
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logging.warning(f"Telegram 429 в чате {chat_id}: пауза {e.retry_after} с, повтор {attempt}")
+                self._pause(chat_id, e.retry_after)
+                continue
+            self.sent += 1
+            return result
+
+    def _pause(self, chat_id: Hashable, retry_after: float) -> None:
+        """Пауза чата после 429; 429 из разных чатов подряд - пауза всего бота"""
+        now = time.monotonic()
+        until = now + retry_after
+        self._bucket(chat_id).pause(until)
+        if self._last_retry_until > now and self._last_retry_chat != chat_id:
+            if self.global_bucket.paused_until < until:
+                self.global_pauses += 1
+                logging.warning(f"Telegram 429 из нескольких чатов: общая пауза {retry_after} с")
+            self.global_bucket.pause(until)
+        if until >= self._last_retry_until:
+            self._last_retry_chat, self._last_retry_until = chat_id, until
+
+    async def _acquire(self, chat_id: Hashable) -> None:
+        """Ждет токен чата, затем общий токен"""
+        started = time.monotonic()
+        self.acquired += 1
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        try:
+            await self._wait(self._bucket(chat_id))
+            await self._wait(self.global_bucket)
+        finally:
+            self.depth -= 1
+            self.total_wait += time.monotonic() - started
+
+    @staticmethod
+    async def _wait(bucket: TokenBucket) -> None:
+        delay = bucket.reserve(time.monotonic())
+        while delay > 0:
+            await asyncio.sleep(delay)
+            # Пока ждали, пришел 429: занимаем место в очереди после паузы
+            now = time.monotonic()
+            delay = bucket.reserve(now) if bucket.paused_until > now else 0.0
+
+    def _bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и счетчики отправки"""
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'pending_edits': len(self._edits),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+            'global_pauses': self.global_pauses,
+            'avg_wait': round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+        }
@@ -0,0 +1,292 @@
+"""Буферы фото: активные в памяти, остывшие - зашифрованными на диске.
+
+Фото, к которому не обращались spill_after секунд, и самые давние фото,
+когда в памяти их больше max_resident_bytes, уходят в файлы во временном
+каталоге процесса. Пишет их отдельный поток, поэтому обработчики и event
+loop диск не ждут. Мелкие фото (меньше min_spill_size) всегда в памяти.
+
+Файлы зашифрованы AES-256-GCM с ключом, который есть только в памяти
+процесса; id фото входит в связанные данные, так что подменить один файл
+другим нельзя. После удаления файла (по TTL фото, после скана, при
+вытеснении сессии) или после остановки процесса его содержимое не
+восстановить даже с копии диска; каталог удаляется при остановке. Читает
+файлы тот же поток через mmap: шифротекст проверяется и расшифровывается
+прямо из страниц файла, после чего фото снова становится активным и живет
+в памяти.
+"""
+import asyncio
+import itertools
+import logging
+import mmap
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+NONCE_SIZE = 12
+
+
+class _Photo:
+    __slots__ = ('data', 'size', 'last_access', 'path', 'nonce', 'spilling', 'loading')
+
+    def __init__(self, data: bytes):
+        self.data: Optional[bytes] = data
+        self.size = len(data)
+        self.last_access = time.monotonic()
+        self.path: Optional[str] = None
+        self.nonce = b''
+        self.spilling = False
+        # Чтение с диска, которое уже идет: его ждут все get() этого фото
+        self.loading: Optional[asyncio.Future] = None
+
+
+class PhotoBufferStore:
+    """Фото по числовому id; spill_dir=None - все фото только в памяти"""
+
+    def __init__(
+        self,
+        *,
+        spill_dir: Optional[str] = None,
+        spill_after: float = 60.0,
+        max_resident_bytes: int = 256 << 20,
+        min_spill_size: int = 64 << 10,
+        maintain_interval: float = 5.0,
+    ):
+        self.spill_dir = spill_dir
+        self.spill_after = spill_after
+        self.max_resident_bytes = max_resident_bytes
+        self.min_spill_size = min_spill_size
+        self.maintain_interval = maintain_interval
+        self._photos: Dict[int, _Photo] = {}
+        self._ids = itertools.count(1)
+        self._directory: Optional[str] = None
+        self._cipher = AESGCM(AESGCM.generate_key(bit_length=256))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pressure: Optional[asyncio.Event] = None
+        self._maintainer: Optional[asyncio.Task] = None
+        self.resident_bytes = 0
+        self.spilled_bytes = 0
+        self._spilled_count = 0
+        self.spills = 0
+        self.reloads = 0
+        self.failures = 0
+
+    def __len__(self) -> int:
+        return len(self._photos)
+
+    # Доступ к фото
+
+    def put(self, data: bytes) -> int:
+        """Сохраняет фото в памяти и возвращает его id"""
+        photo_id = next(self._ids)
+        self._photos[photo_id] = _Photo(data)
+        self.resident_bytes += len(data)
+        if self.resident_bytes > self.max_resident_bytes and self._pressure is not None:
+            self._pressure.set()
+        return photo_id
+
+    async def get(self, photo_id: int) -> Optional[bytes]:
+        """Фото по id; выгруженное на диск читается обратно в память.
+
+        Чтение, проверка и расшифровка файла идут в потоке выгрузки, event
+        loop их не ждет. Если файл не читается, возвращается None, а фото
+        остается в хранилище: удаляет его вызывающий через delete(), пока
+        size() еще знает его размер.
+        """
+        photo = self._photos.get(photo_id)
+        if photo is None:
+            return None
+        photo.last_access = time.monotonic()
+        if photo.data is not None:
+            return photo.data
+        if photo.loading is None:
+            photo.loading = asyncio.ensure_future(self._reload(photo_id, photo))
+        # Отмена одного get() не прерывает чтение, которого могут ждать другие
+        return await asyncio.shield(photo.loading)
+
+    async def _reload(self, photo_id: int, photo: _Photo) -> Optional[bytes]:
+        try:
+            if photo.path is None or self._executor is None:
+                # Хранилище уже остановлено и файлы удалены
+                return None
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._read, photo_id, photo.path, photo.nonce,
+                )
+            except Exception as e:
+                if self._photos.get(photo_id) is not photo:
+                    return None
+                logging.error(f"Не удалось прочитать фото {photo_id} с диска: {e}")
+                self.failures += 1
+                return None
+            if self._photos.get(photo_id) is not photo:
+                # Пока читали, фото удалили
+                return None
+            self._unlink(photo)
+            photo.data = data
+            self.resident_bytes += photo.size
+            self.reloads += 1
+            return data
+        finally:
+            photo.loading = None
+
+    def size(self, photo_id: int) -> int:
+        photo = self._photos.get(photo_id)
+        return photo.size if photo is not None else 0
+
+    def delete(self, photo_id: int) -> None:
+        """Удаляет фото из памяти и с диска"""
+        photo = self._photos.pop(photo_id, None)
+        if photo is None:
+            return
+        if photo.data is not None:
+            self.resident_bytes -= photo.size
+        self._unlink(photo)
+        photo.data = None
+
+    # Диск
+
+    def _unlink(self, photo: _Photo) -> None:
+        if photo.path is None:
+            return
+        try:
+            os.unlink(photo.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Не удалось удалить файл фото: {e}")
+        photo.path = None
+        self.spilled_bytes -= photo.size
+        self._spilled_count -= 1
+
+    def _write(self, photo_id: int, data: bytes) -> Tuple[str, bytes]:
+        """Шифрует и пишет фото в файл; выполняется в потоке выгрузки"""
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        encrypted = self._cipher.encrypt(nonce, data, str(photo_id).encode())
+        path = os.path.join(self._directory, f"{photo_id}.bin")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encrypted)
+        return path, nonce
+
+    def _read(self, photo_id: int, path: str, nonce: bytes) -> bytes:
+        """Проверяет и расшифровывает файл фото; выполняется в потоке выгрузки"""
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            try:
+                return self._cipher.decrypt(nonce, mapped, str(photo_id).encode())
+            except InvalidTag:
+                raise ValueError("подпись файла не совпадает") from None
+
+    async def _spill(self, photo_id: int, photo: _Photo) -> None:
+        data = photo.data
+        if data is None or photo.spilling or self._photos.get(photo_id) is not photo:
+            # Пока выгружались предыдущие, фото удалили или уже выгрузили
+            return
+        photo.spilling = True
+        started = time.monotonic()
+        try:
+            path, nonce = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write, photo_id, data,
+            )
+        except Exception as e:
+            logging.error(f"Не удалось выгрузить фото {photo_id} на диск: {e}")
+            self.failures += 1
+            return
+        finally:
+            photo.spilling = False
+        if self._photos.get(photo_id) is not photo or photo.data is not data or photo.last_access > started:
+            # Пока писали, фото удалили или снова прочитали: файл не нужен
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return
+        photo.path, photo.nonce = path, nonce
+        photo.data = None
+        self.resident_bytes -= photo.size
+        self.spilled_bytes += photo.size
+        self._spilled_count += 1
+        self.spills += 1
+
+    def _candidates(self, now: float) -> List[Tuple[int, _Photo]]:
+        """Что выгрузить: давно не читанные фото и самые давние сверх лимита памяти"""
+        resident = sorted(
+            ((photo_id, photo) for photo_id, photo in self._photos.items()
+             if photo.data is not None and not photo.spilling and photo.size >= self.min_spill_size),
+            key=lambda item: item[1].last_access,
+        )
+        excess = self.resident_bytes - self.max_resident_bytes
+        chosen = []
+        for photo_id, photo in resident:
+            if now - photo.last_access < self.spill_after and excess <= 0:
+                break
+            chosen.append((photo_id, photo))
+            excess -= photo.size
+        return chosen
+
+    async def maintain(self) -> None:
+        """Выгружает на диск остывшие фото и фото сверх лимита памяти"""
+        if self._directory is None:
+            return
+        for photo_id, photo in self._candidates(time.monotonic()):
+            await self._spill(photo_id, photo)
+
+    async def _maintain_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._pressure.wait(), self.maintain_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._pressure.clear()
+            try:
+                await self.maintain()
+            except Exception as e:
+                logging.error(f"Ошибка при выгрузке фото на диск: {e}")
+
+    # Жизненный цикл и статистика
+
+    def start(self) -> None:
+        """Создает каталог для выгрузки и запускает фоновую выгрузку"""
+        if self.spill_dir is None or self._maintainer is not None:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._directory = tempfile.mkdtemp(prefix='sensfit-photos-', dir=self.spill_dir)
+        except OSError as e:
+            logging.error(f"Каталог для выгрузки фото недоступен, фото остаются в памяти: {e}")
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photo-spill")
+        self._pressure = asyncio.Event()
+        self._maintainer = asyncio.create_task(self._maintain_loop(), name="photo-spill")
+
+    async def close(self) -> None:
+        """Останавливает выгрузку и удаляет все файлы фото"""
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            await asyncio.gather(self._maintainer, return_exceptions=True)
+            self._maintainer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for photo in self._photos.values():
+            self._unlink(photo)
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'resident_photos': len(self._photos) - self._spilled_count,
+            'resident_bytes': self.resident_bytes,
+            'spilled_photos': self._spilled_count,
+            'spilled_bytes': self.spilled_bytes,
+            'spills': self.spills,
+            'reloads': self.reloads,
+            'failures': self.failures,
+        }
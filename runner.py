@@ -0,0 +1,310 @@
+"""Запуск бота в нескольких процессах с привязкой пользователя к воркеру.
+
+Фронтовой процесс получает апдейты (long polling или вебхук) и по хешу
+from_user.id отправляет каждый апдейт в один и тот же воркер. Воркер
+обрабатывает апдейты одного пользователя строго по очереди (кроме фото
+одного альбома), поэтому переходы UserStates не переупорядочиваются, а
+разные пользователи обрабатываются параллельно на всех ядрах.
+
+    BOT_WORKERS=4 python runner.py
+"""
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+from webhook import SECRET_HEADER
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', str(os.cpu_count() or 1)))
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '30'))
+
+
+def update_shard_key(update: Dict[str, Any]) -> int:
+    """Ключ шардирования апдейта: id пользователя, иначе id чата, иначе update_id"""
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+def update_media_group(update: Dict[str, Any]) -> Optional[str]:
+    """media_group_id сообщения-альбома"""
+    message = update.get('message')
+    return message.get('media_group_id') if isinstance(message, dict) else None
+
+
+@dataclass
+class _Tail:
+    """Последнее звено очереди пользователя: один апдейт или сообщения одного альбома"""
+    media_group_id: Optional[str]
+    previous: List[asyncio.Task]
+    tasks: List[asyncio.Task] = field(default_factory=list)
+
+
+class UserOrderedFeeder:
+    """Передает апдейты в диспетчер, сохраняя порядок внутри одного пользователя.
+
+    Сообщения одного альбома идут параллельно друг другу: MediaGroupMiddleware
+    в первом из них ждет остальные.
+    """
+
+    def __init__(self, dp, bot):
+        self.dp = dp
+        self.bot = bot
+        # Последнее звено каждого пользователя: следующее ждет завершения его задач
+        self._tails: Dict[int, _Tail] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tails)
+
+    def submit(self, update: Dict[str, Any]) -> None:
+        key = update_shard_key(update)
+        group = update_media_group(update)
+        tail = self._tails.get(key)
+        if tail is None or group is None or tail.media_group_id != group:
+            tail = self._tails[key] = _Tail(group, tail.tasks if tail is not None else [])
+        task = asyncio.create_task(self._feed(tail.previous, update))
+        tail.tasks.append(task)
+        task.add_done_callback(lambda t: self._release(key, tail))
+
+    def _release(self, key: int, tail: _Tail) -> None:
+        if self._tails.get(key) is tail and all(task.done() for task in tail.tasks):
+            del self._tails[key]
+
+    async def _feed(self, previous: List[asyncio.Task], update: Dict[str, Any]) -> None:
+        if previous:
+            await asyncio.wait(previous)
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+
+    async def drain(self, timeout: float) -> None:
+        """Ждет завершения всех начатых апдейтов"""
+        tasks = {task for tail in self._tails.values() for task in tail.tasks}
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+
+# ВОРКЕР
+
+def worker_main(index: int, queue: multiprocessing.Queue, workers: int) -> None:
+    """Точка входа процесса-воркера"""
+    import bot as app
+
+    app.log_pipeline.install(worker=index)
+    try:
+        asyncio.run(_run_worker(index, queue, workers))
+    finally:
+        app.log_pipeline.close()
+
+
+async def _run_worker(index: int, queue: multiprocessing.Queue, workers: int) -> None:
+    import bot as app
+
+    # Общий лимит отправки Telegram делится поровну между воркерами
+    bot = app.create_bot(shards=workers)
+    feeder = UserOrderedFeeder(app.dp, bot)
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+
+    def on_update(update: Optional[Dict[str, Any]]) -> None:
+        if update is None:
+            stop_event.set()
+        else:
+            feeder.submit(update)
+
+    def read_queue() -> None:
+        # multiprocessing.Queue блокирующая, поэтому читаем ее в отдельном потоке
+        while True:
+            update = queue.get()
+            loop.call_soon_threadsafe(on_update, update)
+            if update is None:
+                break
+
+    await app.start_services(worker_index=index)
+    threading.Thread(target=read_queue, name="update-reader", daemon=True).start()
+    try:
+        await stop_event.wait()
+        await feeder.drain(app.WEBHOOK_DRAIN_TIMEOUT)
+    finally:
+        await app.stop_services()
+        await bot.session.close()
+
+
+# ФРОНТ
+
+class ShardRouter:
+    """Раскладывает апдейты по очередям воркеров"""
+
+    def __init__(self, queues: List[multiprocessing.Queue]):
+        self.queues = queues
+
+    def route(self, update: Dict[str, Any]) -> None:
+        shard = hash(update_shard_key(update)) % len(self.queues)
+        self.queues[shard].put(update)
+
+
+async def poll_updates(router: ShardRouter, token: str, allowed_updates: List[str],
+                       stop_event: asyncio.Event, api: TelegramAPIServer = PRODUCTION) -> None:
+    """Long polling без разбора апдейтов: фронту нужен только id пользователя"""
+    url = api.api_url(token, 'getUpdates')
+    offset = 0
+    backoff = 1.0
+    timeout = aiohttp.ClientTimeout(total=POLLING_TIMEOUT + 10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        try:
+            while not stop_event.is_set():
+                params = {'offset': offset, 'timeout': POLLING_TIMEOUT, 'allowed_updates': allowed_updates}
+                try:
+                    async with session.post(url, json=params) as response:
+                        data = await response.json(content_type=None)
+                    if not data.get('ok'):
+                        raise RuntimeError(data.get('description'))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Ошибка getUpdates: {e}; повтор через {backoff:.0f} с")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+                backoff = 1.0
+                for update in data['result']:
+                    router.route(update)
+                    offset = update['update_id'] + 1
+        finally:
+            if offset:
+                await _confirm_offset(session, url, offset)
+
+
+async def _confirm_offset(session: aiohttp.ClientSession, url: str, offset: int) -> None:
+    """Подтверждает Telegram апдейты, уже отданные воркерам.
+
+    Telegram считает апдейт полученным только по следующему getUpdates с
+    большим offset; без этого вызова последняя пачка пришла бы снова после
+    перезапуска и обработалась бы дважды.
+    """
+    try:
+        params = {'offset': offset, 'timeout': 0, 'limit': 1}
+        async with session.post(url, json=params, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            await response.read()
+    except Exception as e:
+        logging.warning(f"Не удалось подтвердить offset {offset} при остановке: {e}")
+
+
+async def serve_webhook(router: ShardRouter, app, stop_event: asyncio.Event) -> None:
+    """Вебхук фронта: проверяет секрет и сразу отдает апдейт воркеру"""
+    async def handle(request: web.Request) -> web.Response:
+        if app.WEBHOOK_SECRET and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), app.WEBHOOK_SECRET
+        ):
+            return web.Response(status=401)
+        if stop_event.is_set():
+            return web.Response(status=503)
+        router.route(await request.json())
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_post(app.WEBHOOK_PATH, handle)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, app.WEBHOOK_HOST, app.WEBHOOK_PORT).start()
+    bot = app.create_bot()
+    try:
+        await bot.set_webhook(
+            url=f"{app.WEBHOOK_BASE_URL.rstrip('/')}{app.WEBHOOK_PATH}",
+            secret_token=app.WEBHOOK_SECRET,
+            allowed_updates=app.dp.resolve_used_update_types(),
+        )
+    finally:
+        await bot.session.close()
+    logging.info(f"Вебхук слушает {app.WEBHOOK_HOST}:{app.WEBHOOK_PORT}{app.WEBHOOK_PATH}")
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_front(workers: int) -> None:
+    import bot as app
+
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=worker_main, args=(i, queues[i], workers), name=f"bot-worker-{i}")
+        for i in range(workers)
+    ]
+    # Воркеры наследуют игнорирование SIGINT с самого старта, еще до импорта бота:
+    # Ctrl+C приходит всей группе процессов, а остановкой управляет фронт
+    previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        for process in processes:
+            process.start()
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    router = ShardRouter(queues)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    logging.info(f"Запущено воркеров: {workers}, режим: {app.BOT_MODE}")
+    try:
+        if app.BOT_MODE == 'webhook':
+            await serve_webhook(router, app, stop_event)
+        else:
+            polling = asyncio.create_task(
+                poll_updates(router, app.TOKEN, app.dp.resolve_used_update_types(), stop_event,
+                             api=app.TELEGRAM_API)
+            )
+            await stop_event.wait()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        logging.info("Останавливаем воркеры")
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            await loop.run_in_executor(None, process.join, app.WEBHOOK_DRAIN_TIMEOUT + 30)
+            if process.is_alive():
+                logging.warning(f"{process.name} не завершился, принудительно останавливаем")
+                process.terminate()
+
+
+def main() -> None:
+    import bot as app
+
+    app.log_pipeline.install()
+    try:
+        if BOT_WORKERS <= 1:
+            asyncio.run(app.main())
+        else:
+            asyncio.run(run_front(BOT_WORKERS))
+    finally:
+        app.log_pipeline.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from storage import StorageBackend
+
+
+def scan_cache_keys(height: int, front: Tuple[Optional[str], bytes],
+                    profile: Tuple[Optional[str], bytes]) -> Iterator[str]:
+    """Ключи скана: по file_unique_id обоих фото, затем по хешу содержимого.
+
+    Фото и рост однозначно определяют результат скана. Хеш считается лениво,
+    только если поиск по file_unique_id не дал результата.
+    """
+    (front_id, front_data), (profile_id, profile_data) = front, profile
+    if front_id and profile_id:
+        yield f"scan:id:{height}:{front_id}:{profile_id}"
+    front_hash = hashlib.sha256(front_data).hexdigest()
+    profile_hash = hashlib.sha256(profile_data).hexdigest()
+    yield f"scan:sha256:{height}:{front_hash}:{profile_hash}"
+
+
+class ScanResultCache:
+    """Кеш результатов скана: LRU в памяти с TTL и необязательный уровень на диске"""
+
+    def __init__(self, *, max_entries: int = 10000, ttl: float = 24 * 3600,
+                 backend: Optional[StorageBackend] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        # key -> (срок годности по time.time(), результат)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def start(self) -> None:
+        if self.backend is not None:
+            await self.backend.open()
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+
+    def _remember(self, key: str, expires_at: float, result: Dict[str, Any]) -> None:
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_memory(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    async def _get_disk(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        try:
+            raw = (await self.backend.get_many([key])).get(key)
+            if raw is None:
+                return None
+            saved = json.loads(raw)
+            if saved['expires_at'] <= now:
+                await self.backend.delete_many([key])
+                return None
+        except Exception as e:
+            logging.error(f"Ошибка чтения кеша сканов с диска: {e}")
+            return None
+        self._remember(key, saved['expires_at'], saved['result'])
+        return saved['result']
+
+    async def get(self, keys: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """Результат по первому найденному ключу; копия, чтобы кеш не меняли снаружи"""
+        now = time.time()
+        tried = []
+        for key in keys:
+            tried.append(key)
+            result = self._get_memory(key, now)
+            if result is not None:
+                self.memory_hits += 1
+                return dict(result)
+        if self.backend is not None:
+            for key in tried:
+                result = await self._get_disk(key, now)
+                if result is not None:
+                    self.disk_hits += 1
+                    return dict(result)
+        self.misses += 1
+        return None
+
+    async def set(self, keys: Iterable[str], result: Dict[str, Any]) -> None:
+        """Сохраняет результат под всеми ключами скана"""
+        expires_at = time.time() + self.ttl
+        result = dict(result)
+        keys = list(keys)
+        for key in keys:
+            self._remember(key, expires_at, result)
+        if self.backend is not None:
+            value = json.dumps({'expires_at': expires_at, 'result': result}, ensure_ascii=False)
+            try:
+                await self.backend.set_many({key: value for key in keys})
+            except Exception as e:
+                logging.error(f"Ошибка записи кеша сканов на диск: {e}")
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def stats(self) -> Dict[str, Any]:
+        """Попадания и промахи: каждое попадание - несделанный платный вызов Bodygram"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,166 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+@dataclass
+class ScanJob:
+    """Задача на анализ фото пользователя"""
+    user_id: int
+    processing_msg: Any
+    state: Any
+    job_id: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Контекст обработчика, поставившего задачу: в нем же она и выполняется
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+class ScanQueueFull(Exception):
+    """Очередь сканов переполнена"""
+
+
+JobHandler = Callable[[ScanJob], Awaitable[None]]
+ProgressHandler = Callable[[ScanJob, int, float], Awaitable[None]]
+
+
+class ScanQueue:
+    """Очередь сканов на asyncio.Queue с пулом воркеров и оценкой ожидания"""
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        on_progress: Optional[ProgressHandler] = None,
+        *,
+        workers: int = 4,
+        maxsize: int = 1000,
+        progress_interval: float = 5.0,
+        initial_job_time: float = 5.0,
+    ):
+        self.handler = handler
+        self.on_progress = on_progress
+        self.workers = workers
+        self.maxsize = maxsize
+        self.progress_interval = progress_interval
+        # Скользящее среднее длительности одного скана, секунды
+        self.avg_job_time = initial_job_time
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: "OrderedDict[int, ScanJob]" = OrderedDict()
+        self._last_position: Dict[int, int] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._busy = 0
+        # Сколько задач воркеры взяли из очереди за все время
+        self._started = 0
+        self._ids = itertools.count(1)
+        # user_id -> число его задач в очереди и в работе
+        self._user_jobs: Dict[int, int] = {}
+
+    @property
+    def depth(self) -> int:
+        """Число задач, ожидающих воркера"""
+        return len(self._pending)
+
+    def has_job(self, user_id: int) -> bool:
+        """Есть ли у пользователя скан в очереди или в работе"""
+        return user_id in self._user_jobs
+
+    def eta(self, position: int) -> float:
+        """Оценка времени до готовности результата для позиции в очереди"""
+        rounds = math.ceil(position / self.workers) if position > 0 else 0
+        return (rounds + 1) * self.avg_job_time
+
+    async def start(self) -> None:
+        """Запускает воркеры и периодическое обновление прогресса"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"scan-worker-{i}"))
+        if self.on_progress is not None and self.progress_interval > 0:
+            self._tasks.append(asyncio.create_task(self._progress_loop(), name="scan-progress"))
+
+    async def stop(self, drain_timeout: float = 30.0) -> None:
+        """Дожидается текущих задач (не дольше drain_timeout) и останавливает воркеры"""
+        if self._queue is not None and drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Очередь сканов не опустела за {drain_timeout} с, осталось {self.depth}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, job: ScanJob) -> int:
+        """Ставит задачу в очередь и возвращает ее позицию (1 - следующая)"""
+        if self._queue is None:
+            raise RuntimeError("ScanQueue не запущена")
+        if self._queue.full():
+            raise ScanQueueFull(f"В очереди уже {self.maxsize} сканов")
+        job.job_id = next(self._ids)
+        # Сообщаем позицию до постановки в очередь, чтобы это уведомление
+        # не перезаписало статус, выставленный уже взявшим задачу воркером
+        position = len(self._pending) + 1
+        if position > self.workers - self._busy:
+            await self._notify(job, position)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise ScanQueueFull(f"В очереди уже {self.maxsize} сканов")
+        self._pending[job.job_id] = job
+        self._last_position[job.job_id] = position
+        self._user_jobs[job.user_id] = self._user_jobs.get(job.user_id, 0) + 1
+        return position
+
+    async def _notify(self, job: ScanJob, position: int) -> None:
+        """Сообщает о позиции задачи, ошибки уведомления не роняют воркер"""
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(job, position, self.eta(position))
+        except Exception as e:
+            logging.warning(f"Не удалось обновить прогресс скана {job.job_id}: {e}")
+
+    async def _progress_loop(self) -> None:
+        """Периодически обновляет позицию у задач, чья очередь сдвинулась"""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            started = self._started
+            for position, job in enumerate(list(self._pending.values()), start=1):
+                if job.job_id not in self._pending:
+                    # Пока шли уведомления, воркер взял задачу и уже сообщил "в работе"
+                    continue
+                # Задачи уходят из очереди только с головы: позиция сдвигается на число взятых
+                position -= self._started - started
+                if self._last_position.get(job.job_id) != position:
+                    self._last_position[job.job_id] = position
+                    await self._notify(job, position)
+
+    async def _worker(self) -> None:
+        """Берет задачи из очереди и обрабатывает их по одной"""
+        while True:
+            job = await self._queue.get()
+            self._pending.pop(job.job_id, None)
+            self._last_position.pop(job.job_id, None)
+            self._started += 1
+            started = time.monotonic()
+            self._busy += 1
+            try:
+                await self._notify(job, 0)
+                # Context.run вместо create_task(context=), которого нет до Python 3.11
+                await job.context.run(asyncio.create_task, self.handler(job))
+            except Exception as e:
+                logging.error(f"Ошибка при обработке скана {job.job_id}: {e}")
+            finally:
+                self._busy -= 1
+                remaining = self._user_jobs.pop(job.user_id, 1) - 1
+                if remaining:
+                    self._user_jobs[job.user_id] = remaining
+                elapsed = time.monotonic() - started
+                self.avg_job_time = 0.8 * self.avg_job_time + 0.2 * elapsed
+                self._queue.task_done()
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from photo_buffers import PhotoBufferStore
+from storage import CachedStore
+
+# Какие фото может хранить сессия
+PHOTO_SIDES = ('front', 'profile')
+
+
+@dataclass
+class UserSession:
+    """Данные одного пользователя между шагами сценария"""
+    quiz_data: Dict[str, Any] = field(default_factory=dict)
+    last_recommendation: Optional[Dict[str, str]] = None
+    height: Optional[int] = None
+    # side -> (id фото в PhotoBufferStore, время загрузки); меняется только через SessionStore
+    photos: Dict[str, tuple] = field(default_factory=dict)
+    # side -> file_unique_id фото в Telegram, если известен
+    photo_ids: Dict[str, str] = field(default_factory=dict)
+    touched_at: float = field(default_factory=time.monotonic)
+    # Сквозной id сессии для логов: новый при каждом /start
+    session_id: str = field(default_factory=lambda: secrets.token_hex(6))
+
+
+class SessionStore:
+    """Хранилище сессий с LRU-лимитом, TTL для фото и сессий и учетом памяти"""
+
+    def __init__(
+        self,
+        *,
+        max_sessions: int = 10000,
+        session_ttl: float = 7 * 24 * 3600,
+        photo_ttl: float = 24 * 3600,
+        sweep_interval: float = 60.0,
+        backend: Optional[CachedStore] = None,
+        photo_store: Optional[PhotoBufferStore] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.photo_ttl = photo_ttl
+        self.sweep_interval = sweep_interval
+        # Квиз, рост и рекомендация переживают перезапуск, фото - никогда
+        self.backend = backend
+        # Байты фото; по умолчанию только в памяти, без выгрузки на диск
+        self.photo_store = photo_store if photo_store is not None else PhotoBufferStore()
+        self._sessions: "OrderedDict[int, UserSession]" = OrderedDict()
+        self._photo_bytes = 0
+        self._photo_count = 0
+        self._evicted = 0
+        self._expired_photos = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    # Сессии
+
+    def get(self, user_id: int) -> Optional[UserSession]:
+        """Возвращает сессию пользователя, если она есть"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self._touch(user_id, session)
+        return session
+
+    def session_id(self, user_id: int) -> Optional[str]:
+        """id текущей сессии пользователя для логов, не продлевает сессию"""
+        session = self._sessions.get(user_id)
+        return session.session_id if session is not None else None
+
+    def get_or_create(self, user_id: int) -> UserSession:
+        """Возвращает сессию пользователя, создавая пустую при необходимости"""
+        session = self.get(user_id)
+        if session is None:
+            session = self.reset(user_id)
+        return session
+
+    def reset(self, user_id: int) -> UserSession:
+        """Начинает сессию заново"""
+        old = self._sessions.get(user_id)
+        if old is not None:
+            self._drop_photos(old)
+        session = UserSession()
+        self._insert(user_id, session)
+        self.persist(user_id)
+        return session
+
+    def delete(self, user_id: int) -> None:
+        """Полностью удаляет данные пользователя"""
+        self._forget(user_id)
+        if self.backend is not None:
+            self.backend.delete(self._backend_key(user_id))
+
+    def _insert(self, user_id: int, session: UserSession) -> None:
+        self._sessions[user_id] = session
+        self._touch(user_id, session)
+        self._evict_overflow()
+
+    def _forget(self, user_id: int) -> None:
+        """Убирает сессию из памяти, постоянная копия остается"""
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._drop_photos(session)
+
+    def _touch(self, user_id: int, session: UserSession) -> None:
+        session.touched_at = time.monotonic()
+        self._sessions.move_to_end(user_id)
+
+    def _evict_overflow(self) -> None:
+        """Вытесняет самые давно использованные сессии сверх лимита"""
+        while len(self._sessions) > self.max_sessions:
+            _, session = self._sessions.popitem(last=False)
+            self._drop_photos(session)
+            self._evicted += 1
+
+    # Постоянное хранение
+
+    @staticmethod
+    def _backend_key(user_id: int) -> str:
+        return f"session:{user_id}"
+
+    async def load(self, user_id: int) -> None:
+        """Поднимает сессию из постоянного хранилища, если ее нет в памяти"""
+        if self.backend is None or user_id in self._sessions:
+            return
+        raw = await self.backend.get(self._backend_key(user_id))
+        if raw is None or user_id in self._sessions:
+            return
+        saved = json.loads(raw)
+        session = UserSession(
+            quiz_data=saved.get('quiz_data', {}),
+            last_recommendation=saved.get('last_recommendation'),
+            height=saved.get('height'),
+        )
+        session.session_id = saved.get('session_id', session.session_id)
+        self._insert(user_id, session)
+
+    def persist(self, user_id: int) -> None:
+        """Ставит сессию в очередь на запись в постоянное хранилище"""
+        if self.backend is None:
+            return
+        session = self._sessions.get(user_id)
+        if session is None:
+            return
+        self.backend.set(self._backend_key(user_id), json.dumps({
+            'quiz_data': session.quiz_data,
+            'last_recommendation': session.last_recommendation,
+            'height': session.height,
+            'session_id': session.session_id,
+        }, ensure_ascii=False))
+
+    # Фото
+
+    def set_photo(self, user_id: int, side: str, data: bytes, file_unique_id: Optional[str] = None) -> None:
+        """Сохраняет фото пользователя"""
+        if side not in PHOTO_SIDES:
+            raise ValueError(f"Неизвестная сторона фото: {side}")
+        session = self.get_or_create(user_id)
+        if side in session.photos:
+            self._drop_photo(session, side)
+        session.photos[side] = (self.photo_store.put(data), time.monotonic())
+        if file_unique_id is not None:
+            session.photo_ids[side] = file_unique_id
+        else:
+            session.photo_ids.pop(side, None)
+        self._photo_bytes += len(data)
+        self._photo_count += 1
+
+    async def get_photo(self, user_id: int, side: str) -> Optional[bytes]:
+        """Возвращает фото, если оно есть и не старше photo_ttl"""
+        session = self.get(user_id)
+        if session is None or side not in session.photos:
+            return None
+        photo_id, stored_at = session.photos[side]
+        if time.monotonic() - stored_at > self.photo_ttl:
+            self._drop_photo(session, side)
+            self._expired_photos += 1
+            return None
+        data = await self.photo_store.get(photo_id)
+        if data is None and session.photos.get(side, (None,))[0] == photo_id:
+            # Файл фото на диске испорчен или пропал: пусть пользователь загрузит заново.
+            # Если пока читали, фото заменили или удалили, новое не трогаем
+            self._drop_photo(session, side)
+        return data
+
+    def get_photo_id(self, user_id: int, side: str) -> Optional[str]:
+        """file_unique_id сохраненного фото"""
+        session = self._sessions.get(user_id)
+        if session is None or side not in session.photos:
+            return None
+        return session.photo_ids.get(side)
+
+    def clear_photos(self, user_id: int) -> None:
+        """Удаляет фото пользователя, например сразу после скана"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self._drop_photos(session)
+
+    def _drop_photo(self, session: UserSession, side: str) -> None:
+        photo_id, _ = session.photos.pop(side)
+        session.photo_ids.pop(side, None)
+        self._photo_bytes -= self.photo_store.size(photo_id)
+        self._photo_count -= 1
+        self.photo_store.delete(photo_id)
+
+    def _drop_photos(self, session: UserSession) -> None:
+        for side in list(session.photos):
+            self._drop_photo(session, side)
+
+    # Очистка и статистика
+
+    def sweep(self) -> None:
+        """Удаляет просроченные фото и неактивные сессии"""
+        now = time.monotonic()
+        expired_sessions: List[int] = []
+        for user_id, session in self._sessions.items():
+            if now - session.touched_at > self.session_ttl:
+                expired_sessions.append(user_id)
+                continue
+            for side, (_, stored_at) in list(session.photos.items()):
+                if now - stored_at > self.photo_ttl:
+                    self._drop_photo(session, side)
+                    self._expired_photos += 1
+        for user_id in expired_sessions:
+            if self.backend is None:
+                self.delete(user_id)
+            else:
+                self._forget(user_id)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Ошибка при очистке сессий: {e}")
+
+    def start(self) -> None:
+        """Запускает фоновую очистку и выгрузку фото на диск"""
+        self.photo_store.start()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="session-sweeper")
+
+    async def stop(self) -> None:
+        """Останавливает фоновую очистку и удаляет выгруженные на диск фото"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        await self.photo_store.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Число сессий, фото и занятая ими память и диск"""
+        photo_store = self.photo_store.stats()
+        return {
+            'sessions': len(self._sessions),
+            'photos': self._photo_count,
+            'photo_bytes': self._photo_bytes,
+            'photo_resident_bytes': photo_store['resident_bytes'],
+            'photo_spilled_bytes': photo_store['spilled_bytes'],
+            'evicted_sessions': self._evicted,
+            'expired_photos': self._expired_photos,
+        }
+
+
+class SessionMiddleware(BaseMiddleware):
+    """Загружает сессию пользователя до обработчика и сохраняет после"""
+
+    def __init__(self, sessions: SessionStore):
+        self.sessions = sessions
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        await self.sessions.load(user.id)
+        try:
+            return await handler(event, data)
+        finally:
+            self.sessions.persist(user.id)
@@ -0,0 +1,117 @@
+import json
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+@dataclass(frozen=True)
+class SizeResult:
+    """Размер бюстгальтера в разных системах"""
+    band_eu: int
+    cup_eu: str
+    band_us: int
+    cup_us: str
+    band_uk: int
+    cup_uk: str
+    band_fr: int
+    cup_fr: str
+
+    @property
+    def eu(self) -> str:
+        return f"{self.band_eu}{self.cup_eu}"
+
+    @property
+    def us(self) -> str:
+        return f"{self.band_us}{self.cup_us}"
+
+    @property
+    def uk(self) -> str:
+        return f"{self.band_uk}{self.cup_uk}"
+
+    @property
+    def fr(self) -> str:
+        return f"{self.band_fr}{self.cup_fr}"
+
+    @property
+    def label(self) -> str:
+        """Подпись для пользователя, например 80B EU (36B US)"""
+        return f"{self.eu} EU ({self.us} US)"
+
+
+class SizeChart:
+    """Размерная сетка с заранее посчитанной таблицей по всей области ввода.
+
+    Таблица хранит для каждой целой пары (под грудью, грудь) индекс готового
+    SizeResult, поэтому поиск - одна арифметика и два обращения по индексу.
+    """
+
+    def __init__(self, chart: Dict[str, Any]):
+        self.underbust_min, self.underbust_max = chart['underbust_range']
+        self.bust_min, self.bust_max = chart['bust_range']
+        self.bands = sorted(chart['bands'], key=lambda band: band['eu'])
+        self.cups = chart['cups']
+        self._bust_span = self.bust_max - self.bust_min + 1
+        self._results: List[SizeResult] = []
+        self._table = array('H')
+        self._build()
+
+    @classmethod
+    def from_file(cls, path: str) -> "SizeChart":
+        """Загружает сетку из JSON-файла"""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _band_for(self, underbust: int) -> Dict[str, Any]:
+        for band in self.bands:
+            if band['min_underbust'] <= underbust <= band['max_underbust']:
+                return band
+        # Вне сетки берем ближайший крайний обхват
+        return self.bands[0] if underbust < self.bands[0]['min_underbust'] else self.bands[-1]
+
+    def _cup_for(self, diff: int) -> Dict[str, Any]:
+        for cup in self.cups:
+            if cup.get('min_diff', float('-inf')) <= diff <= cup.get('max_diff', float('inf')):
+                return cup
+        # Разница попала в разрыв между чашками: берем ближайшую меньшую
+        smaller = [cup for cup in self.cups if cup.get('min_diff', float('-inf')) <= diff]
+        return smaller[-1] if smaller else self.cups[0]
+
+    def _build(self) -> None:
+        """Заполняет плотную таблицу по всей области ввода"""
+        indexes: Dict[Tuple[int, str], int] = {}
+        for underbust in range(self.underbust_min, self.underbust_max + 1):
+            band = self._band_for(underbust)
+            for bust in range(self.bust_min, self.bust_max + 1):
+                cup = self._cup_for(bust - underbust)
+                key = (band['eu'], cup['eu'])
+                if key not in indexes:
+                    indexes[key] = len(self._results)
+                    self._results.append(SizeResult(
+                        band['eu'], cup['eu'],
+                        band['us'], cup['us'],
+                        band['uk'], cup['uk'],
+                        band['fr'], cup['fr'],
+                    ))
+                self._table.append(indexes[key])
+
+    def _index(self, underbust: float, bust: float, clamp: bool) -> int:
+        u = int(round(underbust))
+        b = int(round(bust))
+        if clamp:
+            u = min(max(u, self.underbust_min), self.underbust_max)
+            b = min(max(b, self.bust_min), self.bust_max)
+        elif not (self.underbust_min <= u <= self.underbust_max and self.bust_min <= b <= self.bust_max):
+            raise ValueError(f"Мерки вне сетки: под грудью {underbust}, грудь {bust}")
+        return (u - self.underbust_min) * self._bust_span + (b - self.bust_min)
+
+    def lookup(self, underbust: float, bust: float, clamp: bool = False) -> SizeResult:
+        """Размер по обхватам в см; вне области ValueError, если не задан clamp"""
+        return self._results[self._table[self._index(underbust, bust, clamp)]]
+
+    def lookup_many(self, underbusts: Iterable[float], busts: Iterable[float],
+                    clamp: bool = False) -> List[SizeResult]:
+        """Пакетный поиск для пересчета истории квизов при смене сетки"""
+        results = self._results
+        table = self._table
+        index = self._index
+        return [results[table[index(u, b, clamp)]] for u, b in zip(underbusts, busts)]
@@ -0,0 +1,117 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from size_chart import SizeChart, SizeResult
+
+# Названия мерок в ответе Bodygram
+UNDERBUST_KEYS = ('underBustGirth', 'underbustGirth')
+BUST_KEYS = ('bustGirth',)
+
+# Множители перевода единиц ответа в сантиметры
+UNIT_TO_CM = {'mm': 0.1, 'cm': 1.0, 'm': 100.0, 'in': 2.54}
+
+CONFIDENCE_LABELS = {
+    'high': 'высокая',
+    'medium': 'средняя',
+    'low': 'низкая',
+}
+
+
+@dataclass(frozen=True)
+class SizeEstimate:
+    """Размер по меркам скана с оценкой уверенности"""
+    size: SizeResult
+    underbust: float
+    bust: float
+    confidence: str
+    # Соседние размеры, в которые скан попадает с учетом погрешности
+    alternatives: Tuple[SizeResult, ...] = ()
+    measurements: Dict[str, float] = field(default_factory=dict, compare=False)
+
+
+def extract_measurements(data: Dict[str, Any]) -> Dict[str, float]:
+    """Достает мерки из ответа Bodygram и переводит их в сантиметры.
+
+    Мерки лежат либо в entry.measurements, либо прямо в measurements;
+    значения по умолчанию в миллиметрах.
+    """
+    entry = data.get('entry') if isinstance(data.get('entry'), dict) else data
+    result: Dict[str, float] = {}
+    for item in entry.get('measurements') or []:
+        try:
+            name = item['name']
+            value = float(item['value']) * UNIT_TO_CM[item.get('unit', 'mm')]
+        except (KeyError, TypeError, ValueError):
+            continue
+        result[name] = value
+    return result
+
+
+def _first(measurements: Dict[str, float], keys: Tuple[str, ...]) -> Optional[float]:
+    for key in keys:
+        if key in measurements:
+            return measurements[key]
+    return None
+
+
+class SizeMapper:
+    """Переводит мерки скана в размер по той же сетке, что и квиз.
+
+    Мерки квантуются с шагом quantum, оценка для каждой пары квантов
+    считается один раз и дальше берется из кеша.
+    """
+
+    def __init__(self, chart: SizeChart, *, quantum: float = 0.5, tolerance: float = 0.5,
+                 cache_size: int = 65536):
+        self.chart = chart
+        self.quantum = quantum
+        self.tolerance = tolerance
+        self._estimate = lru_cache(maxsize=cache_size)(self._evaluate)
+
+    def _in_range(self, underbust: float, bust: float) -> bool:
+        chart = self.chart
+        return (chart.underbust_min <= underbust <= chart.underbust_max
+                and chart.bust_min <= bust <= chart.bust_max)
+
+    def _evaluate(self, underbust_q: int, bust_q: int) -> Tuple[SizeResult, str, Tuple[SizeResult, ...]]:
+        underbust = underbust_q * self.quantum
+        bust = bust_q * self.quantum
+        size = self.chart.lookup(underbust, bust, clamp=True)
+        if not self._in_range(underbust, bust):
+            return size, 'low', ()
+        # Размеры при сдвиге каждой мерки на величину погрешности
+        t = self.tolerance
+        alternatives: List[SizeResult] = []
+        for du, db in ((-t, 0), (t, 0), (0, -t), (0, t)):
+            neighbour = self.chart.lookup(underbust + du, bust + db, clamp=True)
+            if neighbour != size and neighbour not in alternatives:
+                alternatives.append(neighbour)
+        confidence = 'high' if not alternatives else 'medium' if len(alternatives) == 1 else 'low'
+        return size, confidence, tuple(alternatives)
+
+    def estimate(self, underbust: float, bust: float) -> SizeEstimate:
+        """Размер по обхватам в см"""
+        size, confidence, alternatives = self._estimate(
+            round(underbust / self.quantum), round(bust / self.quantum)
+        )
+        return SizeEstimate(size, underbust, bust, confidence, alternatives)
+
+    def map(self, data: Dict[str, Any]) -> Optional[SizeEstimate]:
+        """Размер по ответу Bodygram; None, если в ответе нет обхватов груди"""
+        measurements = extract_measurements(data)
+        underbust = _first(measurements, UNDERBUST_KEYS)
+        bust = _first(measurements, BUST_KEYS)
+        if underbust is None or bust is None:
+            return None
+        size, confidence, alternatives = self._estimate(
+            round(underbust / self.quantum), round(bust / self.quantum)
+        )
+        return SizeEstimate(size, underbust, bust, confidence, alternatives, measurements)
+
+    def map_many(self, responses: Iterable[Dict[str, Any]]) -> List[Optional[SizeEstimate]]:
+        """Пакетный пересчет сохраненных ответов, например после смены сетки"""
+        return [self.map(data) for data in responses]
+
+    def cache_info(self):
+        return self._estimate.cache_info()
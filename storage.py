@@ -0,0 +1,361 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+
+class StorageError(Exception):
+    """Ошибка постоянного хранилища"""
+
+
+class StorageBackend(ABC):
+    """Постоянное key-value хранилище строк"""
+
+    async def open(self) -> None:
+        """Открывает соединение"""
+
+    async def close(self) -> None:
+        """Закрывает соединение"""
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """Возвращает найденные значения по списку ключей"""
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, str]) -> None:
+        """Записывает пачку значений"""
+
+    @abstractmethod
+    async def delete_many(self, keys: List[str]) -> None:
+        """Удаляет пачку ключей"""
+
+
+class SQLiteBackend(StorageBackend):
+    """SQLite в режиме WAL, запросы выполняются в отдельном потоке"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    async def open(self) -> None:
+        if self._conn is None:
+            # Один поток: соединение SQLite используется строго последовательно
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+            await self._run(self._open)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_many(self, keys: List[str]) -> Dict[str, str]:
+        placeholders = ",".join("?" * len(keys))
+        rows = self._conn.execute(f"SELECT key, value FROM kv WHERE key IN ({placeholders})", keys)
+        return dict(rows.fetchall())
+
+    def _set_many(self, items: Dict[str, str]) -> None:
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", items.items())
+
+    def _delete_many(self, keys: List[str]) -> None:
+        with self._conn:
+            self._conn.executemany("DELETE FROM kv WHERE key = ?", ((key,) for key in keys))
+
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        if not keys:
+            return {}
+        return await self._run(self._get_many, keys)
+
+    async def set_many(self, items: Dict[str, str]) -> None:
+        if items:
+            await self._run(self._set_many, items)
+
+    async def delete_many(self, keys: List[str]) -> None:
+        if keys:
+            await self._run(self._delete_many, keys)
+
+
+class RedisBackend(StorageBackend):
+    """Минимальный клиент протокола Redis (RESP) на asyncio-потоках.
+
+    Работает с любым сервером, понимающим GET/MGET/MSET/DEL: Redis, KeyDB,
+    Valkey или локальной заглушкой.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, prefix: str = 'sensfit:'):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        """Создает клиент из redis://[:password@]host:port/db"""
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(parsed.hostname or '127.0.0.1', parsed.port or 6379, db, parsed.password)
+
+    async def open(self) -> None:
+        if self._writer is not None:
+            return
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._execute(('AUTH', self.password))
+        if self.db:
+            await self._execute(('SELECT', str(self.db)))
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    @staticmethod
+    def _encode(args: Iterable[str]) -> bytes:
+        parts = [arg.encode() for arg in args]
+        out = [b"*%d\r\n" % len(parts)]
+        for part in parts:
+            out.append(b"$%d\r\n%s\r\n" % (len(part), part))
+        return b"".join(out)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise StorageError("Соединение с Redis закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise StorageError(f"Redis: {payload.decode()}")
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise StorageError(f"Неизвестный ответ Redis: {line!r}")
+
+    async def _execute(self, *commands: Tuple[str, ...]) -> List[Any]:
+        """Отправляет команды одним пакетом (pipeline) и читает все ответы"""
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def _call(self, *commands: Tuple[str, ...]) -> List[Any]:
+        async with self._lock:
+            try:
+                await self.open()
+                return await self._execute(*commands)
+            except (OSError, asyncio.IncompleteReadError, StorageError):
+                # Соединение в неизвестном состоянии: переподключимся при следующем вызове
+                await self.close()
+                raise
+
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        if not keys:
+            return {}
+        (values,) = await self._call(('MGET', *(self.prefix + key for key in keys)))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, items: Dict[str, str]) -> None:
+        if items:
+            args = [part for key, value in items.items() for part in (self.prefix + key, value)]
+            await self._call(('MSET', *args))
+
+    async def delete_many(self, keys: List[str]) -> None:
+        if keys:
+            await self._call(('DEL', *(self.prefix + key for key in keys)))
+
+
+def create_backend(kind: str, url: str) -> Optional[StorageBackend]:
+    """Создает хранилище по STORAGE_BACKEND и STORAGE_URL, для memory возвращает None"""
+    if kind == 'memory':
+        return None
+    if kind == 'sqlite':
+        return SQLiteBackend(url or 'sensfit.db')
+    if kind == 'redis':
+        return RedisBackend.from_url(url or 'redis://127.0.0.1:6379/0')
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {kind}")
+
+
+# Маркер удаленного ключа в кэше
+_DELETED = object()
+
+
+class CachedStore:
+    """Кэш чтения и отложенная пакетная запись поверх StorageBackend.
+
+    Записи сразу видны из кэша и уходят в хранилище пачкой раз в
+    flush_interval секунд; повторные записи одного ключа схлопываются.
+    Кэш рассчитан на то, что ключ пользователя пишет только один процесс.
+    """
+
+    def __init__(self, backend: StorageBackend, *, flush_interval: float = 0.5, cache_size: int = 50000):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._dirty: Dict[str, Any] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Открывает хранилище и запускает фоновую запись"""
+        await self.backend.open()
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop(), name="storage-flusher")
+
+    async def close(self) -> None:
+        """Дописывает накопленные изменения и закрывает хранилище"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+        await self.backend.close()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Читает значение, при промахе кэша - из хранилища"""
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            value = self._cache[key]
+            return None if value is _DELETED else value
+        found = await self.backend.get_many([key])
+        value = found.get(key)
+        # Пока ждали хранилище, ключ могли записать
+        if key not in self._cache:
+            self._remember(key, _DELETED if value is None else value)
+            return value
+        cached = self._cache[key]
+        return None if cached is _DELETED else cached
+
+    def set(self, key: str, value: str) -> None:
+        """Записывает значение в кэш и ставит в очередь на запись"""
+        # Сначала в очередь: иначе вытеснение может выбросить только что записанный ключ
+        self._dirty[key] = value
+        self._remember(key, value)
+
+    def delete(self, key: str) -> None:
+        """Удаляет значение"""
+        self._dirty[key] = _DELETED
+        self._remember(key, _DELETED)
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        excess = len(self._cache) - self.cache_size
+        if excess > 0:
+            self._evict(excess)
+
+    def _evict(self, count: int) -> None:
+        """Вытесняет count самых старых ключей, которые уже записаны в хранилище"""
+        # Обход с головы до первых count чистых ключей: обычно это один шаг, а не копия кэша
+        evicted = []
+        for old_key in self._cache:
+            if old_key not in self._dirty:
+                evicted.append(old_key)
+                if len(evicted) == count:
+                    break
+        for old_key in evicted:
+            del self._cache[old_key]
+
+    @property
+    def pending_writes(self) -> int:
+        """Число ключей, ожидающих записи"""
+        return len(self._dirty)
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения одной пачкой"""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        sets = {key: value for key, value in batch.items() if value is not _DELETED}
+        deletes = [key for key, value in batch.items() if value is _DELETED]
+        try:
+            await self.backend.set_many(sets)
+            await self.backend.delete_many(deletes)
+        except Exception:
+            # Возвращаем пачку в очередь, не затирая более свежие записи
+            for key, value in batch.items():
+                self._dirty.setdefault(key, value)
+            raise
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка записи в хранилище: {e}")
+
+
+class PersistentFSMStorage(BaseStorage):
+    """Хранилище состояний aiogram FSM поверх CachedStore"""
+
+    def __init__(self, store: CachedStore):
+        self.store = store
+
+    @staticmethod
+    def _key(key: StorageKey, part: str) -> str:
+        thread_id = key.thread_id if key.thread_id is not None else ''
+        business_id = getattr(key, 'business_connection_id', None) or ''
+        return f"fsm:{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{business_id}:{key.destiny}:{part}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        if value is None:
+            self.store.delete(self._key(key, 'state'))
+        else:
+            self.store.set(self._key(key, 'state'), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.store.get(self._key(key, 'state'))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not data:
+            self.store.delete(self._key(key, 'data'))
+        else:
+            self.store.set(self._key(key, 'data'), json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await self.store.get(self._key(key, 'data'))
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        # Общий CachedStore закрывается владельцем вместе с сессиями
+        await self.store.flush()
@@ -0,0 +1,180 @@
+"""Клавиатуры, подписи и шаблоны сообщений, собранные один раз при импорте.
+
+Все клавиатуры сценария статичны, поэтому объекты aiogram создаются и
+валидируются здесь один раз, а их JSON для Bot API сериализуется один раз
+при создании сессии бота (PrebuiltMarkupSession).
+"""
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiohttp import FormData
+
+from callbacks import (
+    Answer, BraType, BraTypeCallback, BreastShape, BreastShapeCallback, CalculateCallback,
+    ComfortableCallback, ConsentCallback, DataConsentCallback, Feedback, FeedbackCallback,
+    Method, MethodCallback, Priority, PriorityCallback, SkinTone, SkinToneCallback,
+    StartPhotoCallback,
+)
+
+# Подписи ответов квиза: одни и те же для кнопок и для сводки ответов
+COMFORTABLE_LABELS = {
+    Answer.yes.value: "👍 Да",
+    Answer.no.value: "👎 Нет",
+}
+SHAPE_LABELS = {
+    BreastShape.wide.value: "🔻 Широкая база",
+    BreastShape.narrow.value: "🔸 Узкая / объёмная",
+    BreastShape.low.value: "🔹 Низкий посад",
+    BreastShape.unknown.value: "❔ Не знаю",
+}
+TYPE_LABELS = {
+    BraType.bralette.value: "👙 Бралетт",
+    BraType.sport.value: "💪 Спортивный",
+    BraType.classic.value: "💎 Классический",
+    BraType.pushup.value: "🚀 Лёгкий push-up",
+}
+PRIORITY_LABELS = {
+    Priority.comfort.value: "☁️ Комфорт",
+    Priority.aesthetics.value: "👁 Эстетика",
+    Priority.support.value: "🤸‍♀️ Поддержка",
+}
+TONE_LABELS = {
+    SkinTone.light.value: "🌕 Светлый",
+    SkinTone.medium.value: "🏽 Средний",
+    SkinTone.dark.value: "🏿 Тёмный",
+}
+
+# id клавиатуры -> сама клавиатура; JSON считает PrebuiltMarkupSession
+PREBUILT_KEYBOARDS: Dict[int, InlineKeyboardMarkup] = {}
+
+
+def build_keyboard(buttons: Iterable[Tuple[str, str]]) -> InlineKeyboardMarkup:
+    """Клавиатура по кнопке в ряд; регистрируется для однократной сериализации"""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=callback_data)] for text, callback_data in buttons
+    ])
+    PREBUILT_KEYBOARDS[id(keyboard)] = keyboard
+    return keyboard
+
+
+CONSENT_KEYBOARD = build_keyboard([
+    ("✅ Да", ConsentCallback(answer=Answer.yes).pack()),
+    ("❌ Нет", ConsentCallback(answer=Answer.no).pack()),
+])
+DATA_CONSENT_KEYBOARD = build_keyboard([
+    ("✅ Согласен", DataConsentCallback(answer=Answer.yes).pack()),
+    ("❌ Отмена", DataConsentCallback(answer=Answer.no).pack()),
+])
+METHOD_KEYBOARD = build_keyboard([
+    ("📸 Фото-скан (точнее)", MethodCallback(method=Method.photo).pack()),
+    ("✏️ Квиз без фото", MethodCallback(method=Method.quiz).pack()),
+])
+START_PHOTO_KEYBOARD = build_keyboard([
+    ("📷 Сделать фото", StartPhotoCallback().pack()),
+])
+COMFORTABLE_KEYBOARD = build_keyboard(
+    (label, ComfortableCallback(answer=value).pack()) for value, label in COMFORTABLE_LABELS.items()
+)
+BREAST_SHAPE_KEYBOARD = build_keyboard(
+    (label, BreastShapeCallback(shape=value).pack()) for value, label in SHAPE_LABELS.items()
+)
+BRA_TYPE_KEYBOARD = build_keyboard(
+    (label, BraTypeCallback(bra_type=value).pack()) for value, label in TYPE_LABELS.items()
+)
+PRIORITY_KEYBOARD = build_keyboard(
+    (label, PriorityCallback(priority=value).pack()) for value, label in PRIORITY_LABELS.items()
+)
+SKIN_TONE_KEYBOARD = build_keyboard(
+    (label, SkinToneCallback(tone=value).pack()) for value, label in TONE_LABELS.items()
+)
+CALCULATE_KEYBOARD = build_keyboard([
+    ("🚀 Рассчитать", CalculateCallback().pack()),
+])
+# Фото-скан недоступен (предохранитель Bodygram разомкнут): сразу предлагаем квиз
+QUIZ_FALLBACK_KEYBOARD = build_keyboard([
+    ("✏️ Пройти квиз без фото", MethodCallback(method=Method.quiz).pack()),
+])
+FEEDBACK_KEYBOARD = build_keyboard([
+    ("✅ Подошло", FeedbackCallback(result=Feedback.good).pack()),
+    ("❌ Не подошло", FeedbackCallback(result=Feedback.bad).pack()),
+])
+
+# Шаблоны сообщений с подстановкой полей рекомендации
+SCAN_RESULT_TEMPLATE = (
+    "✔️ Ваш идеальный размер: **{size}**\n"
+    "Рекомендуемая модель:\n"
+    "• {model}\n"
+    "• Ссылка: [🛍️ Купить на WB]({link})\n"
+    "Точность: {confidence}"
+)
+SCAN_ALTERNATIVES_TEMPLATE = "\nНа границе размеров, примерьте также: {alternatives}"
+# Размера пользователя нет в каталоге: модель в ближайшем размере из наличия
+NEAREST_SIZE_MODEL_TEMPLATE = "{model} - в размере {stocked}: вашего пока нет в наличии, это ближайший"
+QUIZ_RESULT_TEMPLATE = (
+    "✔️ Рекомендуемый размер: **{size}**\n"
+    "Подойдёт модель:\n"
+    "• {model}\n"
+    "Ссылки: [WB]({link}) [Ozon]({ozon_link})"
+)
+MYFIT_TEMPLATE = (
+    "Ваша последняя рекомендация:\n\n"
+    "Размер: **{size}**\n"
+    "Модель: {model}\n"
+    "Ссылка: {link}"
+)
+
+# Сводка ответов квиза: ключ, шаблон строки, подписи значений
+QUIZ_SUMMARY_HEADER = "📋 Ваши ответы:\n\n"
+QUIZ_SUMMARY_LINES: Tuple[Tuple[str, str, Optional[Mapping[str, str]]], ...] = (
+    ('comfortable_bra', "• Есть ли комфортный бюстгальтер: {}\n", COMFORTABLE_LABELS),
+    ('current_size', "• Текущий размер: {}\n", None),
+    ('underbust', "• Обхват под грудью: {} см\n", None),
+    ('bust', "• Обхват груди: {} см\n", None),
+    ('breast_shape', "• Форма груди: {}\n", SHAPE_LABELS),
+    ('bra_type', "• Тип бюстгальтера: {}\n", TYPE_LABELS),
+    ('priority', "• Приоритет: {}\n", PRIORITY_LABELS),
+    ('skin_tone', "• Тон кожи: {}\n", TONE_LABELS),
+)
+
+
+def render_quiz_summary(quiz_data: Mapping[str, Any]) -> str:
+    """Сводка ответов квиза одной склейкой строк"""
+    parts = [QUIZ_SUMMARY_HEADER]
+    for key, template, labels in QUIZ_SUMMARY_LINES:
+        if key in quiz_data:
+            value = quiz_data[key]
+            parts.append(template.format(labels.get(value, value) if labels is not None else value))
+    return "".join(parts)
+
+
+class PrebuiltMarkupSession(AiohttpSession):
+    """Сессия, которая подставляет заранее сериализованный JSON готовых клавиатур"""
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        files: Dict[str, Any] = {}
+        self.serialized_markup: Dict[int, str] = {
+            key: self.prepare_value(keyboard, bot=None, files=files)
+            for key, keyboard in PREBUILT_KEYBOARDS.items()
+        }
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        markup = getattr(method, 'reply_markup', None)
+        serialized = self.serialized_markup.get(id(markup)) if markup is not None else None
+        if serialized is None:
+            return super().build_form_data(bot, method)
+        # Та же сборка формы, что в AiohttpSession, но без model_dump клавиатуры
+        form = FormData(quote_fields=False)
+        files: Dict[str, Any] = {}
+        for key, value in method.model_dump(warnings=False, exclude={'reply_markup'}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field('reply_markup', serialized)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
@@ -0,0 +1,135 @@
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from collections import deque
+from typing import Deque, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """Принимает апдейты от Telegram и обрабатывает их в фоне.
+
+    Ответ 200 уходит сразу после разбора апдейта, обработка идет в отдельной
+    задаче. Все такие задачи учитываются, чтобы при остановке их дождаться.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, *, secret_token: Optional[str] = None,
+                 latency_window: int = 10000):
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self.accepting = True
+        self._in_flight: Set[asyncio.Task] = set()
+        # Длительности последних обработок апдейтов, секунды
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        self.errors = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Число апдейтов в обработке"""
+        return len(self._in_flight)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=401)
+        if not self.accepting:
+            # Telegram повторит доставку, апдейт заберет другой экземпляр или этот после рестарта
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"Некорректный апдейт в вебхуке: {e}")
+            return web.Response(status=400)
+        task = asyncio.create_task(self._process(update))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return web.Response()
+
+    async def _process(self, update: Update) -> None:
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    async def drain(self, timeout: float) -> None:
+        """Перестает принимать апдейты и ждет завершения начатых"""
+        self.accepting = False
+        if not self._in_flight:
+            return
+        logging.info(f"Ждем завершения {self.in_flight} апдейтов")
+        _, pending = await asyncio.wait(set(self._in_flight), timeout=timeout)
+        if pending:
+            logging.warning(f"Не дождались {len(pending)} апдейтов за {timeout} с, отменяем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def create_webhook_app(handler: WebhookHandler, path: str) -> web.Application:
+    """Создает aiohttp-приложение с маршрутом вебхука"""
+    app = web.Application()
+    app.router.add_post(path, handler.handle)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    *,
+    host: str,
+    port: int,
+    path: str,
+    base_url: str,
+    secret_token: Optional[str] = None,
+    drain_timeout: float = 30.0,
+    close_bot_session: bool = True,
+) -> None:
+    """Регистрирует вебхук и обслуживает его до SIGINT/SIGTERM.
+
+    close_bot_session=False оставляет сессию бота открытой: ее закрывает
+    вызывающий, когда дождется фоновых задач, которые еще пишут в Telegram.
+    """
+    handler = WebhookHandler(dp, bot, secret_token=secret_token)
+    runner = web.AppRunner(create_webhook_app(handler, path))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка только через KeyboardInterrupt
+            pass
+
+    try:
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        await site.start()
+        await bot.set_webhook(
+            url=f"{base_url.rstrip('/')}{path}",
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info(f"Вебхук слушает {host}:{port}{path}")
+        await stop_event.wait()
+    finally:
+        logging.info("Останавливаем вебхук")
+        await handler.drain(drain_timeout)
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        if close_bot_session:
+            await bot.session.close()